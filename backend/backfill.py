@@ -0,0 +1,259 @@
+"""
+Import links from a Telegram chat export (result.json from Telegram Desktop)
+Streams the export, skips links already in the library, scrapes new ones in parallel
+and stores them through the same process_url/LinkSchema path as the webhook.
+Progress is checkpointed so an interrupted import can be resumed.
+
+Usage:
+    python backfill.py path/to/result.json [--concurrency 16] [--per-domain 2]
+                                           [--batch-size 200] [--checkpoint FILE] [--restart]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import close_database_connection  # noqa: E402
+from ingestion import build_link, enqueue_urls, filter_new_urls  # noqa: E402
+from link_writer import insert_links  # noqa: E402
+from scraper import process_url, extract_domain, close_http_client, shutdown_extraction_pool  # noqa: E402
+from urls import find_urls  # noqa: E402
+import tfidf  # noqa: E402
+
+MESSAGES_KEY = re.compile(r'"messages"\s*:\s*\[')
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_export_messages(path: str) -> Iterator[Dict]:
+    """
+    Yield message objects from a Telegram export without loading the whole file.
+    Works for single-chat exports and full account exports (every "messages" array is read).
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        in_array = False
+        eof = False
+
+        while True:
+            if not in_array:
+                match = MESSAGES_KEY.search(buf, pos)
+                if match:
+                    pos = match.end()
+                    in_array = True
+                    continue
+                if eof:
+                    return
+                # Keep a short unconsumed tail in case the key is split across chunks
+                chunk = f.read(CHUNK_SIZE)
+                buf = buf[max(pos, len(buf) - 32):] + chunk
+                pos = 0
+                eof = not chunk
+                continue
+
+            # Skip separators between array items
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                pos += 1
+                in_array = False
+                continue
+
+            if pos < len(buf):
+                try:
+                    message, pos = decoder.raw_decode(buf, pos)
+                    yield message
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof:
+                return
+
+            # Need more data to finish the current item
+            chunk = f.read(CHUNK_SIZE)
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = not chunk
+
+
+def message_urls(message: Dict) -> List[str]:
+    """Collect URLs from a message's text, link entities and hidden text links"""
+    parts = []
+    text = message.get("text", "")
+    if isinstance(text, str):
+        parts.append(text)
+    else:
+        for item in text:
+            if isinstance(item, str):
+                parts.append(item)
+            elif isinstance(item, dict):
+                parts.append(item.get("href") or item.get("text") or "")
+
+    urls = []
+    for url in find_urls(" ".join(parts)):
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def message_date(message: Dict) -> Optional[datetime]:
+    try:
+        if message.get("date_unixtime"):
+            return datetime.utcfromtimestamp(int(message["date_unixtime"]))
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def load_checkpoint(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, checkpoint: Dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class DomainLimiter:
+    """Per-domain semaphores so one host is never hit by more than `limit` concurrent fetches"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def for_url(self, url: str) -> asyncio.Semaphore:
+        domain = extract_domain(url)
+        if domain not in self._semaphores:
+            self._semaphores[domain] = asyncio.Semaphore(self.limit)
+        return self._semaphores[domain]
+
+
+async def scrape_batch(batch: List[Tuple[str, Optional[datetime]]], slots: asyncio.Semaphore,
+                       domains: DomainLimiter) -> Tuple[List[Dict], List[str]]:
+    """
+    Scrape a batch of (url, message date) pairs concurrently and build link documents.
+    URLs whose host is temporarily failing are returned separately instead of as error links.
+    """
+
+    async def scrape(url: str, date: Optional[datetime]) -> Optional[Dict]:
+        async with domains.for_url(url):
+            async with slots:
+                metadata = await process_url(url)
+        if metadata.get("retryable"):
+            return None
+        doc = build_link(url, metadata, source="telegram").dict()
+        if date:
+            # Keep the original sharing date so the library timeline matches the chat;
+            # updated_at is stamped by insert_links when the batch is written, so the
+            # server's index sync still picks the link up
+            doc["created_at"] = date
+        return doc
+
+    results = await asyncio.gather(*(scrape(url, date) for url, date in batch))
+    docs = [doc for doc in results if doc is not None]
+    retry_urls = [url for (url, _), doc in zip(batch, results) if doc is None]
+    return docs, retry_urls
+
+
+async def run_backfill(args):
+    checkpoint = {} if args.restart else load_checkpoint(args.checkpoint)
+    # Position in the export stream (message IDs restart per chat in full-account exports)
+    messages_done = checkpoint.get("messages_done", 0)
+    stats = {
+        "inserted": checkpoint.get("inserted", 0),
+        "duplicates": checkpoint.get("duplicates", 0),
+        "failed": checkpoint.get("failed", 0),
+        "retry_queued": checkpoint.get("retry_queued", 0)
+    }
+    if messages_done:
+        print(f"⏩ Resuming after {messages_done} messages ({stats['inserted']} links imported so far)")
+
+    slots = asyncio.Semaphore(args.concurrency)
+    domains = DomainLimiter(args.per_domain)
+    started = time.monotonic()
+    processed = 0
+
+    async def flush(batch: List[Tuple[str, Optional[datetime]]], position: int):
+        nonlocal processed
+        new_urls = set(await filter_new_urls([url for url, _ in batch]))
+        todo = []
+        for url, date in batch:
+            if url in new_urls:
+                todo.append((url, date))
+                new_urls.discard(url)  # Same link shared twice within the batch
+        stats["duplicates"] += len(batch) - len(todo)
+
+        docs, retry_urls = await scrape_batch(todo, slots, domains)
+        # Hosts that are down get another chance from the server's ingestion queue
+        stats["retry_queued"] += len(await enqueue_urls(retry_urls, source="telegram"))
+        for result in await insert_links(docs):
+            if result.ok:
+                stats["inserted"] += 1
+            elif result.duplicate:
+                stats["duplicates"] += 1
+            else:
+                stats["failed"] += 1
+
+        processed += len(batch)
+        save_checkpoint(args.checkpoint, {"messages_done": position, **stats, "updated_at": datetime.utcnow().isoformat()})
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(
+            f"📥 {processed} links read | {stats['inserted']} imported | {stats['duplicates']} duplicates | "
+            f"{stats['failed']} failed | {stats['retry_queued']} queued for retry | {processed / elapsed:.1f} links/s | {position} messages done"
+        )
+
+    batch: List[Tuple[str, Optional[datetime]]] = []
+    position = 0
+    for message in iter_export_messages(args.export):
+        position += 1
+        if position <= messages_done or message.get("type") != "message":
+            continue
+        date = message_date(message)
+        batch.extend((url, date) for url in message_urls(message))
+        if len(batch) >= args.batch_size:
+            await flush(batch, position)
+            batch = []
+
+    if batch or position > messages_done:
+        await flush(batch, position)
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Backfill complete: {stats['inserted']} imported, {stats['duplicates']} duplicates, "
+          f"{stats['failed']} failed, {stats['retry_queued']} queued for retry in {elapsed:.0f}s")
+
+
+async def main(args):
+    try:
+        await tfidf.load_model()
+        await run_backfill(args)
+    finally:
+        await tfidf.flush_model()
+        await close_http_client()
+        shutdown_extraction_pool()
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import links from a Telegram chat export")
+    parser.add_argument("export", help="Path to the Telegram export result.json")
+    parser.add_argument("--concurrency", type=int, default=16, help="Pages scraped at once")
+    parser.add_argument("--per-domain", type=int, default=2, help="Concurrent fetches per host")
+    parser.add_argument("--batch-size", type=int, default=200, help="Links per dedupe/insert batch and checkpoint")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json", help="Checkpoint file used to resume")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    asyncio.run(main(parser.parse_args()))
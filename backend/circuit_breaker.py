@@ -0,0 +1,135 @@
+"""
+Per-domain circuit breaker and negative cache for page fetches
+Consecutive transient failures (timeouts, connection errors, 429/5xx) against a host open
+its circuit: further fetches fail fast instead of waiting for the timeout. After a cooldown
+one probe request is let through; success closes the circuit, failure re-opens it with a
+longer cooldown. URLs that failed recently are also remembered (for NEGATIVE_CACHE_TTL
+seconds, or one cooldown for transient failures) so repeats don't hit the network.
+State is per process, like the update store.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive failures that open a circuit
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "60"))  # First open period, doubled per re-open
+BREAKER_MAX_COOLDOWN_SECONDS = float(os.getenv("BREAKER_MAX_COOLDOWN_SECONDS", "1800"))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "900"))  # Seconds a failed URL is not re-fetched
+NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", "10000"))
+
+
+@dataclass
+class DomainState:
+    failures: int = 0  # Consecutive transient failures
+    trips: int = 0  # Times the circuit opened without a success in between
+    open_until: float = 0.0
+    probe_until: float = 0.0  # A half-open probe request is in flight until it reports back (or this passes)
+
+
+@dataclass
+class NegativeEntry:
+    expires_at: float
+    reason: str
+    retryable: bool
+
+
+_domains: Dict[str, DomainState] = {}
+# canonical URL -> entry, oldest first
+_failed_urls: "OrderedDict[str, NegativeEntry]" = OrderedDict()
+
+
+def _domain(canonical_url: str) -> str:
+    return urlsplit(canonical_url).netloc
+
+
+def _expire_negative(now: float):
+    while _failed_urls:
+        entry = next(iter(_failed_urls.values()))
+        if entry.expires_at > now and len(_failed_urls) <= NEGATIVE_CACHE_SIZE:
+            break
+        _failed_urls.popitem(last=False)
+
+
+def check(url: str) -> Optional[Tuple[str, bool]]:
+    """
+    Return (reason, retryable) if the fetch should fail fast, or None to go ahead.
+    A closed circuit, or an expired open one without a probe in flight, lets the request through.
+    """
+    now = time.monotonic()
+    _expire_negative(now)
+    key = canonicalize_url(url)
+    entry = _failed_urls.get(key)
+    if entry is not None and entry.expires_at > now:
+        return f"Recently failed: {entry.reason}", entry.retryable
+
+    domain = _domain(key)
+    state = _domains.get(domain)
+    if state is None or not state.open_until:
+        return None
+    if now < state.open_until:
+        return f"{domain} is failing; retrying in {state.open_until - now:.0f}s", True
+    if now < state.probe_until:
+        return f"{domain} is failing; waiting for a probe request", True
+    state.probe_until = now + BREAKER_COOLDOWN_SECONDS  # Half-open: this request is the probe
+    return None
+
+
+def record_success(url: str):
+    key = canonicalize_url(url)
+    domain = _domain(key)
+    state = _domains.pop(domain, None)
+    if state is not None and state.open_until:
+        logger.info(f"🟢 Circuit closed for {domain}")
+    _failed_urls.pop(key, None)
+
+
+def record_failure(url: str, reason: str, retryable: bool):
+    """Remember a failed URL; transient failures also count against the host"""
+    now = time.monotonic()
+    key = canonicalize_url(url)
+    _failed_urls.pop(key, None)
+    ttl = min(NEGATIVE_CACHE_TTL, BREAKER_COOLDOWN_SECONDS) if retryable else NEGATIVE_CACHE_TTL
+    _failed_urls[key] = NegativeEntry(now + ttl, reason, retryable)
+    _expire_negative(now)
+
+    domain = _domain(key)
+    if not retryable:
+        # The host answered (e.g. 404 or a PDF); it is healthy even if this URL isn't
+        _domains.pop(domain, None)
+        return
+
+    state = _domains.setdefault(domain, DomainState())
+    state.failures += 1
+    if state.probe_until or state.failures >= BREAKER_FAILURE_THRESHOLD:
+        cooldown = min(BREAKER_COOLDOWN_SECONDS * (2 ** state.trips), BREAKER_MAX_COOLDOWN_SECONDS)
+        state.open_until = now + cooldown
+        state.trips += 1
+        state.probe_until = 0.0
+        logger.warning(f"🔴 Circuit open for {domain} for {cooldown:.0f}s after {state.failures} failures ({reason})")
+
+
+def forget(url: str):
+    """Drop a URL from the negative cache so an explicit retry fetches it (its host's circuit still applies)"""
+    _failed_urls.pop(canonicalize_url(url), None)
+
+
+def retry_after(url: str) -> float:
+    """Seconds until a fetch of this URL would be attempted again (0 if it would go ahead now)"""
+    now = time.monotonic()
+    wait = 0.0
+    key = canonicalize_url(url)
+    entry = _failed_urls.get(key)
+    if entry is not None:
+        wait = entry.expires_at - now
+    state = _domains.get(_domain(key))
+    if state is not None and state.open_until:
+        wait = max(wait, state.open_until - now)
+    return max(wait, 0.0)
+
@@ -0,0 +1,7 @@
+"""
+Test defaults: modules that import database.py need these settings (no server is contacted)
+"""
+import os
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "linkvault_test")
@@ -0,0 +1,77 @@
+"""
+Cached link counts
+Counting the matches of a filter makes MongoDB walk every matching index entry (or,
+for a prefix search, every search term), so a list call that counts does the work of
+its query twice. Counts are kept for COUNT_CACHE_TTL seconds, keyed by the normalized
+filter, and dropped whenever links are added, changed or removed; the TTL only bounds
+staleness from writes made by other processes. The unfiltered total comes from the
+collection metadata (estimated_document_count) without counting at all.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+from database import collection
+
+logger = logging.getLogger(__name__)
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "30"))  # Seconds a count is reused
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", "1000"))
+
+# filter key -> (expiry timestamp, count), least recently used first
+_counts: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+_pending: Dict[str, asyncio.Future] = {}  # Counts in flight, shared by concurrent callers
+_generation = 0  # Bumped by every invalidation so counts started before it aren't cached
+
+
+def _key(query: Dict) -> str:
+    """Same string for the same filter, whatever order its keys were added in"""
+    return json.dumps(query, sort_keys=True, default=repr)
+
+
+async def count_links(query: Dict) -> int:
+    """Number of links matching a filter, from the cache when it's fresh"""
+    if not query:
+        return await collection.estimated_document_count()
+    key = _key(query)
+    entry = _counts.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _counts.move_to_end(key)
+        return entry[1]
+    pending = _pending.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _pending[key] = future
+    generation = _generation
+    try:
+        total = await collection.count_documents(query)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Retrieved here so waiter-less failures aren't logged as unhandled
+        raise
+    finally:
+        if _pending.get(key) is future:
+            del _pending[key]
+    future.set_result(total)
+    if generation == _generation and COUNT_CACHE_TTL > 0:
+        _counts[key] = (time.monotonic() + COUNT_CACHE_TTL, total)
+        _counts.move_to_end(key)
+        while len(_counts) > COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return total
+
+
+def invalidate_counts():
+    """Forget every cached count (call after writes that add, change or remove links)"""
+    global _generation
+    _generation += 1
+    _counts.clear()
+    _pending.clear()  # Counts in flight may predate the write; later callers start their own
@@ -0,0 +1,342 @@
+"""
+Bounded crawler that follows a page's nested_links
+A crawl starts from one URL (typically a curated reading list), scrapes it and then
+treats its nested_links as a frontier: pages are scraped breadth-first up to a depth
+and page budget, each becoming a regular library entry. Discovered links are checked
+against robots.txt (cached per host) and fetches to the same host are spaced out.
+Workers share one visited set of canonical URLs, so every page is scraped once per crawl.
+Crawl state and progress live in the crawl_jobs collection.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+from bson import ObjectId
+from database import crawl_collection
+from ingestion import INGEST_STALE_AFTER_MINUTES, build_link, filter_new_urls
+from link_writer import LinkBatchWriter
+from scraper import SCRAPER_USER_AGENT, extract_domain, get_http_client, process_url
+from urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "2"))  # Upper bound for a crawl's max_depth
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "200"))  # Upper bound for a crawl's page budget
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))  # Pages scraped at once per crawl
+CRAWL_DOMAIN_DELAY = float(os.getenv("CRAWL_DOMAIN_DELAY", "1.0"))  # Seconds between requests to one host
+CRAWL_ROBOTS_TTL = int(os.getenv("CRAWL_ROBOTS_TTL", "3600"))  # Seconds a robots.txt is cached
+ROBOTS_CACHE_SIZE = 1000
+MAX_CRAWL_DELAY = 30.0  # Ignore absurd Crawl-delay values
+
+CRAWL_RUNNING = "running"
+CRAWL_COMPLETED = "completed"
+CRAWL_FAILED = "failed"
+CRAWL_CANCELLED = "cancelled"
+
+# Links that point at files rather than pages (they would only burn the page budget)
+SKIPPED_EXTENSIONS = re.compile(
+    r"\.(?:png|jpe?g|gif|svg|webp|ico|css|js|zip|tar|gz|tgz|rar|7z|exe|dmg|iso|mp3|mp4|mov|avi|woff2?)$",
+    re.IGNORECASE
+)
+
+_crawl_tasks: Dict[str, asyncio.Task] = {}
+
+
+class RobotsCache:
+    """robots.txt rules per host, fetched once and kept for CRAWL_ROBOTS_TTL seconds"""
+
+    def __init__(self, ttl: int = CRAWL_ROBOTS_TTL, max_size: int = ROBOTS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._parsers: "OrderedDict[str, Tuple[float, RobotFileParser]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def _fetch(self, origin: str) -> RobotFileParser:
+        parser = RobotFileParser(f"{origin}/robots.txt")
+        try:
+            response = await get_http_client().get(f"{origin}/robots.txt")
+            if response.status_code == 200:
+                parser.parse(response.text.splitlines())
+            elif 400 <= response.status_code < 500:
+                parser.allow_all = True  # No robots.txt: everything is allowed
+            else:
+                parser.disallow_all = True  # Server errors: assume the site doesn't want crawling
+        except Exception as e:
+            logger.info(f"Could not fetch robots.txt for {origin}: {e}")
+            parser.disallow_all = True
+        return parser
+
+    async def get(self, url: str) -> RobotFileParser:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}".lower()
+        cached = self._parsers.get(origin)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self._parsers.move_to_end(origin)
+            return cached[1]
+
+        # Concurrent workers hitting the same new host share one robots.txt request
+        if origin in self._pending:
+            return await asyncio.shield(self._pending[origin])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[origin] = future
+        try:
+            parser = await self._fetch(origin)
+            future.set_result(parser)
+        finally:
+            del self._pending[origin]
+            if not future.done():
+                future.cancel()
+
+        self._parsers[origin] = (time.monotonic(), parser)
+        self._parsers.move_to_end(origin)
+        while len(self._parsers) > self.max_size:
+            self._parsers.popitem(last=False)
+        return parser
+
+    async def can_fetch(self, url: str) -> Tuple[bool, Optional[float]]:
+        """Return whether the URL may be crawled and the host's Crawl-delay (if any)"""
+        parser = await self.get(url)
+        delay = parser.crawl_delay(SCRAPER_USER_AGENT)
+        return parser.can_fetch(SCRAPER_USER_AGENT, url), float(delay) if delay else None
+
+
+class DomainThrottle:
+    """Spaces out requests to the same host across all running crawls"""
+
+    def __init__(self, delay: float = CRAWL_DOMAIN_DELAY):
+        self.delay = delay
+        self._next_slot: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def wait(self, domain: str, delay: Optional[float] = None):
+        delay = min(max(self.delay, delay or 0.0), MAX_CRAWL_DELAY)
+        lock = self._locks.setdefault(domain, asyncio.Lock())
+        async with lock:
+            wait = self._next_slot.get(domain, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_slot[domain] = time.monotonic() + delay
+
+
+_robots = RobotsCache()
+_throttle = DomainThrottle()
+
+
+def crawlable_links(links: List[str]) -> List[str]:
+    """Clean up nested_links into fetchable page URLs"""
+    result = []
+    for link in links or []:
+        link = link.strip().split("#")[0].rstrip(".,;:!?)]}'\"")
+        if link.startswith("www."):
+            link = f"https://{link}"
+        if not link.startswith(("http://", "https://")):
+            continue
+        if SKIPPED_EXTENSIONS.search(urlsplit(link).path):
+            continue
+        result.append(link)
+    return result
+
+
+def serialize_crawl(crawl: Dict, include_links: bool = True) -> Dict:
+    """
+    Convert a crawl job document into a JSON-friendly dict. Lists leave out link_ids
+    (list_crawls doesn't load them; pages_saved is their count).
+    """
+    serialized = {
+        "id": str(crawl["_id"]),
+        "url": crawl["url"],
+        "status": crawl["status"],
+        "max_depth": crawl["max_depth"],
+        "max_pages": crawl["max_pages"],
+        "pages_scraped": crawl.get("pages_scraped", 0),
+        "pages_saved": crawl.get("pages_saved", 0),
+        "pages_known": crawl.get("pages_known", 0),
+        "pages_blocked": crawl.get("pages_blocked", 0),
+        "pages_failed": crawl.get("pages_failed", 0),
+        "frontier": crawl.get("frontier", 0),
+        "error": crawl.get("error"),
+        "created_at": crawl.get("created_at"),
+        "updated_at": crawl.get("updated_at"),
+        "finished_at": crawl.get("finished_at")
+    }
+    if include_links:
+        serialized["link_ids"] = crawl.get("link_ids", [])
+    return serialized
+
+
+class Crawl:
+    """One bounded breadth-first crawl from a seed URL"""
+
+    def __init__(self, crawl_id: ObjectId, url: str, max_depth: int, max_pages: int):
+        self.crawl_id = crawl_id
+        self.url = url
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.frontier: asyncio.Queue = asyncio.Queue()
+        self.visited: Set[str] = set()
+        self.pages_started = 0
+        self.stats = {"pages_scraped": 0, "pages_saved": 0, "pages_known": 0, "pages_blocked": 0, "pages_failed": 0}
+        self.writer = LinkBatchWriter()
+
+    def _budget_left(self) -> bool:
+        return self.pages_started < self.max_pages
+
+    async def _save_progress(self, link_id: Optional[str] = None):
+        update = {"$set": {**self.stats, "frontier": self.frontier.qsize(), "updated_at": datetime.utcnow()}}
+        if link_id:
+            update["$push"] = {"link_ids": link_id}
+        await crawl_collection.update_one({"_id": self.crawl_id}, update)
+
+    async def _expand(self, links: List[str], depth: int):
+        """Queue unseen nested links that are not in the library yet"""
+        candidates = []
+        for link in crawlable_links(links):
+            canonical_url = canonicalize_url(link)
+            if canonical_url not in self.visited:
+                self.visited.add(canonical_url)
+                candidates.append(link)
+        if not candidates:
+            return
+        new_urls = await filter_new_urls(candidates)
+        self.stats["pages_known"] += len(candidates) - len(new_urls)
+        for link in new_urls:
+            self.frontier.put_nowait((link, depth))
+
+    async def _crawl_page(self, url: str, depth: int):
+        domain = extract_domain(url)
+        if depth > 0:
+            # The seed was submitted by the user; discovered links have to respect robots.txt
+            allowed, crawl_delay = await _robots.can_fetch(url)
+            if not allowed:
+                self.stats["pages_blocked"] += 1
+                logger.info(f"🤖 robots.txt disallows {url}")
+                return
+        else:
+            crawl_delay = None
+        if not self._budget_left():
+            return
+        self.pages_started += 1
+
+        await _throttle.wait(domain, crawl_delay)
+        metadata = await process_url(url)
+        self.stats["pages_scraped"] += 1
+        if "Error" in metadata.get("tags", []):
+            self.stats["pages_failed"] += 1
+            logger.warning(f"❌ Crawl could not scrape {url}: {metadata.get('summary')}")
+            await self._save_progress()
+            return
+
+        link_id = None
+        outcome = await self.writer.add(build_link(url, metadata, source="crawl").dict())
+        if outcome.ok:
+            self.stats["pages_saved"] += 1
+            link_id = str(outcome.inserted_id)
+        elif outcome.duplicate:
+            self.stats["pages_known"] += 1
+
+        if depth < self.max_depth and self._budget_left():
+            await self._expand(metadata.get("nested_links", []), depth + 1)
+        await self._save_progress(link_id)
+
+    async def _worker(self):
+        while True:
+            url, depth = await self.frontier.get()
+            try:
+                if self._budget_left():
+                    await self._crawl_page(url, depth)
+            except Exception as e:
+                self.stats["pages_failed"] += 1
+                logger.error(f"Error crawling {url}: {e}", exc_info=True)
+            finally:
+                self.frontier.task_done()
+
+    async def run(self):
+        self.visited.add(canonicalize_url(self.url))
+        self.frontier.put_nowait((self.url, 0))
+        workers = [asyncio.create_task(self._worker()) for _ in range(CRAWL_CONCURRENCY)]
+        try:
+            await self.frontier.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.writer.close()
+
+
+async def _run_crawl(crawl: Crawl):
+    status, error = CRAWL_COMPLETED, None
+    try:
+        await crawl.run()
+        logger.info(
+            f"🕸️ Crawl of {crawl.url} finished: {crawl.stats['pages_saved']} saved, "
+            f"{crawl.stats['pages_known']} already known, {crawl.stats['pages_blocked']} blocked by robots.txt"
+        )
+    except asyncio.CancelledError:
+        status = CRAWL_CANCELLED
+        raise
+    except Exception as e:
+        status, error = CRAWL_FAILED, str(e)
+        logger.error(f"Crawl of {crawl.url} failed: {e}", exc_info=True)
+    finally:
+        now = datetime.utcnow()
+        await crawl_collection.update_one(
+            {"_id": crawl.crawl_id},
+            {"$set": {**crawl.stats, "status": status, "error": error, "frontier": 0, "updated_at": now, "finished_at": now}}
+        )
+        _crawl_tasks.pop(str(crawl.crawl_id), None)
+
+
+async def start_crawl(url: str, max_depth: int = 1, max_pages: int = 50) -> str:
+    """Record a crawl job and run it in the background; returns the crawl ID"""
+    max_depth = max(0, min(max_depth, CRAWL_MAX_DEPTH))
+    max_pages = max(1, min(max_pages, CRAWL_MAX_PAGES))
+    now = datetime.utcnow()
+    result = await crawl_collection.insert_one({
+        "url": url,
+        "canonical_url": canonicalize_url(url),
+        "status": CRAWL_RUNNING,
+        "max_depth": max_depth,
+        "max_pages": max_pages,
+        "link_ids": [],
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    })
+    crawl_id = str(result.inserted_id)
+    _crawl_tasks[crawl_id] = asyncio.create_task(_run_crawl(Crawl(result.inserted_id, url, max_depth, max_pages)))
+    logger.info(f"🕸️ Started crawl {crawl_id} from {url} (depth {max_depth}, up to {max_pages} pages)")
+    return crawl_id
+
+
+async def get_crawl(crawl_id: str) -> Optional[Dict]:
+    return await crawl_collection.find_one({"_id": ObjectId(crawl_id)})
+
+
+async def list_crawls(limit: int = 20) -> List[Dict]:
+    cursor = crawl_collection.find({}, {"link_ids": 0}).sort("created_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def mark_interrupted_crawls():
+    """Crawls whose process died stop reporting progress; mark them cancelled (they can't resume)"""
+    cutoff = datetime.utcnow() - timedelta(minutes=INGEST_STALE_AFTER_MINUTES)
+    result = await crawl_collection.update_many(
+        {"status": CRAWL_RUNNING, "updated_at": {"$lt": cutoff}},
+        {"$set": {"status": CRAWL_CANCELLED, "error": "Interrupted by a restart", "updated_at": datetime.utcnow()}}
+    )
+    if result.modified_count:
+        logger.info(f"Marked {result.modified_count} interrupted crawls as cancelled")
+
+
+async def stop_crawls():
+    """Cancel running crawls (call from the app lifespan)"""
+    tasks = list(_crawl_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -4,6 +4,7 @@ import ssl
 import certifi
 from dotenv import load_dotenv
 import logging
+from pymongo import ASCENDING, DESCENDING, TEXT
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -54,6 +55,14 @@ client = get_mongodb_client()
 db = client[os.getenv("DB_NAME")]
 collection = db.get_collection("links")
 users_collection = db.get_collection("users")
+jobs_collection = db.get_collection("ingest_jobs")  # Background ingestion queue
+updates_collection = db.get_collection("telegram_updates")  # Processed Telegram update_ids
+crawl_collection = db.get_collection("crawl_jobs")  # Nested-link crawls and their progress
+models_collection = db.get_collection("models")  # Corpus statistics (TF-IDF model)
+signatures_collection = db.get_collection("link_signatures")  # MinHash signatures for near-duplicate detection
+
+# How long processed Telegram update_ids are remembered (Telegram stops redelivering well before this)
+TELEGRAM_UPDATE_TTL_SECONDS = int(os.getenv("TELEGRAM_UPDATE_TTL_SECONDS", "86400"))
 
 # Async lifecycle management
 async def connect_to_database():
@@ -65,6 +74,37 @@ async def connect_to_database():
         logger.warning(f"Failed to connect to MongoDB: {e}")
         logger.warning("App will start but database operations will fail until connection is fixed")
 
+async def ensure_indexes():
+    """Create indexes needed by background jobs and deduplication (idempotent, safe to run on every startup)"""
+    try:
+        await jobs_collection.create_index([("status", 1), ("created_at", 1)])
+        await jobs_collection.create_index([("canonical_url", ASCENDING), ("status", ASCENDING)])
+        await crawl_collection.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+        await updates_collection.create_index("created_at", expireAfterSeconds=TELEGRAM_UPDATE_TTL_SECONDS)
+        await collection.create_index([("last_fetched_at", ASCENDING)])  # Refresher picks the oldest snapshots first
+        await collection.create_index([("updated_at", ASCENDING)])  # Search index and embeddings sync recent changes
+        # Newest-first listing and its keyset pagination (see pagination.py)
+        await collection.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+        # Unique only where the field is set, so legacy documents without it don't collide on null
+        await collection.create_index(
+            "canonical_url",
+            unique=True,
+            partialFilterExpression={"canonical_url": {"$type": "string"}}
+        )
+        # Full-text search (see search.py): relevance is weighted title > summary > content
+        await collection.create_index("search_terms")
+        await collection.create_index(
+            [("title", TEXT), ("summary", TEXT), ("content", TEXT)],
+            weights={"title": 10, "summary": 5, "content": 1},
+            name="links_text",
+            default_language="english"
+        )
+        # Near-duplicate candidates are found through shared LSH bucket keys (see near_duplicates.py)
+        await signatures_collection.create_index("buckets")
+        logger.info("Database indexes verified")
+    except Exception as e:
+        logger.warning(f"Failed to create indexes: {e}")
+
 async def close_database_connection():
     """Close database connections gracefully on shutdown"""
     try:
@@ -0,0 +1,597 @@
+"""
+Semantic embeddings for related links and semantic search
+Links are embedded locally on the CPU with latent semantic analysis: their hashed TF-IDF
+vectors (see tfidf.py) are projected onto the top singular vectors of a sample of the
+library, computed with a randomized SVD. No external API or model download is involved.
+
+The vectors are stored in a memory-mapped NumPy matrix, grouped by the cell of an IVF
+index (spherical k-means centroids), so a lookup only scores the links in the few cells
+closest to the query. Lookups made at the same time are answered as one batch that
+scores the cell centroids and the recent links with one matrix product each. New and changed links are embedded into a small in-memory delta that is
+merged into a new on-disk generation in the background, like the BM25 index
+(search_index.py); changes made by other workers are picked up from `updated_at`. As
+there, only the worker holding the directory's writer lock builds and merges
+generations, and the other workers load each one it publishes.
+
+Usage (fit the projection on the library and embed every link; running workers load it):
+    python embeddings.py
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from bson import ObjectId
+from scipy import sparse
+from database import collection, close_database_connection
+from search_index import (
+    SYNC_OVERLAP, claim_writer, commit_generation, is_writer, read_manifest, release_writer, save_array
+)
+from tfidf import TFIDF_DIM, DocTerms, TfidfModel, iter_batches, link_text, spherical_kmeans
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "false").lower() in ("1", "true", "yes")
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embeddings"))
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "128"))  # LSA dimensions
+EMBEDDING_VOCAB = int(os.getenv("EMBEDDING_VOCAB", "30000"))  # Most common term buckets kept by the projection
+EMBEDDING_FIT_SAMPLE = int(os.getenv("EMBEDDING_FIT_SAMPLE", "20000"))  # Links used to fit the projection and cells
+EMBEDDING_NPROBE = int(os.getenv("EMBEDDING_NPROBE", "8"))  # IVF cells scanned per lookup
+EMBEDDING_SYNC_INTERVAL = float(os.getenv("EMBEDDING_SYNC_INTERVAL", "60"))  # Seconds between syncs/saves
+
+SEMANTIC_MAX_RESULTS = 200  # Nearest links considered per semantic search
+MAX_DELTA_VECTORS = 2000  # Merge the in-memory delta into a new generation beyond this
+SVD_OVERSAMPLING = 10
+SVD_POWER_ITERATIONS = 4
+ASSIGN_CHUNK = 16384  # Vectors assigned to cells per matrix product
+MAX_BUILD_BACKOFF = 3600  # Seconds; retries of a build that had too few links to fit back off up to this
+EMBED_PROJECTION = {"title": 1, "summary": 1, "content": 1, "tags": 1}
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def randomized_svd(matrix: sparse.csr_matrix, k: int, seed: int = 0) -> np.ndarray:
+    """Top-k right singular vectors (k x columns) of a sparse matrix (Halko et al.)"""
+    rng = np.random.default_rng(seed)
+    k = min(k, *matrix.shape)
+    basis = matrix @ rng.standard_normal((matrix.shape[1], k + SVD_OVERSAMPLING), dtype=np.float32)
+    for _ in range(SVD_POWER_ITERATIONS):
+        basis, _ = np.linalg.qr(basis)
+        projected, _ = np.linalg.qr(matrix.T @ basis)
+        basis = matrix @ projected
+    basis, _ = np.linalg.qr(basis)
+    _, _, vt = np.linalg.svd((matrix.T @ basis).T, full_matrices=False)
+    return vt[:k]
+
+
+@dataclass
+class LsaModel:
+    buckets: np.ndarray  # Term hash buckets kept (sorted)
+    idf: np.ndarray  # Their idf over the fitting sample
+    components: np.ndarray  # len(buckets) x dimensions
+
+    def __post_init__(self):
+        self.column_of = np.full(TFIDF_DIM, -1, dtype=np.int32)
+        self.column_of[self.buckets] = np.arange(len(self.buckets), dtype=np.int32)
+
+    @property
+    def dimensions(self) -> int:
+        return self.components.shape[1]
+
+    def matrix(self, docs: Sequence[DocTerms]) -> sparse.csr_matrix:
+        """Sublinear tf x idf over the kept buckets, L2-normalized rows"""
+        columns = [self.column_of[doc.buckets] for doc in docs]
+        kept = [c >= 0 for c in columns]
+        indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([int(k.sum()) for k in kept])
+        indices = np.concatenate([c[k] for c, k in zip(columns, kept)]) if docs else np.zeros(0, dtype=np.int32)
+        data = np.concatenate([doc.counts[k] for doc, k in zip(docs, kept)]) if docs else np.zeros(0, dtype=np.float32)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(docs), len(self.buckets)))
+        matrix.sum_duplicates()
+        matrix.data = (1.0 + np.log(matrix.data)) * self.idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ matrix
+
+    def embed(self, docs: Sequence[DocTerms]) -> np.ndarray:
+        """Unit vectors (len(docs) x dimensions); documents without known terms get zeros"""
+        return normalize_rows(np.asarray(self.matrix(docs) @ self.components))
+
+    @classmethod
+    def fit(cls, docs: Sequence[DocTerms], dimensions: int = EMBEDDING_DIM, vocab: int = EMBEDDING_VOCAB) -> Optional["LsaModel"]:
+        """Fit the projection on a sample; None if the sample has too few terms"""
+        counts = TfidfModel().counts(docs)
+        df = np.bincount(counts.indices, minlength=TFIDF_DIM)
+        # Terms seen in a single document only add noise, unless the sample is tiny
+        candidates = np.flatnonzero(df >= 2)
+        if len(candidates) < dimensions:
+            candidates = np.flatnonzero(df)
+        if len(docs) < 2 or len(candidates) < 2:
+            return None
+        buckets = np.sort(candidates[np.argsort(-df[candidates], kind="stable")[:vocab]])
+        idf = (np.log((1.0 + len(docs)) / (1.0 + df[buckets])) + 1.0).astype(np.float32)
+        model = cls(buckets, idf, np.zeros((len(buckets), 0), dtype=np.float32))
+        model.components = np.ascontiguousarray(randomized_svd(model.matrix(docs), dimensions).T, dtype=np.float32)
+        return model
+
+
+def embed_documents(model: LsaModel, docs: Sequence[Dict]) -> np.ndarray:
+    return model.embed([DocTerms.from_text(link_text(doc)) for doc in docs])
+
+
+def fit_cells(vectors: np.ndarray) -> np.ndarray:
+    """IVF centroids: about sqrt(n) spherical k-means cells fitted on a sample"""
+    if not len(vectors):
+        return np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    n_cells = max(1, int(math.sqrt(len(vectors))))
+    if len(vectors) > EMBEDDING_FIT_SAMPLE:
+        vectors = vectors[np.sort(np.random.default_rng(0).choice(len(vectors), EMBEDDING_FIT_SAMPLE, replace=False))]
+    return spherical_kmeans(np.asarray(vectors), n_cells).astype(np.float32)
+
+
+def assign_cells(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    cells = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        cells[start:start + ASSIGN_CHUNK] = (vectors[start:start + ASSIGN_CHUNK] @ centroids.T).argmax(axis=1)
+    return cells
+
+
+def write_generation(directory: str, generation: int, model: LsaModel, vectors: np.ndarray, ids: List[str], centroids: np.ndarray):
+    """Group the vectors by IVF cell and write them with the projection as generation files"""
+    # Re-fit the cells once the library has outgrown them (sqrt(n) cells for n links)
+    if len(vectors) and (not len(centroids) or 4 * len(centroids) ** 2 < len(vectors)):
+        centroids = fit_cells(vectors)
+    cells = assign_cells(vectors, centroids)
+    order = np.argsort(cells, kind="stable")
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(cells, minlength=len(centroids)))
+
+    prefix = os.path.join(directory, f"{generation}")
+    save_array(f"{prefix}.vectors.npy", np.ascontiguousarray(vectors[order], dtype=np.float32))
+    save_array(f"{prefix}.ids.npy", np.frombuffer(b"".join(ObjectId(ids[i]).binary for i in order), dtype=np.uint8).reshape(-1, 12))
+    save_array(f"{prefix}.cells.npy", offsets)
+    save_array(f"{prefix}.centroids.npy", centroids.astype(np.float32))
+    save_array(f"{prefix}.buckets.npy", model.buckets)
+    save_array(f"{prefix}.idf.npy", model.idf)
+    save_array(f"{prefix}.components.npy", model.components)
+
+
+class VectorIndex:
+    def __init__(self):
+        self.generation = 0
+        self.synced_at: Optional[datetime] = None
+        self.model: Optional[LsaModel] = None
+        # On-disk generation, rows grouped by cell: cell i is rows offsets[i]:offsets[i + 1]
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ids: List[str] = []
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.deleted = np.zeros(0, dtype=bool)  # Tombstones for on-disk rows
+        # In-memory delta; its rows are numbered after the on-disk ones
+        self.delta_vectors = np.zeros((0, 0), dtype=np.float32)
+        self.delta_live = np.zeros(0, dtype=bool)
+        self.delta_ids: List[Optional[str]] = []
+        self.row_of: Dict[str, int] = {}
+        self.dirty = False
+        self._journal: Optional[list] = None  # Changes made while a new generation is written
+
+    def load(self, directory: str, generation: int, synced_at: Optional[datetime]):
+        prefix = os.path.join(directory, f"{generation}")
+        self.__init__()
+        self.generation = generation
+        self.synced_at = synced_at
+        self.model = LsaModel(np.load(f"{prefix}.buckets.npy"), np.load(f"{prefix}.idf.npy"), np.load(f"{prefix}.components.npy"))
+        self.vectors = np.load(f"{prefix}.vectors.npy", mmap_mode="r")
+        self.centroids = np.load(f"{prefix}.centroids.npy")
+        self.offsets = np.load(f"{prefix}.cells.npy")
+        raw = np.load(f"{prefix}.ids.npy").tobytes()
+        self.ids = [str(ObjectId(raw[i:i + 12])) for i in range(0, len(raw), 12)]
+        self.row_of = {link_id: i for i, link_id in enumerate(self.ids)}
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+        self.delta_vectors = np.zeros((0, self.model.dimensions), dtype=np.float32)
+
+    @property
+    def base_size(self) -> int:
+        return len(self.ids)
+
+    # -- Changes --
+
+    def add(self, link_id: str, vector: np.ndarray):
+        """Insert or replace a link's vector"""
+        if self._journal is not None:
+            self._journal.append((link_id, vector))
+        row = self.row_of.get(link_id)
+        if row is not None and row >= self.base_size:
+            self.delta_vectors[row - self.base_size] = vector
+        else:
+            if row is not None:
+                self.deleted[row] = True
+            n = len(self.delta_ids)
+            if n == len(self.delta_vectors):
+                capacity = max(64, 2 * n)
+                self.delta_vectors = np.resize(self.delta_vectors, (capacity, self.model.dimensions))
+                self.delta_live = np.resize(self.delta_live, capacity)
+            self.delta_vectors[n] = vector
+            self.delta_live[n] = True
+            self.delta_ids.append(link_id)
+            self.row_of[link_id] = self.base_size + n
+        self.dirty = True
+
+    def remove(self, link_id: str):
+        if self._journal is not None:
+            self._journal.append((link_id, None))
+        row = self.row_of.pop(link_id, None)
+        if row is None:
+            return
+        if row < self.base_size:
+            self.deleted[row] = True
+        else:
+            self.delta_live[row - self.base_size] = False
+            self.delta_ids[row - self.base_size] = None
+        self.dirty = True
+
+    @property
+    def pending(self) -> int:
+        """Changes not yet merged into a generation"""
+        return len(self.delta_ids) + int(self.deleted.sum())
+
+    # -- Queries --
+
+    def vector(self, link_id: str) -> Optional[np.ndarray]:
+        row = self.row_of.get(link_id)
+        if row is None:
+            return None
+        return np.array(self.vectors[row] if row < self.base_size else self.delta_vectors[row - self.base_size])
+
+    def _link_id(self, row: int) -> str:
+        return self.ids[row] if row < self.base_size else self.delta_ids[row - self.base_size]
+
+    def nearest(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """
+        Top-k links by cosine similarity for each row of `queries`. The centroids and the
+        delta are scored for the whole batch in one matrix product each; every query then
+        scores only the rows of its EMBEDDING_NPROBE nearest cells (contiguous on disk).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_delta = len(self.delta_ids)
+        delta_rows = self.base_size + np.arange(n_delta)
+        if n_delta:
+            delta_scores = np.where(self.delta_live[:n_delta], queries @ self.delta_vectors[:n_delta].T, -np.inf)
+        if self.base_size:
+            nprobe = min(EMBEDDING_NPROBE, len(self.centroids))
+            probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for q, query in enumerate(queries):
+            scores, owners = [], []
+            if self.base_size:
+                cells = probes[q]
+                sizes = self.offsets[cells + 1] - self.offsets[cells]
+                rows = np.repeat(self.offsets[cells] - (np.cumsum(sizes) - sizes), sizes) + np.arange(int(sizes.sum()))
+                scores.append(np.where(self.deleted[rows], -np.inf, self.vectors[rows] @ query))
+                owners.append(rows)
+            if n_delta:
+                scores.append(delta_scores[q])
+                owners.append(delta_rows)
+            scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+            owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            results.append([(self._link_id(owners[i]), float(scores[i])) for i in top if scores[i] > -np.inf])
+        return results
+
+    def merged(self, deleted: np.ndarray, delta_vectors: np.ndarray, delta_live: np.ndarray, delta_ids: List[Optional[str]]):
+        """Live vectors and ids of the on-disk generation plus a snapshot of the delta"""
+        keep = ~deleted
+        vectors = np.concatenate((np.asarray(self.vectors)[keep], delta_vectors[delta_live]))
+        ids = [link_id for link_id, k in zip(self.ids, keep) if k] + [link_id for link_id in delta_ids if link_id is not None]
+        return vectors, ids
+
+
+_index: Optional[VectorIndex] = None  # Set once an index is loaded or built
+_sync_task: Optional[asyncio.Task] = None
+_save_lock = asyncio.Lock()
+_next_build_at = 0.0  # Monotonic time before which a build that found too few links isn't retried
+_build_backoff = EMBEDDING_SYNC_INTERVAL
+_queued: List[Tuple[np.ndarray, int, asyncio.Future]] = []  # Lookups waiting to be answered as one batch
+
+
+def ready() -> bool:
+    return EMBEDDINGS_ENABLED and _index is not None
+
+
+def _embeddable(doc: Dict) -> bool:
+    return "Error" not in (doc.get("tags") or [])
+
+
+def _apply(index: VectorIndex, docs: List[Dict], vectors: np.ndarray):
+    for doc, vector in zip(docs, vectors):
+        if _embeddable(doc) and vector.any():
+            index.add(str(doc["_id"]), vector)
+        else:
+            index.remove(str(doc["_id"]))
+
+
+async def add_documents(docs: Iterable[Dict]):
+    """Embed new or changed links into the index off the event loop (no-op until it is loaded)"""
+    docs = list(docs)
+    while ready() and docs:
+        index = _index
+        vectors = await asyncio.to_thread(embed_documents, index.model, docs)
+        # Vectors belong to the model they were embedded with; re-embed if a new generation was loaded meanwhile
+        if _index is index:
+            _apply(index, docs, vectors)
+            return
+
+
+def remove_document(link_id: str):
+    if ready():
+        _index.remove(link_id)
+
+
+async def nearest(vector: np.ndarray, k: int) -> List[Tuple[str, float]]:
+    """
+    The k links most similar to a unit vector. Lookups made in the same event loop
+    iteration are answered together by one batched query.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _queued.append((vector, k, future))
+    if len(_queued) == 1:
+        loop.call_soon(_answer_queued)
+    return await future
+
+
+def _answer_queued():
+    batch = list(_queued)
+    _queued.clear()
+    try:
+        results = _index.nearest(np.stack([vector for vector, _, _ in batch]), max(k for _, k, _ in batch))
+    except Exception as e:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, k, future), hits in zip(batch, results):
+        if not future.done():
+            future.set_result(hits[:k])
+
+
+async def _fetch_ranked(hits: List[Tuple[str, float]], projection: Optional[Dict] = None) -> List[Dict]:
+    """Documents for ranked hits, in order, each with its `similarity`"""
+    ids = [ObjectId(link_id) for link_id, _ in hits]
+    docs = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": ids}}, projection)}
+    links = []
+    for oid, (_, similarity) in zip(ids, hits):
+        doc = docs.get(oid)
+        if doc is not None:
+            doc["similarity"] = round(similarity, 4)
+            links.append(doc)
+    return links
+
+
+async def _embed_one(doc: Dict) -> np.ndarray:
+    """Embed one document off the event loop, with the model of the index that is current when it's done"""
+    while True:
+        model = _index.model
+        vector = (await asyncio.to_thread(embed_documents, model, [doc]))[0]
+        if _index.model is model:
+            return vector
+
+
+async def related_links(link_id: str, limit: int, projection: Optional[Dict] = None) -> Optional[List[Dict]]:
+    """The links most similar in content to a link; None if the link doesn't exist"""
+    vector = _index.vector(link_id)
+    if vector is None:
+        # Not embedded (yet): embed it from the stored document
+        doc = await collection.find_one({"_id": ObjectId(link_id)}, EMBED_PROJECTION)
+        if doc is None:
+            return None
+        vector = await _embed_one(doc)
+        if not vector.any():
+            return []
+    hits = [hit for hit in await nearest(vector, limit + 1) if hit[0] != link_id][:limit]
+    return await _fetch_ranked(hits, projection)
+
+
+async def semantic_links(search: str, filters: Dict, skip: int, limit: int,
+                         projection: Optional[Dict] = None) -> Tuple[List[Dict], int]:
+    """
+    Page of links ranked by similarity to the meaning of a search (words the projection
+    relates to the query count even if they don't occur in the link). Filters are applied
+    by MongoDB to the SEMANTIC_MAX_RESULTS nearest links.
+    """
+    vector = await _embed_one({"title": search})
+    if not vector.any():
+        return [], 0
+    hits = await nearest(vector, SEMANTIC_MAX_RESULTS)
+    ids = [ObjectId(link_id) for link_id, _ in hits]
+    allowed = {doc["_id"] async for doc in collection.find({**filters, "_id": {"$in": ids}}, {"_id": 1})}
+    ranked = [(str(oid), similarity) for oid, (_, similarity) in zip(ids, hits) if oid in allowed]
+    return await _fetch_ranked(ranked[skip:skip + limit], projection), len(ranked)
+
+
+# --- Persistence and sync ---
+
+async def save_index():
+    """Merge the in-memory delta into a new generation on disk, off the event loop (writer only)"""
+    global _index
+    index = _index
+    if index is None or not index.dirty or not is_writer(EMBEDDING_DIR):
+        return
+    async with _save_lock:
+        n = len(index.delta_ids)
+        snapshot = (index.deleted.copy(), index.delta_vectors[:n].copy(), index.delta_live[:n].copy(), list(index.delta_ids))
+        synced_at = index.synced_at
+        index._journal = []
+        try:
+            def write(generation: int) -> int:
+                vectors, ids = index.merged(*snapshot)
+                write_generation(EMBEDDING_DIR, generation, index.model, vectors, ids, index.centroids)
+                return len(ids)
+
+            generation = await asyncio.to_thread(commit_generation, EMBEDDING_DIR, write, synced_at, {"hash_dim": TFIDF_DIM})
+            loaded = VectorIndex()
+            loaded.load(EMBEDDING_DIR, generation, synced_at)
+        finally:
+            journal, index._journal = index._journal, None
+        # Replay what changed while writing
+        for link_id, vector in journal:
+            if vector is None:
+                loaded.remove(link_id)
+            else:
+                loaded.add(link_id, vector)
+        loaded.dirty = bool(journal)
+        _index = loaded
+        logger.info(f"🧭 Embedding generation {generation} saved ({loaded.base_size} links)")
+
+
+async def build_index(batch_size: int = 500) -> Optional[VectorIndex]:
+    """Fit the projection on the first EMBEDDING_FIT_SAMPLE links, then embed the whole library"""
+    global _index
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+    started_at = datetime.utcnow()
+
+    def analyze(docs: List[Dict]) -> List[DocTerms]:
+        return [DocTerms.from_text(link_text(doc)) for doc in docs]
+
+    sample: List[DocTerms] = []
+    async for docs in iter_batches(batch_size, EMBED_PROJECTION):
+        sample.extend(await asyncio.to_thread(analyze, docs))
+        if len(sample) >= EMBEDDING_FIT_SAMPLE:
+            break
+    model = await asyncio.to_thread(LsaModel.fit, sample[:EMBEDDING_FIT_SAMPLE])
+    del sample
+    if model is None:
+        logger.info("🧭 Not enough links to fit embeddings yet")
+        return None
+
+    vectors: List[np.ndarray] = []
+    ids: List[str] = []
+    async for docs in iter_batches(batch_size, EMBED_PROJECTION):
+        batch = await asyncio.to_thread(embed_documents, model, docs)
+        embedded = batch.any(axis=1)
+        vectors.append(batch[embedded])
+        ids.extend(str(doc["_id"]) for doc, e in zip(docs, embedded) if e)
+        logger.info(f"🧭 Embedded {len(ids)} links")
+    matrix = np.concatenate(vectors) if vectors else np.zeros((0, model.dimensions), dtype=np.float32)
+
+    def write(generation: int) -> int:
+        write_generation(EMBEDDING_DIR, generation, model, matrix, ids, np.zeros((0, model.dimensions), dtype=np.float32))
+        return len(ids)
+
+    generation = await asyncio.to_thread(commit_generation, EMBEDDING_DIR, write, started_at, {"hash_dim": TFIDF_DIM})
+    index = VectorIndex()
+    index.load(EMBEDDING_DIR, generation, started_at)
+    if EMBEDDINGS_ENABLED:
+        _index = index
+    logger.info(f"🧭 Embedded {len(ids)} links ({model.dimensions} dimensions, {len(index.centroids)} cells)")
+    return index
+
+
+async def sync_index(batch_size: int = 500):
+    """Embed links changed by other processes (or while the index was offline)"""
+    if not ready() or _index.synced_at is None:
+        return
+    now = datetime.utcnow()
+    since = _index.synced_at - SYNC_OVERLAP
+    changed = 0
+    cursor = collection.find({"updated_at": {"$gt": since}}, EMBED_PROJECTION)
+    while docs := await cursor.to_list(length=batch_size):
+        index = _index
+        _apply(index, docs, await asyncio.to_thread(embed_documents, index.model, docs))
+        changed += len(docs)
+    _index.synced_at = now
+    if changed:
+        logger.info(f"🧭 Synced {changed} changed links into the embeddings")
+
+
+def _load(manifest: Dict):
+    """Switch to the published generation; changes since its sync are re-read from updated_at"""
+    global _index
+    index = VectorIndex()
+    synced_at = datetime.fromisoformat(manifest["synced_at"]) if manifest.get("synced_at") else None
+    index.load(EMBEDDING_DIR, manifest["generation"], synced_at)
+    _index = index
+    logger.info(f"🧭 Loaded embedding generation {index.generation} ({index.base_size} links)")
+
+
+async def _build():
+    """Build the first generation, backing off while the library is too small to fit"""
+    global _next_build_at, _build_backoff
+    if time.monotonic() < _next_build_at:
+        return
+    if await build_index() is None:
+        _next_build_at = time.monotonic() + _build_backoff
+        _build_backoff = min(_build_backoff * 2, MAX_BUILD_BACKOFF)
+    else:
+        _build_backoff = EMBEDDING_SYNC_INTERVAL
+
+
+async def _sync_loop():
+    while True:
+        try:
+            # Re-checked every round so another worker takes over when the writer exits
+            writer = claim_writer(EMBEDDING_DIR)
+            manifest = read_manifest(EMBEDDING_DIR)
+            if manifest is None or manifest.get("hash_dim") != TFIDF_DIM:
+                if writer:
+                    await _build()
+            elif _index is None or manifest["generation"] > _index.generation:
+                _load(manifest)
+            await sync_index()
+            if writer and _index is not None and _index.pending >= MAX_DELTA_VECTORS:
+                await save_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Embedding sync failed: {e}")
+        await asyncio.sleep(EMBEDDING_SYNC_INTERVAL)
+
+
+def start_embeddings():
+    """Load (or build) the embeddings and keep them in sync (call from the app lifespan)"""
+    global _sync_task
+    if EMBEDDINGS_ENABLED:
+        os.makedirs(EMBEDDING_DIR, exist_ok=True)
+        _sync_task = asyncio.create_task(_sync_loop())
+
+
+async def stop_embeddings():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
+    try:
+        await save_index()
+    except Exception as e:
+        logger.error(f"Error saving embeddings: {e}")
+    release_writer(EMBEDDING_DIR)
+
+
+async def main(args):
+    try:
+        started = datetime.utcnow()
+        index = await build_index(batch_size=args.batch_size)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        if index is None:
+            print("⚠️ Not enough links to fit embeddings")
+        else:
+            print(f"✅ Embedded {index.base_size} links into {EMBEDDING_DIR} in {elapsed:.1f}s")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Fit the embedding projection and embed every link")
+    parser.add_argument("--batch-size", type=int, default=500, help="Links read and embedded per batch")
+    asyncio.run(main(parser.parse_args()))
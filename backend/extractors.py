@@ -0,0 +1,274 @@
+"""
+Fast-path extractors for well-known sites
+Instead of downloading and parsing the full page, links to registered domains are
+described from cheap structured sources (oEmbed, the arXiv API, the GitHub API, or
+just the page's <head>). An extractor returns the same metadata dict as process_url,
+or None to fall back to the generic trafilatura path.
+"""
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+import httpx
+from lxml import etree, html
+import circuit_breaker
+from scraper import HTML_CONTENT_TYPES, extract_domain, get_http_client
+from tagging import get_matcher
+from text_analysis import analyze_text, summarize
+from urls import youtube_video_id
+
+logger = logging.getLogger(__name__)
+
+FAST_EXTRACTORS_ENABLED = os.getenv("FAST_EXTRACTORS_ENABLED", "true").lower() in ("1", "true", "yes")
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")  # Optional, raises the GitHub API rate limit
+HEAD_MAX_BYTES = 256 * 1024  # Stop reading a page once </head> is seen or this much was read
+README_MAX_CHARS = 20000  # README text stored as content (links are harvested from all of it)
+
+Extractor = Callable[[str], Awaitable[Optional[Dict]]]
+_registry: Dict[str, Extractor] = {}
+
+
+def register_extractor(*domains: str):
+    """Decorator registering a fast-path extractor for one or more domains"""
+    def decorator(func: Extractor) -> Extractor:
+        for domain in domains:
+            _registry[domain] = func
+        return func
+    return decorator
+
+
+def find_extractor(url: str) -> Optional[Extractor]:
+    """Return the extractor for a URL's domain (or a parent domain), if any"""
+    if not FAST_EXTRACTORS_ENABLED:
+        return None
+    domain = extract_domain(url).lower()
+    while domain:
+        if domain in _registry:
+            return _registry[domain]
+        domain = domain.partition(".")[2]
+    return None
+
+
+def build_metadata(url: str, title: Optional[str], description: Optional[str] = None, content: Optional[str] = None,
+                   author: Optional[str] = None, image_url: Optional[str] = None, video_url: Optional[str] = None,
+                   nested_links: Optional[List[str]] = None) -> Dict:
+    """Assemble a process_url-compatible metadata dict"""
+    title = (title or "").strip() or "No Title"
+    description = (description or "").strip()
+    text = (content or description).strip()
+    domain = extract_domain(url)
+    matcher = get_matcher()
+    stats = analyze_text(text, url=url, title=title, matcher=matcher)
+    return {
+        "title": title,
+        "summary": summarize(description) if description else stats.summary,
+        "content": text or None,
+        "author": author,
+        "tags": matcher.rank(domain, stats.tag_hits),
+        "taxonomy_version": matcher.version,
+        "domain": domain,
+        "reading_time": stats.reading_time,
+        "word_count": stats.word_count,
+        "image_url": image_url,
+        "video_url": video_url,
+        "nested_links": nested_links or []
+    }
+
+
+async def api_get(url: str, **kwargs) -> Optional[httpx.Response]:
+    """
+    GET a structured-data endpoint through the circuit breaker, so a failing API host is
+    left alone like any other; None (use the generic path) while its circuit is open
+    """
+    full_url = str(httpx.URL(url, params=kwargs.get("params")))
+    if circuit_breaker.check(full_url):
+        return None
+    try:
+        response = await get_http_client().get(url, **kwargs)
+    except httpx.HTTPError as e:
+        circuit_breaker.record_failure(full_url, str(e) or type(e).__name__, True)
+        return None
+    if response.status_code == 429 or response.status_code >= 500:
+        circuit_breaker.record_failure(full_url, f"HTTP {response.status_code}", True)
+    else:
+        circuit_breaker.record_success(full_url)
+    return response
+
+
+async def fetch_head(url: str) -> Optional[html.HtmlElement]:
+    """Download only the <head> of an HTML page and parse it (through the circuit breaker, like api_get)"""
+    if circuit_breaker.check(url):
+        return None
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url) as response:
+            if response.status_code == 429 or response.status_code >= 500:
+                circuit_breaker.record_failure(url, f"HTTP {response.status_code}", True)
+                return None
+            circuit_breaker.record_success(url)
+            if response.status_code != 200:
+                return None
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type and content_type not in HTML_CONTENT_TYPES:
+                return None
+            data = b""
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                # Only the new bytes (plus a tag-sized overlap) need checking
+                if b"</head>" in data[-(len(chunk) + 7):].lower() or len(data) >= HEAD_MAX_BYTES:
+                    break
+    except httpx.HTTPError as e:
+        circuit_breaker.record_failure(url, str(e) or type(e).__name__, True)
+        return None
+    if not data:
+        return None
+    head_end = data.lower().find(b"</head>")
+    if head_end != -1:
+        data = data[:head_end] + b"</head><body></body></html>"
+    return html.fromstring(data)
+
+
+def _meta(tree: html.HtmlElement, *keys: str) -> Optional[str]:
+    for key in keys:
+        values = tree.xpath(f'//meta[@property="{key}" or @name="{key}"]/@content')
+        if values and values[0].strip():
+            return values[0].strip()
+    return None
+
+
+async def extract_from_head(url: str) -> Optional[Dict]:
+    """Describe a page from its OpenGraph/meta tags without downloading the body"""
+    tree = await fetch_head(url)
+    if tree is None:
+        return None
+    title = _meta(tree, "og:title", "twitter:title") or (tree.findtext(".//title") or "").strip()
+    if not title:
+        return None
+    return build_metadata(
+        url,
+        title=title,
+        description=_meta(tree, "og:description", "description", "twitter:description"),
+        author=_meta(tree, "author", "article:author"),
+        image_url=_meta(tree, "og:image", "twitter:image"),
+        video_url=_meta(tree, "og:video")
+    )
+
+
+@register_extractor("youtube.com", "youtu.be", "youtube-nocookie.com")
+async def extract_youtube(url: str) -> Optional[Dict]:
+    """YouTube videos via the public oEmbed endpoint"""
+    video_id = youtube_video_id(url)
+    if not video_id:
+        return None
+    watch_url = f"https://www.youtube.com/watch?v={video_id}"
+    response = await api_get(
+        "https://www.youtube.com/oembed", params={"url": watch_url, "format": "json"}
+    )
+    if response is None or response.status_code != 200:
+        return None
+    data = response.json()
+    return build_metadata(
+        url,
+        title=data.get("title"),
+        description=f"Video by {data['author_name']}" if data.get("author_name") else None,
+        author=data.get("author_name"),
+        image_url=data.get("thumbnail_url") or f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg",
+        video_url=f"https://www.youtube.com/embed/{video_id}"
+    )
+
+
+ARXIV_ID = re.compile(r"/(?:abs|pdf|html)/(.+?)(?:v\d+)?(?:\.pdf)?/?$")  # New (2101.00001) and old (hep-th/9901001) IDs
+_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+@register_extractor("arxiv.org")
+async def extract_arxiv(url: str) -> Optional[Dict]:
+    """arXiv papers (abstract and PDF links) via the export API's Atom metadata"""
+    match = ARXIV_ID.search(url.split("?")[0])
+    if not match:
+        return None
+    response = await api_get(
+        "https://export.arxiv.org/api/query", params={"id_list": match.group(1), "max_results": 1}
+    )
+    if response is None or response.status_code != 200:
+        return None
+    feed = etree.fromstring(response.content, _XML_PARSER)
+    entry = feed.find(f"{ATOM}entry")
+    if entry is None or not (entry.findtext(f"{ATOM}title") or "").strip():
+        return None
+
+    title = " ".join(entry.findtext(f"{ATOM}title").split())
+    abstract = " ".join((entry.findtext(f"{ATOM}summary") or "").split())
+    authors = [name.strip() for name in entry.xpath("a:author/a:name/text()", namespaces={"a": ATOM[1:-1]})]
+    author = ", ".join(authors[:3]) + (" et al." if len(authors) > 3 else "") if authors else None
+    return build_metadata(url, title=title, description=abstract, content=abstract, author=author)
+
+
+GITHUB_REPO = re.compile(r"^/([\w.-]+)/([\w.-]+?)(?:\.git)?/?$")
+# [text](url) and <a href="url"> (badges like [![img](src)](url) keep their outer target, images are skipped)
+MARKDOWN_LINK = re.compile(r"(?<!!)\[(?:[^\[\]]|\[[^\]]*\])*\]\((https?://[^)\s]+)\)|<a\s[^>]*href=\"(https?://[^\"]+)\"")
+
+
+def readme_links(readme: str, url: str) -> List[str]:
+    """Link targets in a README, so curated lists (awesome-*) can be crawled"""
+    links = []
+    for match in MARKDOWN_LINK.finditer(readme):
+        link = match.group(1) or match.group(2)
+        if link != url and link not in links:
+            links.append(link)
+    return links
+
+
+@register_extractor("github.com")
+async def extract_github(url: str) -> Optional[Dict]:
+    """Repositories via the GitHub API (description, topics, README); other pages via <head>"""
+    path = url.split("?")[0].split("#")[0].split("github.com", 1)[-1]
+    match = GITHUB_REPO.match(path)
+    if not match:
+        return await extract_from_head(url)
+
+    owner, repo = match.groups()
+    headers = {"Accept": "application/vnd.github+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    response = await api_get(f"https://api.github.com/repos/{owner}/{repo}", headers=headers)
+    if response is None or response.status_code != 200:
+        # Rate limited or private: the <head> still has the OpenGraph card
+        return await extract_from_head(url)
+    data = response.json()
+
+    readme = ""
+    readme_response = await api_get(
+        f"https://api.github.com/repos/{owner}/{repo}/readme",
+        headers={**headers, "Accept": "application/vnd.github.raw"}
+    )
+    if readme_response is not None and readme_response.status_code == 200:
+        readme = readme_response.text
+
+    description = data.get("description") or ""
+    topics = ", ".join(data.get("topics") or [])
+    return build_metadata(
+        url,
+        title=f"{data.get('full_name', f'{owner}/{repo}')}: {description}" if description else data.get("full_name"),
+        description=description or None,
+        content="\n\n".join(part for part in (description, topics, readme[:README_MAX_CHARS]) if part),
+        author=(data.get("owner") or {}).get("login"),
+        image_url=f"https://opengraph.githubassets.com/1/{owner}/{repo}",
+        nested_links=readme_links(readme, url)  # From the whole README: curated lists are long
+    )
+
+
+async def run_fast_path(url: str) -> Optional[Dict]:
+    """Try the registered extractor for a URL; None means use the generic path"""
+    extractor = find_extractor(url)
+    if extractor is None:
+        return None
+    try:
+        metadata = await extractor(url)
+    except Exception as e:
+        logger.warning(f"Fast-path extractor {extractor.__name__} failed for {url}: {e}")
+        return None
+    if metadata:
+        logger.info(f"⚡ Extracted {url} via {extractor.__name__}")
+    return metadata
@@ -0,0 +1,215 @@
+"""
+On-disk cache of fetched pages
+Entries are keyed by a hash of the canonical URL and hold the gzip-compressed HTML
+together with its ETag/Last-Modified validators (and the extracted metadata), so a
+re-fetch can be sent as a conditional request and an unchanged page costs a 304.
+Least recently used entries are evicted once the cache grows past FETCH_CACHE_MAX_BYTES.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "fetch"))
+FETCH_CACHE_MAX_BYTES = int(os.getenv("FETCH_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 0 disables the cache
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = 0.0
+    metadata: Optional[Dict] = field(default=None, repr=False)
+
+
+_lock = threading.Lock()
+_index: Optional["OrderedDict[str, int]"] = None  # key -> bytes on disk, oldest first
+_total_bytes = 0
+
+
+def is_enabled() -> bool:
+    return FETCH_CACHE_MAX_BYTES > 0
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+
+def _paths(key: str):
+    directory = os.path.join(FETCH_CACHE_DIR, key[:2])
+    return os.path.join(directory, f"{key}.json"), os.path.join(directory, f"{key}.html.gz")
+
+
+def _entry_size(key: str) -> int:
+    size = 0
+    for path in _paths(key):
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+
+def _load_index():
+    """Build the LRU index from the files on disk (modification time = last use)"""
+    global _index, _total_bytes
+    entries = []
+    if os.path.isdir(FETCH_CACHE_DIR):
+        for shard in os.listdir(FETCH_CACHE_DIR):
+            shard_dir = os.path.join(FETCH_CACHE_DIR, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.endswith(".json"):
+                    key = name[:-5]
+                    try:
+                        mtime = os.path.getmtime(os.path.join(shard_dir, name))
+                    except OSError:
+                        continue
+                    entries.append((mtime, key))
+    entries.sort()
+    _index = OrderedDict((key, _entry_size(key)) for _, key in entries)
+    _total_bytes = sum(_index.values())
+
+
+def _ensure_index():
+    if _index is None:
+        _load_index()
+
+
+def _remove(key: str):
+    global _total_bytes
+    _total_bytes -= _index.pop(key, 0)
+    for path in _paths(key):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _evict():
+    while _total_bytes > FETCH_CACHE_MAX_BYTES and _index:
+        oldest = next(iter(_index))
+        _remove(oldest)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _lookup(url: str) -> Optional[CacheEntry]:
+    key = cache_key(url)
+    meta_path, _ = _paths(key)
+    with _lock:
+        _ensure_index()
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(meta_path)  # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        if key in _index:
+            _index.move_to_end(key)
+    return CacheEntry(
+        key=key,
+        url=meta.get("url", url),
+        etag=meta.get("etag"),
+        last_modified=meta.get("last_modified"),
+        fetched_at=meta.get("fetched_at", 0.0),
+        metadata=meta.get("metadata")
+    )
+
+
+def _read_body(key: str) -> Optional[str]:
+    _, body_path = _paths(key)
+    try:
+        with open(body_path, "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+    except (OSError, EOFError, gzip.BadGzipFile, UnicodeDecodeError):
+        return None
+
+
+def _store(url: str, html_content: str, etag: Optional[str], last_modified: Optional[str], metadata: Optional[Dict]):
+    global _total_bytes
+    key = cache_key(url)
+    meta_path, body_path = _paths(key)
+    meta = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "fetched_at": time.time(),
+        "metadata": metadata
+    }
+    with _lock:
+        _ensure_index()
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        _write_atomic(body_path, gzip.compress(html_content.encode("utf-8"), compresslevel=6))
+        # Metadata file last: its presence marks a complete entry
+        _write_atomic(meta_path, json.dumps(meta, default=str).encode("utf-8"))
+        _total_bytes -= _index.pop(key, 0)
+        _index[key] = _entry_size(key)
+        _total_bytes += _index[key]
+        _evict()
+
+
+def _touch(key: str):
+    meta_path, _ = _paths(key)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["fetched_at"] = time.time()
+        _write_atomic(meta_path, json.dumps(meta, default=str).encode("utf-8"))
+    except (OSError, ValueError):
+        pass
+
+
+# Async wrappers keep disk I/O off the event loop
+
+async def lookup(url: str) -> Optional[CacheEntry]:
+    """Return the cached validators/metadata for a URL, or None"""
+    if not is_enabled():
+        return None
+    try:
+        return await asyncio.to_thread(_lookup, url)
+    except Exception as e:
+        logger.warning(f"Fetch cache lookup failed for {url}: {e}")
+        return None
+
+
+async def read_body(entry: CacheEntry) -> Optional[str]:
+    """Return the cached HTML for an entry (None if it was evicted meanwhile)"""
+    return await asyncio.to_thread(_read_body, entry.key)
+
+
+async def store(url: str, html_content: str, etag: Optional[str] = None,
+                last_modified: Optional[str] = None, metadata: Optional[Dict] = None):
+    """Cache a fetched page; only pages with validators are worth keeping"""
+    if not is_enabled() or not (etag or last_modified):
+        return
+    try:
+        await asyncio.to_thread(_store, url, html_content, etag, last_modified, metadata)
+    except Exception as e:
+        logger.warning(f"Fetch cache store failed for {url}: {e}")
+
+
+async def mark_revalidated(entry: CacheEntry):
+    """Record a successful 304 revalidation"""
+    try:
+        await asyncio.to_thread(_touch, entry.key)
+    except Exception as e:
+        logger.warning(f"Fetch cache update failed for {entry.url}: {e}")
@@ -0,0 +1,389 @@
+"""
+Background ingestion queue for links received from Telegram
+The webhook only records URLs as jobs in MongoDB and returns immediately;
+a dispatcher claims jobs and scrapes them concurrently, bounded by a global
+cap and a per-domain politeness limit, then stores the links.
+Jobs move through: queued -> fetching -> extracted / failed
+Transient fetch failures (host down, timeouts, circuit open) send the job back to
+queued with a later `available_at` instead of storing an error link.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import collection, jobs_collection
+from models import LinkSchema
+from link_writer import LinkBatchWriter
+from scraper import process_url, extract_domain
+from search import search_terms
+import circuit_breaker
+import tfidf
+from urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "8"))  # Jobs scraped at once per process
+INGEST_PER_DOMAIN_LIMIT = int(os.getenv("INGEST_PER_DOMAIN_LIMIT", "2"))  # Concurrent fetches per host
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "5"))  # Seconds between idle queue checks
+INGEST_STALE_AFTER_MINUTES = int(os.getenv("INGEST_STALE_AFTER_MINUTES", "10"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))  # Fetch attempts before an error link is stored
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "60"))  # Seconds before the first retry, doubled per attempt
+
+JOB_QUEUED = "queued"
+JOB_FETCHING = "fetching"
+JOB_EXTRACTED = "extracted"
+JOB_FAILED = "failed"
+JOB_STATUSES = (JOB_QUEUED, JOB_FETCHING, JOB_EXTRACTED, JOB_FAILED)
+
+_wakeup: Optional[asyncio.Event] = None
+_global_slots: Optional[asyncio.Semaphore] = None
+_dispatcher_task: Optional[asyncio.Task] = None
+_running_jobs: Set[asyncio.Task] = set()
+_inflight_by_domain: Dict[str, int] = {}
+_link_writer: Optional[LinkBatchWriter] = None
+
+
+def build_link(url: str, metadata: Dict, source: str = "telegram") -> LinkSchema:
+    """Build a LinkSchema from the metadata dict returned by process_url"""
+    return LinkSchema(
+        **tfidf.annotate(metadata),
+        url=url,
+        canonical_url=canonicalize_url(url),
+        title=metadata["title"],
+        summary=metadata["summary"],
+        content=metadata.get("content"),
+        author=metadata.get("author"),
+        tags=metadata.get("tags", []),
+        auto_tags=metadata.get("tags", []),
+        taxonomy_version=metadata.get("taxonomy_version"),
+        domain=metadata.get("domain"),
+        reading_time=metadata.get("reading_time", 0),
+        word_count=metadata.get("word_count"),
+        image_url=metadata.get("image_url"),
+        video_url=metadata.get("video_url"),
+        source=source,
+        nested_links=metadata.get("nested_links", []),
+        search_terms=search_terms(metadata["title"], metadata["summary"]),
+        last_fetched_at=datetime.utcnow()
+    )
+
+
+def serialize_job(job: Dict) -> Dict:
+    """Convert a job document into a JSON-friendly dict"""
+    return {
+        "id": str(job["_id"]),
+        "url": job["url"],
+        "status": job["status"],
+        "source": job.get("source"),
+        "attempts": job.get("attempts", 0),
+        "error": job.get("error"),
+        "available_at": job.get("available_at"),
+        "link_id": job.get("link_id"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at")
+    }
+
+
+def ingestion_busy() -> bool:
+    """True while this process is scraping queued links (background work should yield)"""
+    return bool(_running_jobs)
+
+
+def _notify_workers():
+    """Wake up the dispatcher in this process after jobs were queued or slots freed"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def enqueue_urls(urls: List[str], source: str = "telegram", chat_id: Optional[int] = None) -> List[str]:
+    """Persist one ingestion job per URL and return the job IDs"""
+    if not urls:
+        return []
+
+    now = datetime.utcnow()
+    jobs = [
+        {
+            "url": url,
+            "canonical_url": canonicalize_url(url),
+            "domain": extract_domain(url),
+            "source": source,
+            "chat_id": chat_id,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "error": None,
+            "available_at": None,
+            "link_id": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        for url in urls
+    ]
+    result = await jobs_collection.insert_many(jobs)
+    _notify_workers()
+    return [str(job_id) for job_id in result.inserted_ids]
+
+
+async def filter_new_urls(urls: List[str]) -> List[str]:
+    """
+    Drop URLs that are already in the library or already queued, comparing canonical URLs.
+    Uses one $in query per collection for the whole message instead of a lookup per URL.
+    """
+    by_canonical: Dict[str, str] = {}
+    for url in urls:
+        by_canonical.setdefault(canonicalize_url(url), url)
+    if not by_canonical:
+        return []
+
+    canonical_urls = list(by_canonical)
+    known = set()
+    async for doc in collection.find({"canonical_url": {"$in": canonical_urls}}, {"canonical_url": 1}):
+        known.add(doc["canonical_url"])
+    async for job in jobs_collection.find(
+        {"canonical_url": {"$in": canonical_urls}, "status": {"$in": [JOB_QUEUED, JOB_FETCHING]}},
+        {"canonical_url": 1}
+    ):
+        known.add(job["canonical_url"])
+
+    for canonical_url in known:
+        logger.warning(f"⚠️ URL already exists or is queued: {by_canonical.get(canonical_url)}")
+    return [url for canonical_url, url in by_canonical.items() if canonical_url not in known]
+
+
+async def get_job(job_id: str) -> Optional[Dict]:
+    return await jobs_collection.find_one({"_id": ObjectId(job_id)})
+
+
+async def list_jobs(status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+    query = {"status": status} if status else {}
+    cursor = jobs_collection.find(query).sort("created_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def _claim_next_job() -> Optional[Dict]:
+    """
+    Atomically move the oldest claimable job to 'fetching' (safe across gunicorn workers).
+    Jobs for domains already at the per-domain limit are skipped so one busy host
+    doesn't hold up links from other sites.
+    """
+    now = datetime.utcnow()
+    saturated = [domain for domain, count in _inflight_by_domain.items() if count >= INGEST_PER_DOMAIN_LIMIT]
+    # Jobs parked for a retry become claimable again once available_at has passed
+    query = {"status": JOB_QUEUED, "$or": [{"available_at": None}, {"available_at": {"$lte": now}}]}
+    if saturated:
+        query["domain"] = {"$nin": saturated}
+
+    return await jobs_collection.find_one_and_update(
+        query,
+        {"$set": {"status": JOB_FETCHING, "started_at": now, "updated_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _finish_job(job_id, status: str, link_id: Optional[str] = None, error: Optional[str] = None, **extra):
+    update = {"status": status, "link_id": link_id, "error": error, "updated_at": datetime.utcnow()}
+    update.update(extra)
+    await jobs_collection.update_one({"_id": job_id}, {"$set": update})
+
+
+async def _process_job(job: Dict, on_scraped=None):
+    """
+    Scrape a single queued URL and store the resulting link.
+    on_scraped is called once the page has been fetched, so concurrency slots
+    are not held while the link waits for its batch write.
+    """
+    url = job["url"]
+    try:
+        canonical_url = job.get("canonical_url") or canonicalize_url(url)
+
+        # Another message may have added the URL while this job was queued
+        existing = await collection.find_one({"canonical_url": canonical_url}, {"_id": 1})
+        if existing:
+            logger.info(f"⚠️ URL already exists in DB: {url}")
+            await _finish_job(job["_id"], JOB_EXTRACTED, link_id=str(existing["_id"]), duplicate=True)
+            return
+
+        logger.info(f"🔍 Extracting metadata from: {url}")
+        metadata = await process_url(url)
+        if on_scraped:
+            on_scraped()
+
+        attempts = job.get("attempts", 1)
+        if metadata.get("retryable") and attempts < INGEST_MAX_ATTEMPTS:
+            # Host is down or rate limiting us: park the job rather than storing an error link
+            delay = max(INGEST_RETRY_DELAY * (2 ** (attempts - 1)), circuit_breaker.retry_after(url))
+            now = datetime.utcnow()
+            await jobs_collection.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "status": JOB_QUEUED,
+                    "available_at": now + timedelta(seconds=delay),
+                    "error": metadata.get("summary"),
+                    "updated_at": now
+                }}
+            )
+            logger.info(f"⏳ Retrying {url} in {delay:.0f}s (attempt {attempts}/{INGEST_MAX_ATTEMPTS})")
+            return
+
+        new_link = build_link(url, metadata, source=job.get("source") or "telegram")
+        # Finished links are written in unordered insert_many batches
+        outcome = await _link_writer.add(new_link.dict())
+        if outcome.duplicate:
+            # A concurrent delivery stored the same canonical URL first; the unique index keeps one copy
+            existing = await collection.find_one({"canonical_url": canonical_url}, {"_id": 1})
+            logger.info(f"⚠️ URL stored concurrently, skipping duplicate: {url}")
+            await _finish_job(job["_id"], JOB_EXTRACTED, link_id=str(existing["_id"]) if existing else None, duplicate=True)
+            return
+        if not outcome.ok:
+            raise RuntimeError(f"Failed to store link: {outcome.error}")
+        link_id = str(outcome.inserted_id)
+
+        if "Error" in metadata.get("tags", []):
+            await _finish_job(job["_id"], JOB_FAILED, link_id=link_id, error=metadata.get("summary"))
+            logger.warning(f"❌ Failed to scrape {url}: {metadata.get('summary')}")
+        else:
+            await _finish_job(job["_id"], JOB_EXTRACTED, link_id=link_id)
+            logger.info(f"✅ Saved: {metadata['title']} with {len(metadata.get('nested_links', []))} nested links")
+    except Exception as e:
+        logger.error(f"Error processing ingestion job for {url}: {e}", exc_info=True)
+        await _finish_job(job["_id"], JOB_FAILED, error=str(e))
+
+
+async def _wait_for_work():
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=INGEST_POLL_INTERVAL)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _run_job(job: Dict, domain: str):
+    released = False
+
+    def release_slots():
+        nonlocal released
+        if released:
+            return
+        released = True
+        _inflight_by_domain[domain] -= 1
+        if not _inflight_by_domain[domain]:
+            del _inflight_by_domain[domain]
+        _global_slots.release()
+        _notify_workers()
+
+    try:
+        await _process_job(job, on_scraped=release_slots)
+    finally:
+        release_slots()
+
+
+async def _dispatcher_loop():
+    """Claim queued jobs and run them concurrently within the global and per-domain limits"""
+    logger.info(f"📥 Ingestion dispatcher started (max {INGEST_MAX_CONCURRENCY} jobs, {INGEST_PER_DOMAIN_LIMIT} per domain)")
+    while True:
+        await _global_slots.acquire()
+        try:
+            _wakeup.clear()
+            job = await _claim_next_job()
+        except asyncio.CancelledError:
+            _global_slots.release()
+            raise
+        except Exception as e:
+            _global_slots.release()
+            logger.error(f"❌ Error claiming ingestion job: {e}")
+            await asyncio.sleep(INGEST_POLL_INTERVAL)
+            continue
+
+        if job is None:
+            _global_slots.release()
+            await _wait_for_work()
+            continue
+
+        domain = job.get("domain") or extract_domain(job["url"])
+        _inflight_by_domain[domain] = _inflight_by_domain.get(domain, 0) + 1
+        task = asyncio.create_task(_run_job(job, domain))
+        _running_jobs.add(task)
+        task.add_done_callback(_running_jobs.discard)
+
+
+async def requeue_stale_jobs():
+    """Return jobs stuck in 'fetching' (e.g. after a crash or restart) to the queue"""
+    cutoff = datetime.utcnow() - timedelta(minutes=INGEST_STALE_AFTER_MINUTES)
+    result = await jobs_collection.update_many(
+        {"status": JOB_FETCHING, "updated_at": {"$lt": cutoff}},
+        {"$set": {"status": JOB_QUEUED, "updated_at": datetime.utcnow()}}
+    )
+    if result.modified_count:
+        logger.info(f"Requeued {result.modified_count} stale ingestion jobs")
+
+
+async def backfill_canonical_urls(batch_size: int = 500):
+    """
+    Set canonical_url on links stored before it existed.
+    Legacy duplicates hit the unique index and are left without the field (logged).
+    """
+    updated = duplicates = 0
+    while True:
+        docs = await collection.find(
+            {"canonical_url": {"$exists": False}}, {"url": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+
+        requests = []
+        doc_ids = []
+        for doc in docs:
+            try:
+                canonical_url = canonicalize_url(doc.get("url") or "")
+            except Exception:
+                canonical_url = None
+            requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"canonical_url": canonical_url}}))
+            doc_ids.append(doc["_id"])
+
+        try:
+            result = await collection.bulk_write(requests, ordered=False)
+            updated += result.modified_count
+        except BulkWriteError as e:
+            updated += e.details.get("nModified", 0)
+            failed_ids = [doc_ids[err["index"]] for err in e.details.get("writeErrors", [])]
+            duplicates += len(failed_ids)
+            # Mark them so the next batch doesn't pick them up again
+            await collection.update_many({"_id": {"$in": failed_ids}}, {"$set": {"canonical_url": None}})
+
+    if updated or duplicates:
+        logger.info(f"Backfilled canonical_url on {updated} links ({duplicates} legacy duplicates left unset)")
+
+
+async def start_ingestion_workers():
+    """Start the background dispatcher (call from the app lifespan)"""
+    global _wakeup, _global_slots, _dispatcher_task, _link_writer
+    _wakeup = asyncio.Event()
+    _link_writer = LinkBatchWriter()
+    _global_slots = asyncio.Semaphore(INGEST_MAX_CONCURRENCY)
+
+    try:
+        await requeue_stale_jobs()
+    except Exception as e:
+        logger.warning(f"Could not requeue stale ingestion jobs: {e}")
+
+    _dispatcher_task = asyncio.create_task(_dispatcher_loop())
+    logger.info("✅ Ingestion workers started")
+
+
+async def stop_ingestion_workers():
+    """Cancel the dispatcher and running jobs; in-flight jobs are requeued on next startup"""
+    global _dispatcher_task
+    tasks = list(_running_jobs)
+    if _dispatcher_task is not None:
+        tasks.append(_dispatcher_task)
+        _dispatcher_task = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _inflight_by_domain.clear()
+    if _link_writer is not None:
+        await _link_writer.close()
+    logger.info("Ingestion workers stopped")
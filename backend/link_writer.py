@@ -0,0 +1,154 @@
+"""
+Batched writes for new links
+Ingestion paths hand finished link documents to a LinkBatchWriter, which writes
+them with unordered insert_many calls instead of one insert_one per link.
+Duplicate-key errors (unique canonical_url) are reported back per document.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import BulkWriteError
+from database import collection
+from counts import invalidate_counts
+import embeddings
+import near_duplicates
+import search_index
+
+logger = logging.getLogger(__name__)
+
+LINK_BATCH_SIZE = int(os.getenv("LINK_BATCH_SIZE", "50"))
+LINK_BATCH_DELAY = float(os.getenv("LINK_BATCH_DELAY", "0.5"))  # Seconds a partial batch may wait
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+@dataclass
+class InsertResult:
+    inserted_id: Optional[object] = None
+    duplicate: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.inserted_id is not None
+
+
+async def insert_links(docs: List[Dict]) -> List[InsertResult]:
+    """Insert documents with one unordered insert_many and return a result per document"""
+    if not docs:
+        return []
+
+    results = [InsertResult() for _ in docs]
+    failed = {}
+    try:
+        signatures = await near_duplicates.flag_duplicates(docs)
+    except Exception as e:
+        logger.warning(f"Near-duplicate check failed: {e}")
+        signatures = [None] * len(docs)
+    # The search index and embeddings sync on updated_at, so it must be the write time:
+    # documents can be built long before they are inserted (e.g. a backfill batch)
+    now = datetime.utcnow()
+    for doc in docs:
+        doc["updated_at"] = now
+    try:
+        # insert_many assigns _id to each dict client-side before sending
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            failed[err["index"]] = err
+    except Exception as e:
+        logger.error(f"Batch insert of {len(docs)} links failed: {e}")
+        return [InsertResult(error=str(e)) for _ in docs]
+
+    for index, doc in enumerate(docs):
+        err = failed.get(index)
+        if err is None:
+            results[index].inserted_id = doc["_id"]
+        elif err.get("code") == DUPLICATE_KEY_ERROR:
+            results[index].duplicate = True
+        else:
+            results[index].error = err.get("errmsg", "write error")
+    inserted = [doc for doc, result in zip(docs, results) if result.ok]
+    if len(inserted) < len(docs):
+        try:
+            await near_duplicates.resolve_failed(docs, [result.ok for result in results])
+        except Exception as e:
+            logger.warning(f"Repointing near-duplicates of failed links failed: {e}")
+    if inserted:
+        invalidate_counts()
+    try:
+        await search_index.index_documents(inserted)
+    except Exception as e:
+        logger.warning(f"Adding links to the search index failed: {e}")
+    try:
+        await embeddings.add_documents(inserted)
+    except Exception as e:
+        logger.warning(f"Embedding new links failed: {e}")
+    try:
+        await near_duplicates.store_signatures(inserted, [sig for sig, result in zip(signatures, results) if result.ok])
+    except Exception as e:
+        logger.warning(f"Saving near-duplicate signatures failed: {e}")
+    return results
+
+
+class LinkBatchWriter:
+    """Collects link documents from concurrent callers and flushes them in batches"""
+
+    def __init__(self, batch_size: int = LINK_BATCH_SIZE, max_delay: float = LINK_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes = set()
+
+    async def add(self, doc: Dict) -> InsertResult:
+        """Queue a document and wait until its batch has been written"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        # Every caller of add() must be woken up, whatever happens to the batch
+        try:
+            results = await insert_links([doc for doc, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            logger.info(f"💾 Wrote batch of {len(batch)} links ({sum(r.ok for r in results)} inserted)")
+        except Exception as e:
+            logger.error(f"Writing a batch of {len(batch)} links failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def close(self):
+        """Flush whatever is pending and wait for in-flight batches"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -6,15 +6,34 @@ import bcrypt
 from typing import Optional, List
 from contextlib import asynccontextmanager
 import os
-import re
 from datetime import datetime, timedelta
-from database import collection, users_collection, connect_to_database, close_database_connection
-from models import LinkSchema, LinkUpdate, UserSchema, Token, TokenData
-from scraper import process_url
+from database import collection, users_collection, connect_to_database, close_database_connection, ensure_indexes
+from models import LinkUpdate, UserSchema, Token, TokenData, CrawlRequest
+from ingestion import (
+    JOB_STATUSES, enqueue_urls, filter_new_urls, get_job, list_jobs, serialize_job,
+    start_ingestion_workers, stop_ingestion_workers, backfill_canonical_urls
+)
+from crawler import start_crawl, get_crawl, list_crawls, serialize_crawl, mark_interrupted_crawls, stop_crawls
+from search import build_search, backfill_search_terms
+import search_index
+from search_index import search_links, start_search_index, stop_search_index
+import embeddings
+from embeddings import related_links, semantic_links, start_embeddings, stop_embeddings
+from retag import start_retag, stop_retag, retag_status
+from tfidf import start_tfidf, stop_tfidf, start_rebuild, rebuild_status
+import near_duplicates
+from near_duplicates import start_scan, stop_scan, scan_status
+from refresher import start_refresher, stop_refresher, refresh_link_by_id
+from urls import find_urls
+from pagination import NEWEST_FIRST, decode_cursor, after_cursor, next_cursor
+from projections import VIEWS, VIEW_PATTERN
+from counts import count_links, invalidate_counts
+from update_store import claim_update
 from dotenv import load_dotenv
 import logging
 import asyncio
 from email_notifier import send_daily_digest, is_email_configured
+from scraper import close_http_client, shutdown_extraction_pool
 
 load_dotenv()
 
@@ -88,12 +107,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return user
 
 # --- Lifespan Management ---
+_backfill_tasks: List[asyncio.Task] = []  # Startup backfills, cancelled on shutdown if still running
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize connections and resources on startup, clean up on shutdown"""
     logger.info("Starting up application...")
     try:
         await connect_to_database()
+        await ensure_indexes()
         
         # Create or update default admin user from environment variables (do NOT hardcode credentials)
         admin_username = os.getenv("ADMIN_USERNAME")
@@ -127,6 +149,16 @@ async def lifespan(app: FastAPI):
         else:
             logger.warning("⚠️ Email credentials not set - email notifications disabled")
         
+        await start_tfidf()
+        await start_ingestion_workers()
+        await mark_interrupted_crawls()
+        start_refresher()
+        start_search_index()
+        start_embeddings()
+        # Populate canonical_url on legacy links without delaying startup
+        _backfill_tasks.append(asyncio.create_task(backfill_canonical_urls()))
+        _backfill_tasks.append(asyncio.create_task(backfill_search_terms()))
+        
         logger.info("Application startup complete")
     except Exception as e:
         logger.warning(f"Database connection issue: {e}")
@@ -137,8 +169,23 @@ async def lifespan(app: FastAPI):
     # Cleanup on shutdown
     logger.info("Shutting down application...")
     
-    logger.info("Shutting down application...")
     try:
+        for task in _backfill_tasks:
+            task.cancel()
+        for result in await asyncio.gather(*_backfill_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Startup backfill failed: {result}")
+        _backfill_tasks.clear()
+        await stop_ingestion_workers()
+        await stop_crawls()
+        await stop_refresher()
+        await stop_retag()
+        await stop_scan()
+        await stop_tfidf()
+        await stop_search_index()
+        await stop_embeddings()
+        await close_http_client()
+        shutdown_extraction_pool()
         await close_database_connection()
         logger.info("Application shutdown complete")
     except Exception as e:
@@ -219,11 +266,16 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
 async def get_links(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=1000),  # Increased max limit to 1000
+    cursor: Optional[str] = None,
     is_read: Optional[bool] = None,
     is_favorite: Optional[bool] = None,
     is_scheduled: Optional[bool] = None,
     tag: Optional[str] = None,
+    is_duplicate: Optional[bool] = None,
     search: Optional[str] = None,
+    mode: str = Query("text", pattern="^(text|semantic)$"),
+    view: str = Query("card", pattern=VIEW_PATTERN),
+    include_total: bool = True,
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -231,12 +283,32 @@ async def get_links(
     
     - **skip**: Number of items to skip (pagination)
     - **limit**: Max items to return (max 1000)
+    - **cursor**: `next_cursor` of the previous page; continues right after it at the same
+      cost however deep the page is (newest first, can't be combined with search)
     - **is_read**: Filter by read status
     - **is_favorite**: Filter by favorite status
     - **is_scheduled**: Filter by scheduled status
     - **tag**: Filter by specific tag
-    - **search**: Search in title, summary, and content
+    - **is_duplicate**: Only near-duplicates of an earlier link (true) or hide them (false)
+    - **search**: Full-text search in title, summary and content, best matches first
+      ("phrase", -exclude and prefix* are supported); with SEARCH_BACKEND=bm25 each
+      result also has a highlighted `snippet`
+    - **mode**: `semantic` ranks links by similarity in meaning to the search instead of
+      matching its words; each result has a `similarity`
+    - **view**: Fields to return: `card` (default), `calendar` (just what the calendar
+      draws) or `full` (everything but content, which only GET /api/links/{id} returns)
+    - **include_total**: Set to false to skip counting the matches (`total` is then null)
     """
+    if search and mode == "semantic" and not embeddings.ready():
+        raise HTTPException(status_code=503, detail="Semantic search is not available yet")
+    after = None
+    if cursor:
+        if search:
+            raise HTTPException(status_code=400, detail="cursor can't be combined with search, page with skip instead")
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     try:
         # Build filter query
         query = {}
@@ -256,29 +328,52 @@ async def get_links(
         if tag:
             query["tags"] = tag
         
+        if is_duplicate is not None:
+            query["duplicate_of"] = {"$ne": None} if is_duplicate else None
+        
+        if search and mode == "semantic":
+            links, total = await semantic_links(search, query, skip, limit, VIEWS[view])
+            for document in links:
+                document["id"] = str(document.pop("_id"))
+            return {"links": links, "total": total if include_total else None, "skip": skip, "limit": limit, "next_cursor": None}
+        
+        if search and search_index.ready():
+            # Embedded BM25 index: ranked ids come from the index, filters and documents from MongoDB
+            links, total = await search_links(search, query, skip, limit, VIEWS[view])
+            for document in links:
+                document["id"] = str(document.pop("_id"))
+            return {"links": links, "total": total if include_total else None, "skip": skip, "limit": limit, "next_cursor": None}
+        
+        ranked = False
         if search:
-            query["$or"] = [
-                {"title": {"$regex": search, "$options": "i"}},
-                {"summary": {"$regex": search, "$options": "i"}},
-                {"content": {"$regex": search, "$options": "i"}}
-            ]
+            search_query, ranked = build_search(search)
+            query.update(search_query)
         
-        # Get total count
-        total = await collection.count_documents(query)
+        # Get total count (of the whole filtered list, not just what's after the cursor)
+        total = await count_links(query) if include_total else None
         
-        # Get paginated results
+        # Get paginated results (best matches first when searching, newest first otherwise)
         links = []
-        cursor = collection.find(query).sort("created_at", -1).skip(skip).limit(limit)
-        async for document in cursor:
+        if ranked:
+            results = collection.find(query, {**VIEWS[view], "score": {"$meta": "textScore"}}).sort(
+                [("score", {"$meta": "textScore"}), ("created_at", -1)]
+            )
+        else:
+            if after:
+                query.update(after_cursor(*after))
+            results = collection.find(query, VIEWS[view]).sort(NEWEST_FIRST)
+        async for document in results.skip(skip).limit(limit):
             document["id"] = str(document["_id"])
             del document["_id"]
+            document.pop("score", None)
             links.append(document)
         
         return {
             "links": links,
             "total": total,
             "skip": skip,
-            "limit": limit
+            "limit": limit,
+            "next_cursor": None if search else next_cursor(links, limit)  # cursor can't be combined with search
         }
     except Exception as e:
         logger.error(f"Error fetching links: {e}")
@@ -300,6 +395,26 @@ async def get_link(link_id: str, current_user: dict = Depends(get_current_user))
         logger.error(f"Error fetching link {link_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/links/{link_id}/related")
+async def get_related_links(
+    link_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user)
+):
+    """Links most similar in content to this one, best first, each with a `similarity`"""
+    if not embeddings.ready():
+        raise HTTPException(status_code=503, detail="Embeddings are not available yet")
+    try:
+        links = await related_links(link_id, limit, VIEWS["card"])
+    except Exception as e:
+        logger.error(f"Error fetching links related to {link_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if links is None:
+        raise HTTPException(status_code=404, detail="Link not found")
+    for document in links:
+        document["id"] = str(document.pop("_id"))
+    return {"links": links}
+
 @app.patch("/api/links/{link_id}")
 async def update_link(link_id: str, update: LinkUpdate, current_user: dict = Depends(get_current_user)):
     """Update link properties (read status, favorite, tags)"""
@@ -315,6 +430,9 @@ async def update_link(link_id: str, update: LinkUpdate, current_user: dict = Dep
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Link not found")
+        invalidate_counts()
+        if "tags" in update_data:
+            await search_index.reindex_link(link_id)
         
         return {"status": "updated", "id": link_id}
     except Exception as e:
@@ -330,12 +448,28 @@ async def delete_link(link_id: str, current_user: dict = Depends(get_current_use
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Link not found")
+        invalidate_counts()
+        search_index.remove_document(link_id)
+        embeddings.remove_document(link_id)
+        await near_duplicates.remove_signature(ObjectId(link_id))
         
         return {"status": "deleted", "id": link_id}
     except Exception as e:
         logger.error(f"Error deleting link {link_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/links/{link_id}/refresh")
+async def refresh_link(link_id: str, current_user: dict = Depends(get_current_user)):
+    """Re-scrape a link now and update the fields that changed"""
+    try:
+        result = await refresh_link_by_id(link_id)
+    except Exception as e:
+        logger.error(f"Error refreshing link {link_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Link not found")
+    return {"status": result, "id": link_id}
+
 @app.get("/api/tags")
 async def get_all_tags(current_user: dict = Depends(get_current_user)):
     """Get all unique tags from the database"""
@@ -346,14 +480,47 @@ async def get_all_tags(current_user: dict = Depends(get_current_user)):
         logger.error(f"Error fetching tags: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/tags/retag")
+async def retag_links(current_user: dict = Depends(get_current_user)):
+    """Apply the current tag taxonomy to existing links in the background (user-added tags are kept)"""
+    started = start_retag()
+    return {"status": "started" if started else "already_running", **retag_status()}
+
+@app.get("/api/tags/retag")
+async def get_retag_status(current_user: dict = Depends(get_current_user)):
+    """Progress of the last retag run"""
+    return retag_status()
+
+@app.post("/api/tags/keywords")
+async def rebuild_keywords(current_user: dict = Depends(get_current_user)):
+    """Recompute TF-IDF statistics and topic clusters, then refresh keywords/suggested_tags on every link"""
+    started = start_rebuild()
+    return {"status": "started" if started else "already_running", **rebuild_status()}
+
+@app.get("/api/tags/keywords")
+async def get_keywords_status(current_user: dict = Depends(get_current_user)):
+    """Progress of the last TF-IDF rebuild"""
+    return rebuild_status()
+
+@app.post("/api/duplicates/scan")
+async def scan_duplicates(current_user: dict = Depends(get_current_user)):
+    """Find near-duplicate links across the whole library in the background and set duplicate_of"""
+    started = start_scan()
+    return {"status": "started" if started else "already_running", **scan_status()}
+
+@app.get("/api/duplicates/scan")
+async def get_duplicates_scan_status(current_user: dict = Depends(get_current_user)):
+    """Progress of the last near-duplicate scan"""
+    return scan_status()
+
 @app.get("/api/stats")
 async def get_statistics(current_user: dict = Depends(get_current_user)):
     """Get library statistics"""
     try:
-        total = await collection.count_documents({})
-        read = await collection.count_documents({"is_read": True})
-        favorites = await collection.count_documents({"is_favorite": True})
-        scheduled = await collection.count_documents({"scheduled_at": {"$ne": None}})
+        total = await count_links({})
+        read = await count_links({"is_read": True})
+        favorites = await count_links({"is_favorite": True})
+        scheduled = await count_links({"scheduled_at": {"$ne": None}})
         
         return {
             "total_links": total,
@@ -366,6 +533,73 @@ async def get_statistics(current_user: dict = Depends(get_current_user)):
         logger.error(f"Error fetching stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Ingestion Job Status ---
+@app.get("/api/ingest/jobs")
+async def get_ingest_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    """List recent ingestion jobs, optionally filtered by status (queued/fetching/extracted/failed)"""
+    if status and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status. Use one of: {', '.join(JOB_STATUSES)}")
+    try:
+        jobs = await list_jobs(status=status, limit=limit)
+        return {"jobs": [serialize_job(job) for job in jobs]}
+    except Exception as e:
+        logger.error(f"Error fetching ingestion jobs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the state of a single ingestion job"""
+    try:
+        job = await get_job(job_id)
+    except Exception as e:
+        logger.error(f"Error fetching ingestion job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_job(job)
+
+# --- Nested-Link Crawls ---
+@app.post("/api/crawl")
+async def create_crawl(crawl: CrawlRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Scrape a page and follow its nested links in the background (e.g. an awesome-list)
+    
+    - **max_depth**: How many link hops to follow from the page (capped by CRAWL_MAX_DEPTH)
+    - **max_pages**: Page budget for the whole crawl (capped by CRAWL_MAX_PAGES)
+    """
+    try:
+        crawl_id = await start_crawl(crawl.url, max_depth=crawl.max_depth, max_pages=crawl.max_pages)
+        return {"status": "started", "id": crawl_id}
+    except Exception as e:
+        logger.error(f"Error starting crawl of {crawl.url}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/crawl")
+async def get_crawls(limit: int = Query(20, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    """List recent crawls with their progress"""
+    try:
+        crawls = await list_crawls(limit=limit)
+        return {"crawls": [serialize_crawl(crawl, include_links=False) for crawl in crawls]}
+    except Exception as e:
+        logger.error(f"Error fetching crawls: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/crawl/{crawl_id}")
+async def get_crawl_status(crawl_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the progress of a single crawl"""
+    try:
+        crawl = await get_crawl(crawl_id)
+    except Exception as e:
+        logger.error(f"Error fetching crawl {crawl_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not crawl:
+        raise HTTPException(status_code=404, detail="Crawl not found")
+    return serialize_crawl(crawl)
+
 # --- Telegram Webhook ---
 @app.post("/webhooks/telegram")
 async def telegram_webhook(request: Request):
@@ -375,6 +609,13 @@ async def telegram_webhook(request: Request):
     """
     try:
         data = await request.json()
+        
+        # Telegram redelivers slow updates; answer repeats without touching the scraper or links
+        update_id = data.get("update_id")
+        if not await claim_update(update_id):
+            logger.info(f"Ignoring redelivered Telegram update {update_id}")
+            return {"ok": True, "duplicate_update": True}
+        
         logger.info(f"Received Telegram webhook: {data}")
         
         # Telegram update structure is much simpler than WhatsApp
@@ -396,55 +637,30 @@ async def telegram_webhook(request: Request):
         
         logger.info(f"Processing message from {chat_type}: {text[:100]}...")
         
-        # Regex to find URLs
-        urls = re.findall(r'https?://\S+', text)
+        # Find URLs (trailing punctuation stripped)
+        urls = find_urls(text)
         
         if not urls:
             logger.info("No URLs found in message")
             return {"ok": True}
         
-        processed_count = 0
-        
-        for url in urls:
-            # Clean URL (remove trailing punctuation)
-            url = url.rstrip('.,;:!?')
-            
-            logger.info(f"📥 Processing URL: {url}")
-            
-            # Check duplication in DB
-            existing = await collection.find_one({"url": url})
-            if existing:
-                logger.warning(f"⚠️ URL already exists in DB: {url}")
-                continue
-            
-            # Extract metadata from URL
-            logger.info(f"🔍 Extracting metadata from: {url}")
-            metadata = process_url(url)
-            
-            # Save to MongoDB
-            new_link = LinkSchema(
-                url=url,
-                title=metadata["title"],
-                summary=metadata["summary"],
-                content=metadata.get("content"),
-                author=metadata.get("author"),
-                tags=metadata.get("tags", []),
-                domain=metadata.get("domain"),
-                reading_time=metadata.get("reading_time", 0),
-                image_url=metadata.get("image_url"),
-                video_url=metadata.get("video_url"),
-                source="telegram",
-                nested_links=metadata.get("nested_links", [])
-            )
-            
-            await collection.insert_one(new_link.dict())
-            logger.info(f"✅ Saved: {metadata['title']} with {len(metadata.get('nested_links', []))} nested links")
-            processed_count += 1
+        # "/crawl <url>" expands a reading list into library entries instead of saving one link
+        if text.startswith("/crawl"):
+            crawl_ids = [await start_crawl(url) for url in urls]
+            return {"ok": True, "urls_found": len(urls), "crawl_ids": crawl_ids}
+        
+        # One batched lookup for the whole message, comparing canonical URLs
+        queued_urls = await filter_new_urls(urls)
+        
+        # Scraping happens in the background ingestion workers so Telegram gets a fast 200
+        job_ids = await enqueue_urls(queued_urls, source="telegram", chat_id=chat_id)
+        logger.info(f"📥 Queued {len(job_ids)} URLs for ingestion")
         
         return {
             "ok": True,
-            "urls_processed": processed_count,
-            "urls_found": len(urls)
+            "urls_queued": len(job_ids),
+            "urls_found": len(urls),
+            "job_ids": job_ids
         }
     
     except Exception as e:
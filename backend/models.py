@@ -4,20 +4,29 @@ from datetime import datetime
 
 class LinkSchema(BaseModel):
     url: str
+    canonical_url: Optional[str] = None  # Normalized URL used for deduplication (unique index)
     title: str = "No Title"
     summary: Optional[str] = None
     content: Optional[str] = None  # Full extracted content
     tags: List[str] = Field(default_factory=list)  # Auto-generated tags
+    auto_tags: List[str] = Field(default_factory=list)  # Tags from the taxonomy (the rest of `tags` were added by the user)
+    taxonomy_version: Optional[str] = None  # Taxonomy the auto tags came from (retag.py skips links already on it)
+    keywords: List[str] = Field(default_factory=list)  # Top TF-IDF terms against the whole library
+    suggested_tags: List[str] = Field(default_factory=list)  # Label of the nearest topic cluster
+    search_terms: List[str] = Field(default_factory=list)  # Distinct title/summary words for prefix search
+    duplicate_of: Optional[str] = None  # Id of the earliest link with near-identical text (see near_duplicates.py)
     source: str = "whatsapp"
     domain: Optional[str] = None  # e.g., "arxiv.org"
     author: Optional[str] = None
     reading_time: Optional[int] = None  # Minutes
+    word_count: Optional[int] = None
     image_url: Optional[str] = None
     video_url: Optional[str] = None
     is_read: bool = False
     is_favorite: bool = False
     nested_links: List[str] = Field(default_factory=list)
     scheduled_at: Optional[datetime] = None
+    last_fetched_at: Optional[datetime] = None  # When the page was last scraped (used by the refresher)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -47,6 +56,18 @@ class LinkUpdate(BaseModel):
     tags: Optional[List[str]] = None
     scheduled_at: Optional[datetime] = None
 
+class CrawlRequest(BaseModel):
+    """Start a crawl that follows a page's nested links"""
+    url: str
+    max_depth: int = Field(1, ge=0)  # 0 = only the page itself, 1 = the page and the links on it
+    max_pages: int = Field(50, ge=1)
+
+    @validator('url')
+    def validate_url(cls, v):
+        if not v.startswith(('http://', 'https://')):
+            raise ValueError('URL must start with http:// or https://')
+        return v
+
 class WebhookPayload(BaseModel):
     """WhatsApp Cloud API webhook payload structure"""
     object: str
@@ -0,0 +1,378 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH buckets
+Exact-URL deduplication misses the same article reached through a mirror, an AMP page, a
+re-post or a newsletter copy. Each link's extracted text is reduced to a MinHash signature
+of its word 3-grams: the fraction of equal signature values estimates the Jaccard
+similarity of two texts. The signature is cut into bands, and each band hashes to a bucket
+key; links sharing a key are candidates (locality-sensitive hashing).
+
+Signatures and their bucket keys are stored in the `link_signatures` collection with a
+multikey index on the keys, so a new link is checked with one indexed lookup of its
+NEAR_DUP_BANDS keys, however large the library is. A new link whose estimated similarity
+to a stored one reaches NEAR_DUP_THRESHOLD gets `duplicate_of` set to the earliest copy.
+
+The batch job signs links stored before this existed and re-clusters the whole library:
+links sharing a bucket are verified against their full signatures, and each connected
+group points at its earliest link.
+
+Usage:
+    python near_duplicates.py [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from bson import ObjectId
+from bson.binary import Binary
+from pymongo import ReplaceOne, UpdateOne
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from database import collection, signatures_collection, close_database_connection
+from counts import invalidate_counts
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() in ("1", "true", "yes")
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))  # Estimated Jaccard similarity of word 3-grams
+NEAR_DUP_MAX_CHARS = int(os.getenv("NEAR_DUP_MAX_CHARS", "50000"))  # Text compared per link
+NEAR_DUP_BATCH_SIZE = int(os.getenv("NEAR_DUP_BATCH_SIZE", "500"))
+
+SHINGLE_WORDS = 3
+MIN_SHINGLES = 20  # Shorter texts (stubs, error pages) are never flagged
+NEAR_DUP_PERMUTATIONS = 128
+NEAR_DUP_BANDS = 32  # 4 values per band: pairs at 0.7 similarity share a bucket >99.9% of the time
+MAX_CANDIDATES = 500  # Stored signatures read per new link, most shared buckets first
+SIGNATURE_CHUNK = 8192  # Shingles hashed per vectorized step
+
+# Multiply-shift hash functions (a odd): h(x) = ((a * x + b) mod 2**64) >> 32
+_rng = np.random.default_rng(1)
+_A = _rng.integers(0, 2 ** 63, NEAR_DUP_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NEAR_DUP_PERMUTATIONS, dtype=np.uint64)
+FNV_PRIME = np.uint64(1099511628211)
+
+WORD = re.compile(r"\w+")
+
+_scan_task: Optional[asyncio.Task] = None
+_status: Dict = {"running": False}
+
+
+def comparable_text(doc: Dict) -> str:
+    """The text a link is compared by (titles differ between mirrors, so they are left out)"""
+    if "Error" in (doc.get("tags") or []):
+        return ""
+    return doc.get("content") or doc.get("summary") or ""
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature (uint32 x NEAR_DUP_PERMUTATIONS) of the text's word 3-grams (SHINGLE_WORDS); None if too short"""
+    words = WORD.findall(text[:NEAR_DUP_MAX_CHARS].lower())
+    if len(words) < SHINGLE_WORDS + MIN_SHINGLES - 1:
+        return None
+    vocabulary: Dict[str, int] = {}
+    codes = np.fromiter((vocabulary.setdefault(word, len(vocabulary)) for word in words), dtype=np.int64, count=len(words))
+    hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in vocabulary), dtype=np.uint64, count=len(vocabulary))[codes]
+    # Hash each run of SHINGLE_WORDS word hashes into one 32-bit shingle (FNV-style)
+    n = len(hashes) - SHINGLE_WORDS + 1
+    shingles = hashes[:n].copy()
+    for offset in range(1, SHINGLE_WORDS):
+        shingles = ((shingles * FNV_PRIME) ^ hashes[offset:offset + n]) & np.uint64(0xFFFFFFFF)
+    shingles = np.unique(shingles)
+    # Every hash function over every shingle, keeping the minimum per function
+    minimum = np.full(NEAR_DUP_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(shingles), SIGNATURE_CHUNK):
+        chunk = shingles[start:start + SIGNATURE_CHUNK]
+        np.minimum(minimum, (_A[:, None] * chunk[None, :] + _B[:, None]).min(axis=1), out=minimum)
+    return (minimum >> np.uint64(32)).astype(np.uint32)
+
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """LSH bucket key per band (n x NEAR_DUP_BANDS, int64, band number in the top bits)"""
+    bands = np.atleast_2d(signatures).reshape(-1, NEAR_DUP_BANDS, NEAR_DUP_PERMUTATIONS // NEAR_DUP_BANDS).astype(np.uint64)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    for row in range(bands.shape[2]):
+        keys = (keys ^ bands[:, :, row]) * FNV_PRIME
+    band = np.arange(NEAR_DUP_BANDS, dtype=np.uint64) << np.uint64(59)
+    return ((keys >> np.uint64(5)) | band).astype(np.int64)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of signature rows"""
+    return (np.atleast_2d(a) == np.atleast_2d(b)).mean(axis=1)
+
+
+def _signature_document(link_id, sig: np.ndarray) -> Dict:
+    return {"_id": link_id, "minhash": Binary(sig.tobytes()), "buckets": band_keys(sig)[0].tolist()}
+
+
+def _from_binary(value) -> np.ndarray:
+    return np.frombuffer(value, dtype=np.uint32)
+
+
+async def _candidates(keys: np.ndarray) -> List[Dict]:
+    """
+    Stored signatures sharing a bucket with these band keys, those sharing the most first
+    (true matches share several bands, so a crowded bucket can't push them past the limit)
+    """
+    keys = keys.tolist()
+    stored = await signatures_collection.aggregate([
+        {"$match": {"buckets": {"$in": keys}}},
+        {"$addFields": {"shared": {"$size": {"$filter": {"input": "$buckets", "cond": {"$in": ["$$this", keys]}}}}}},
+        {"$sort": {"shared": -1}},
+        {"$limit": MAX_CANDIDATES},
+        {"$project": {"minhash": 1, "buckets": 1}},
+    ]).to_list(length=MAX_CANDIDATES)
+    if len(stored) == MAX_CANDIDATES:
+        logger.info(f"🪞 Near-duplicate lookup hit MAX_CANDIDATES ({MAX_CANDIDATES}); comparing the closest only")
+    return stored
+
+
+async def flag_duplicates(docs: List[Dict]) -> List[Optional[np.ndarray]]:
+    """
+    Set `duplicate_of` on new link documents (before they are inserted) that match a stored
+    link or an earlier document of the same batch. Returns each document's signature.
+    """
+    if not NEAR_DUP_ENABLED or not docs:
+        return [None] * len(docs)
+    sigs = await asyncio.to_thread(lambda: [signature(comparable_text(doc)) for doc in docs])
+    signed = [i for i, sig in enumerate(sigs) if sig is not None]
+    if not signed:
+        return sigs
+    keys = band_keys(np.stack([sigs[i] for i in signed]))
+    stored = await asyncio.gather(*(_candidates(row) for row in keys))
+
+    matches: Dict[int, object] = {}  # Document index -> matching link _id
+    for row, i in enumerate(signed):
+        docs[i].setdefault("_id", ObjectId())
+        own = set(keys[row].tolist())
+        candidates = [(c["_id"], _from_binary(c["minhash"])) for c in stored[row]]
+        candidates += [(docs[j]["_id"], sigs[j]) for earlier, j in enumerate(signed[:row]) if own.intersection(keys[earlier].tolist())]
+        if not candidates:
+            continue
+        scores = similarity(np.stack([sig for _, sig in candidates]), sigs[i])
+        best = int(scores.argmax())
+        if scores[best] >= NEAR_DUP_THRESHOLD:
+            matches[i] = candidates[best][0]
+    if not matches:
+        return sigs
+
+    # Point at the earliest copy: a match that is itself a duplicate passes on its original
+    batch_roots = {doc["_id"]: doc.get("duplicate_of") for doc in docs if "_id" in doc}
+    stored_ids = [m for m in matches.values() if m not in batch_roots]
+    stored_roots = {
+        doc["_id"]: doc.get("duplicate_of")
+        async for doc in collection.find({"_id": {"$in": stored_ids}}, {"duplicate_of": 1})
+    } if stored_ids else {}
+    for i in sorted(matches):
+        match = matches[i]
+        if match in batch_roots:
+            docs[i]["duplicate_of"] = batch_roots[match] or str(match)
+        elif match in stored_roots:  # Otherwise the matched link has since been deleted
+            docs[i]["duplicate_of"] = stored_roots[match] or str(match)
+        batch_roots[docs[i]["_id"]] = docs[i].get("duplicate_of")
+    flagged = sum(1 for i in matches if docs[i].get("duplicate_of"))
+    if flagged:
+        logger.info(f"🪞 Flagged {flagged} near-duplicate links")
+    return sigs
+
+
+def _repoint_failed(docs: List[Dict], ok: List[bool]) -> List[Dict]:
+    """
+    Inserted documents flagged as copies of a batch-mate that failed to insert: the earliest
+    of them becomes the original and the others point at it. Returns the documents changed.
+    """
+    failed = {str(doc["_id"]) for doc, inserted in zip(docs, ok) if not inserted and "_id" in doc}
+    new_roots: Dict[str, str] = {}
+    changed = []
+    for doc, inserted in zip(docs, ok):
+        target = doc.get("duplicate_of")
+        if not inserted or target not in failed:
+            continue
+        doc["duplicate_of"] = new_roots.get(target)
+        new_roots.setdefault(target, str(doc["_id"]))
+        changed.append(doc)
+    return changed
+
+
+async def resolve_failed(docs: List[Dict], ok: List[bool]):
+    """Fix `duplicate_of` (set by flag_duplicates) after insert_many so none point at a link that wasn't inserted"""
+    changed = _repoint_failed(docs, ok)
+    if changed:
+        await collection.bulk_write(
+            [UpdateOne({"_id": doc["_id"]}, {"$set": {"duplicate_of": doc["duplicate_of"]}}) for doc in changed],
+            ordered=False
+        )
+
+
+async def store_signatures(docs: List[Dict], sigs: List[Optional[np.ndarray]]):
+    """Save the signatures of inserted links so later links can be compared with them"""
+    requests = [
+        ReplaceOne({"_id": doc["_id"]}, _signature_document(doc["_id"], sig), upsert=True)
+        for doc, sig in zip(docs, sigs) if sig is not None
+    ]
+    if requests:
+        await signatures_collection.bulk_write(requests, ordered=False)
+
+
+async def update_signature(link_id, text: str):
+    """Re-sign a link whose text changed (its duplicate_of is revisited by the next scan)"""
+    if not NEAR_DUP_ENABLED:
+        return
+    sig = await asyncio.to_thread(signature, text)
+    if sig is None:
+        await signatures_collection.delete_one({"_id": link_id})
+    else:
+        await signatures_collection.replace_one({"_id": link_id}, _signature_document(link_id, sig), upsert=True)
+
+
+async def remove_signature(link_id):
+    await signatures_collection.delete_one({"_id": link_id})
+
+
+# --- Batch job ---
+
+def cluster(signatures: np.ndarray) -> np.ndarray:
+    """
+    Index of each row's cluster root (its earliest row; rows are in insertion order).
+    Rows sharing a bucket are compared with the bucket's earliest row only, which keeps
+    verification linear; clusters still connect through the other bands.
+    """
+    n = len(signatures)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    keys = band_keys(signatures)
+    firsts, members = [], []
+    for band in range(NEAR_DUP_BANDS):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        run_start = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        run_first = order[np.repeat(run_start, np.diff(np.append(run_start, n)))]
+        candidate = run_first != order
+        firsts.append(run_first[candidate])
+        members.append(order[candidate])
+    pairs = np.unique(np.stack((np.concatenate(firsts), np.concatenate(members)), axis=1), axis=0)
+    verified = np.zeros(len(pairs), dtype=bool)
+    for start in range(0, len(pairs), SIGNATURE_CHUNK):
+        chunk = pairs[start:start + SIGNATURE_CHUNK]
+        verified[start:start + SIGNATURE_CHUNK] = similarity(signatures[chunk[:, 0]], signatures[chunk[:, 1]]) >= NEAR_DUP_THRESHOLD
+    pairs = pairs[verified]
+    graph = sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    roots = np.full(labels.max() + 1, n, dtype=np.int64)
+    np.minimum.at(roots, labels, np.arange(n))
+    return roots[labels]
+
+
+async def scan_library(batch_size: int = NEAR_DUP_BATCH_SIZE) -> Dict:
+    """Sign links without a signature, cluster the whole library and update duplicate_of"""
+    _status.update(
+        running=True, phase="signing", processed=0, signed=0, duplicates=0, clusters=0, changed=0,
+        error=None, started_at=datetime.utcnow(), finished_at=None
+    )
+    ids: List[object] = []
+    current: List[Optional[str]] = []
+    sig_rows: List[np.ndarray] = []
+    sig_index: List[int] = []  # Position in ids of each signature row
+    last_id = None
+    try:
+        # Pass 1: read ids in _id (insertion) order; text is only read for links not signed yet
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            docs = await collection.find(query, {"duplicate_of": 1}).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                break
+            last_id = docs[-1]["_id"]
+            batch_ids = [doc["_id"] for doc in docs]
+            known = {s["_id"]: _from_binary(s["minhash"]) async for s in signatures_collection.find({"_id": {"$in": batch_ids}})}
+            missing = [link_id for link_id in batch_ids if link_id not in known]
+            if missing:
+                texts = [doc async for doc in collection.find({"_id": {"$in": missing}}, {"content": 1, "summary": 1, "tags": 1})]
+                new = await asyncio.to_thread(lambda: {doc["_id"]: signature(comparable_text(doc)) for doc in texts})
+                new = {link_id: sig for link_id, sig in new.items() if sig is not None}
+                await store_signatures([{"_id": link_id} for link_id in new], list(new.values()))
+                known.update(new)
+                _status["signed"] += len(new)
+            for doc in docs:
+                if doc["_id"] in known:
+                    sig_index.append(len(ids))
+                    sig_rows.append(known[doc["_id"]])
+                ids.append(doc["_id"])
+                current.append(doc.get("duplicate_of"))
+            _status["processed"] += len(docs)
+            logger.info(f"🪞 Read {_status['processed']} links ({_status['signed']} newly signed)")
+
+        # Pass 2: cluster in memory (512 bytes per signed link)
+        _status["phase"] = "clustering"
+        matrix = np.stack(sig_rows) if sig_rows else np.zeros((0, NEAR_DUP_PERMUTATIONS), dtype=np.uint32)
+        roots = await asyncio.to_thread(cluster, matrix)
+        wanted: List[Optional[str]] = [None] * len(ids)
+        for row, root in enumerate(roots):
+            if root != row:
+                wanted[sig_index[row]] = str(ids[sig_index[root]])
+        _status["duplicates"] = sum(1 for w in wanted if w)
+        _status["clusters"] = len({w for w in wanted if w})
+
+        # Pass 3: write only the links whose duplicate_of changed
+        _status["phase"] = "writing"
+        requests = [
+            UpdateOne({"_id": link_id}, {"$set": {"duplicate_of": want}})
+            for link_id, want, have in zip(ids, wanted, current) if want != have
+        ]
+        for start in range(0, len(requests), batch_size):
+            await collection.bulk_write(requests[start:start + batch_size], ordered=False)
+        if requests:
+            invalidate_counts()
+        _status["changed"] = len(requests)
+        logger.info(f"🪞 {_status['duplicates']} near-duplicates in {_status['clusters']} clusters ({len(requests)} links updated)")
+    except Exception as e:
+        _status["error"] = str(e)
+        raise
+    finally:
+        _status.update(running=False, phase=None, finished_at=datetime.utcnow())
+    return dict(_status)
+
+
+def scan_status() -> Dict:
+    return dict(_status)
+
+
+def start_scan() -> bool:
+    """Run scan_library in the background; False if a run is already in progress"""
+    global _scan_task
+    if _scan_task is not None and not _scan_task.done():
+        return False
+
+    async def run():
+        try:
+            await scan_library()
+        except Exception as e:
+            logger.error(f"Near-duplicate scan failed: {e}", exc_info=True)
+
+    _scan_task = asyncio.create_task(run())
+    return True
+
+
+async def stop_scan():
+    if _scan_task is not None and not _scan_task.done():
+        _scan_task.cancel()
+        await asyncio.gather(_scan_task, return_exceptions=True)
+
+
+async def main(args):
+    try:
+        result = await scan_library(batch_size=args.batch_size)
+        print(f"✅ Found {result['duplicates']} near-duplicates in {result['clusters']} clusters "
+              f"({result['processed']} links, {result['signed']} newly signed, {result['changed']} updated)")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Find near-duplicate links across the library and set duplicate_of")
+    parser.add_argument("--batch-size", type=int, default=NEAR_DUP_BATCH_SIZE, help="Links per read/bulk_write batch")
+    asyncio.run(main(parser.parse_args()))
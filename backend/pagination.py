@@ -0,0 +1,49 @@
+"""
+Keyset pagination for the link list
+Pages with skip make MongoDB walk and discard every skipped document, so deep pages get
+slower and links added between page loads shift what each page shows. A cursor instead
+remembers the (created_at, _id) of the last link on the page; the next page is a range
+query on the compound created_at/_id index (created by database.ensure_indexes) that
+starts right after it, so page 500 costs the same as page 1. _id breaks ties between
+links created in the same millisecond.
+Cursors are opaque to clients: URL-safe base64 of a small JSON object.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+
+NEWEST_FIRST = [("created_at", -1), ("_id", -1)]
+
+
+def encode_cursor(created_at: datetime, link_id: Any) -> str:
+    """Cursor pointing just after the link with this created_at and _id"""
+    payload = json.dumps({"t": created_at.isoformat(), "id": str(link_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """(created_at, _id) of a cursor, ValueError if it wasn't made by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def after_cursor(created_at: datetime, link_id: ObjectId) -> Dict:
+    """Filter matching the links that come after the cursor in NEWEST_FIRST order"""
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": link_id}},
+    ]}
+
+
+def next_cursor(links: List[Dict], limit: int) -> Optional[str]:
+    """Cursor for the page after `links`, None when this page was the last one"""
+    if len(links) < limit or not links:
+        return None
+    last = links[-1]
+    return encode_cursor(last["created_at"], last["id"])
@@ -0,0 +1,46 @@
+"""
+Field projections for link lists
+A stored link carries its full extracted content, every nested link found on the page
+and internal fields (search terms, TF-IDF keywords), none of which a list shows. List
+endpoints take a `view` naming what the client draws, and MongoDB only returns those
+fields; the full content is only returned by GET /api/links/{id}.
+    card        what a link card shows (the default); nested_links is cut to the first
+                NESTED_LINKS_PREVIEW, with nested_links_count holding the full length
+    calendar    the calendar grid and its upcoming-reading cards (the same link cards, so
+                with the same nested links preview)
+    full        every stored field except content
+"""
+from typing import Dict, Optional
+
+NESTED_LINKS_PREVIEW = 3  # The card shows the first three and "+N more"
+
+CALENDAR_FIELDS = [
+    "url", "title", "summary", "tags", "domain", "author", "reading_time", "image_url",
+    "video_url", "is_read", "is_favorite", "scheduled_at", "created_at",
+]
+
+NESTED_LINKS_FIELDS = {
+    "nested_links": {"$slice": NESTED_LINKS_PREVIEW},
+    "nested_links_count": {"$size": {"$ifNull": ["$nested_links", []]}},
+}
+
+VIEWS: Dict[str, Dict] = {
+    "card": {
+        **{field: 1 for field in CALENDAR_FIELDS},
+        "source": 1,
+        "duplicate_of": 1,
+        "updated_at": 1,
+        **NESTED_LINKS_FIELDS,
+    },
+    "calendar": {**{field: 1 for field in CALENDAR_FIELDS}, **NESTED_LINKS_FIELDS},
+    "full": {"content": 0},
+}
+
+VIEW_PATTERN = f"^({'|'.join(VIEWS)})$"
+
+
+def with_content(projection: Dict) -> Optional[Dict]:
+    """The same projection with content added back (search snippets are cut from it)"""
+    if projection.get("content") == 0:
+        return {field: value for field, value in projection.items() if field != "content"} or None
+    return {**projection, "content": 1}
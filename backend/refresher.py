@@ -0,0 +1,204 @@
+"""
+Background re-scrape of stale and failed links
+Links whose scrape failed, or whose snapshot is older than REFRESH_MAX_AGE_DAYS, are
+picked oldest-first by `last_fetched_at` and scraped again through process_url (so
+cached pages are revalidated with conditional requests). Only fields that changed are
+written back. Failures back off exponentially via `fetch_failures`/`next_fetch_at`.
+The refresher has its own small budget and pauses while live ingestion is busy.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from database import collection
+from counts import invalidate_counts
+from ingestion import ingestion_busy
+from scraper import process_url
+from search import search_terms
+import circuit_breaker
+import embeddings
+import near_duplicates
+import search_index
+import tfidf
+
+logger = logging.getLogger(__name__)
+
+REFRESH_ENABLED = os.getenv("REFRESH_ENABLED", "true").lower() in ("1", "true", "yes")
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "300"))  # Seconds between sweeps
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", "20"))  # Links re-scraped per sweep
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "2"))
+REFRESH_MAX_AGE_DAYS = float(os.getenv("REFRESH_MAX_AGE_DAYS", "30"))  # Healthy links are re-checked after this
+REFRESH_BACKOFF_MINUTES = float(os.getenv("REFRESH_BACKOFF_MINUTES", "30"))  # First retry delay, doubled per failure
+REFRESH_MAX_BACKOFF_DAYS = float(os.getenv("REFRESH_MAX_BACKOFF_DAYS", "7"))
+REFRESH_MAX_FAILURES = int(os.getenv("REFRESH_MAX_FAILURES", "8"))  # Give up on a link after this many failures
+REFRESH_LEASE_MINUTES = 15  # A claimed link is hidden from other workers for this long
+
+# Fields taken from a fresh scrape; tags are only replaced when the old snapshot was an error
+REFRESHED_FIELDS = (
+    "title", "summary", "content", "author", "domain", "reading_time", "word_count",
+    "image_url", "video_url", "nested_links"
+)
+
+_refresher_task: Optional[asyncio.Task] = None
+
+
+def _backoff(failures: int) -> timedelta:
+    minutes = REFRESH_BACKOFF_MINUTES * (2 ** max(failures - 1, 0))
+    return min(timedelta(minutes=minutes), timedelta(days=REFRESH_MAX_BACKOFF_DAYS))
+
+
+def _due_query(errors: bool, now: datetime) -> Dict:
+    """Failed links (any age) or healthy links with an old snapshot, excluding ones backing off"""
+    query = {
+        "$and": [
+            {"$or": [{"next_fetch_at": None}, {"next_fetch_at": {"$lte": now}}]},
+            {"fetch_failures": {"$not": {"$gte": REFRESH_MAX_FAILURES}}}
+        ]
+    }
+    if errors:
+        query["tags"] = "Error"
+    else:
+        cutoff = now - timedelta(days=REFRESH_MAX_AGE_DAYS)
+        query["tags"] = {"$ne": "Error"}
+        query["$and"].append({"$or": [{"last_fetched_at": None}, {"last_fetched_at": {"$lt": cutoff}}]})
+    return query
+
+
+async def _claim_link(errors: bool) -> Optional[Dict]:
+    """Atomically lease the oldest due link so concurrent workers don't refresh it twice"""
+    now = datetime.utcnow()
+    return await collection.find_one_and_update(
+        _due_query(errors, now),
+        {"$set": {"next_fetch_at": now + timedelta(minutes=REFRESH_LEASE_MINUTES)}},
+        sort=[("last_fetched_at", ASCENDING)],
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+def scrape_failed(link: Dict, metadata: Dict) -> bool:
+    """An error result, or a page that no longer yields text although the stored snapshot has some"""
+    return "Error" in metadata.get("tags", []) or (not metadata.get("content") and bool(link.get("content")))
+
+
+def changed_fields(link: Dict, metadata: Dict) -> Dict:
+    """Return the fields of a fresh scrape that differ from the stored link (empty values never replace stored ones)"""
+    changes = {
+        field: metadata.get(field)
+        for field in REFRESHED_FIELDS
+        if metadata.get(field) and metadata.get(field) != link.get(field)
+    }
+    # Tags may have been edited by the user; only an error snapshot's tags are replaced
+    if "Error" in link.get("tags", []) and metadata.get("tags") != link.get("tags"):
+        changes["tags"] = changes["auto_tags"] = metadata.get("tags", [])
+        changes["taxonomy_version"] = metadata.get("taxonomy_version")
+    return changes
+
+
+async def refresh_link(link: Dict) -> str:
+    """Re-scrape one link and write back what changed; returns 'updated', 'unchanged' or 'failed'"""
+    url = link["url"]
+    metadata = await process_url(url)
+    now = datetime.utcnow()
+
+    if scrape_failed(link, metadata):
+        # Keep the existing snapshot (good or bad) and retry later
+        failures = link.get("fetch_failures", 0) + 1
+        await collection.update_one(
+            {"_id": link["_id"]},
+            {"$set": {"last_fetched_at": now, "fetch_failures": failures, "next_fetch_at": now + _backoff(failures)}}
+        )
+        logger.info(f"🔁 Refresh of {url} failed ({failures} in a row): {metadata.get('summary')}")
+        return "failed"
+
+    changes = changed_fields(link, metadata)
+    if "title" in changes or "content" in changes:
+        changes.update(tfidf.annotate(metadata, count=False))
+    if "title" in changes or "summary" in changes:
+        changes["search_terms"] = search_terms(metadata.get("title"), metadata.get("summary"))
+    update = {"$set": {"last_fetched_at": now}, "$unset": {"fetch_failures": "", "next_fetch_at": ""}}
+    if changes:
+        update["$set"].update(changes, updated_at=now)
+    await collection.update_one({"_id": link["_id"]}, update)
+    if changes:
+        invalidate_counts()
+    if changes.keys() & {"title", "summary", "content", "tags"}:
+        await search_index.reindex_link(str(link["_id"]))
+        await embeddings.add_documents([{**link, **changes}])
+    if changes.keys() & {"summary", "content", "tags"}:
+        await near_duplicates.update_signature(link["_id"], near_duplicates.comparable_text({**link, **changes}))
+    if changes:
+        logger.info(f"🔁 Refreshed {url}: {', '.join(sorted(changes))} changed")
+        return "updated"
+    return "unchanged"
+
+
+async def refresh_link_by_id(link_id: str) -> Optional[str]:
+    """Re-scrape a single link on demand (ignores age, backoff and the negative cache)"""
+    link = await collection.find_one({"_id": ObjectId(link_id)})
+    if not link:
+        return None
+    circuit_breaker.forget(link["url"])
+    return await refresh_link(link)
+
+
+async def run_refresh_sweep(budget: int = REFRESH_BATCH_SIZE) -> Dict[str, int]:
+    """Refresh up to `budget` due links, failed ones first"""
+    stats = {"updated": 0, "unchanged": 0, "failed": 0}
+    claimed = 0
+    lock = asyncio.Lock()
+
+    async def worker():
+        nonlocal claimed
+        while True:
+            # Live ingestion has priority over background refreshes
+            if ingestion_busy():
+                return
+            async with lock:
+                if claimed >= budget:
+                    return
+                link = await _claim_link(errors=True) or await _claim_link(errors=False)
+                if link is None:
+                    return
+                claimed += 1
+            try:
+                stats[await refresh_link(link)] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Error refreshing {link.get('url')}: {e}", exc_info=True)
+
+    await asyncio.gather(*(worker() for _ in range(max(REFRESH_CONCURRENCY, 1))))
+    if claimed:
+        logger.info(
+            f"🔁 Refresh sweep: {stats['updated']} updated, {stats['unchanged']} unchanged, {stats['failed']} failed"
+        )
+    return stats
+
+
+async def _refresher_loop():
+    logger.info(f"🔁 Link refresher started (up to {REFRESH_BATCH_SIZE} links every {REFRESH_INTERVAL:.0f}s)")
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            await run_refresh_sweep()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Refresh sweep failed: {e}")
+
+
+def start_refresher():
+    """Start the periodic refresher (call from the app lifespan)"""
+    global _refresher_task
+    if REFRESH_ENABLED and REFRESH_BATCH_SIZE > 0:
+        _refresher_task = asyncio.create_task(_refresher_loop())
+
+
+async def stop_refresher():
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        await asyncio.gather(_refresher_task, return_exceptions=True)
+        _refresher_task = None
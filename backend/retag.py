@@ -0,0 +1,134 @@
+"""
+Apply the current tag taxonomy to links already in the library
+Links are read in _id order in batches (keyset pagination, so no long-lived cursor and
+never the whole library in memory), retagged with the compiled matcher and written back
+with one unordered bulk_write per batch. Each link records the taxonomy_version it was
+tagged with, so an interrupted run simply continues where it stopped.
+Tags added by the user (anything not in the link's previous auto_tags) are kept.
+
+Usage:
+    python retag.py [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from database import collection, close_database_connection
+from counts import invalidate_counts
+from tagging import TagMatcher, get_matcher
+
+logger = logging.getLogger(__name__)
+
+RETAG_BATCH_SIZE = int(os.getenv("RETAG_BATCH_SIZE", "500"))
+
+RETAG_PROJECTION = {"title": 1, "content": 1, "summary": 1, "domain": 1, "tags": 1, "auto_tags": 1}
+
+_retag_task: Optional[asyncio.Task] = None
+_status: Dict = {"running": False}
+
+
+def retag_document(doc: Dict, matcher: TagMatcher) -> Tuple[List[str], List[str]]:
+    """Return (tags, auto_tags) for a link under the given taxonomy"""
+    auto_tags = matcher.tag(doc.get("title") or "", doc.get("content") or doc.get("summary") or "", doc.get("domain") or "")
+    tags = doc.get("tags") or []
+    previous_auto = doc.get("auto_tags")
+    if previous_auto is None:
+        # Links from before auto_tags was stored: tags named in the taxonomy are assumed automatic
+        previous_auto = [tag for tag in tags if tag in matcher.tag_names]
+    user_tags = [tag for tag in tags if tag not in previous_auto]
+    return user_tags + [tag for tag in auto_tags if tag not in user_tags], auto_tags
+
+
+def _build_updates(docs: List[Dict], matcher: TagMatcher) -> Tuple[List[UpdateOne], int]:
+    requests = []
+    changed = 0
+    now = datetime.utcnow()
+    for doc in docs:
+        tags, auto_tags = retag_document(doc, matcher)
+        update = {"tags": tags, "auto_tags": auto_tags, "taxonomy_version": matcher.version}
+        if tags != (doc.get("tags") or []):
+            changed += 1
+            update["updated_at"] = now  # Lets the search index pick up the new tags
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+    return requests, changed
+
+
+async def retag_library(batch_size: int = RETAG_BATCH_SIZE) -> Dict:
+    """Retag every link not yet tagged with the current taxonomy version"""
+    matcher = get_matcher()
+    if not matcher.version:
+        raise RuntimeError("No tag taxonomy loaded")
+
+    _status.update(
+        running=True, version=matcher.version, processed=0, changed=0, error=None,
+        started_at=datetime.utcnow(), finished_at=None
+    )
+    # Error snapshots have no content to tag; the refresher retags them once they recover
+    query = {"taxonomy_version": {"$ne": matcher.version}, "tags": {"$ne": "Error"}}
+    last_id = None
+    try:
+        while True:
+            batch_query = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+            docs = await collection.find(batch_query, RETAG_PROJECTION).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                break
+            last_id = docs[-1]["_id"]
+
+            # Matching is CPU work; keep it off the event loop
+            requests, changed = await asyncio.to_thread(_build_updates, docs, matcher)
+            await collection.bulk_write(requests, ordered=False)
+            if changed:
+                invalidate_counts()
+            _status["processed"] += len(docs)
+            _status["changed"] += changed
+            logger.info(f"🏷️ Retagged {_status['processed']} links ({_status['changed']} changed)")
+    except Exception as e:
+        _status["error"] = str(e)
+        raise
+    finally:
+        _status.update(running=False, finished_at=datetime.utcnow())
+    return dict(_status)
+
+
+def retag_status() -> Dict:
+    return dict(_status)
+
+
+def start_retag() -> bool:
+    """Run retag_library in the background; False if a run is already in progress"""
+    global _retag_task
+    if _retag_task is not None and not _retag_task.done():
+        return False
+
+    async def run():
+        try:
+            await retag_library()
+        except Exception as e:
+            logger.error(f"Retag job failed: {e}", exc_info=True)
+
+    _retag_task = asyncio.create_task(run())
+    return True
+
+
+async def stop_retag():
+    if _retag_task is not None and not _retag_task.done():
+        _retag_task.cancel()
+        await asyncio.gather(_retag_task, return_exceptions=True)
+
+
+async def main(args):
+    try:
+        result = await retag_library(batch_size=args.batch_size)
+        print(f"✅ Retagged {result['processed']} links with taxonomy {result['version']} ({result['changed']} changed)")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Apply the current tag taxonomy to existing links")
+    parser.add_argument("--batch-size", type=int, default=RETAG_BATCH_SIZE, help="Links per read/bulk_write batch")
+    asyncio.run(main(parser.parse_args()))
@@ -1,18 +1,195 @@
-import trafilatura
-import re
+import os
+import asyncio
+import logging
 from urllib.parse import urlparse, parse_qs
-from typing import Dict, List
-import json
-import requests
+from typing import Dict, Optional
+from dataclasses import dataclass
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
 from lxml import html
+from trafilatura import bare_extraction
+from trafilatura.utils import decode_file, load_html
+import fetch_cache
+import circuit_breaker
+from tagging import get_matcher
+from text_analysis import analyze_text
 
-def extract_media(url: str, html_content: str) -> Dict:
-    """Extract image and video previews using OpenGraph and specific patterns"""
+logger = logging.getLogger(__name__)
+
+# HTTP fetcher configuration
+SCRAPER_CONNECT_TIMEOUT = float(os.getenv("SCRAPER_CONNECT_TIMEOUT", "5"))  # Seconds
+SCRAPER_READ_TIMEOUT = float(os.getenv("SCRAPER_READ_TIMEOUT", "15"))  # Seconds
+SCRAPER_MAX_BYTES = int(os.getenv("SCRAPER_MAX_BYTES", str(5 * 1024 * 1024)))  # Max HTML size (5 MB)
+SCRAPER_MAX_CONNECTIONS = int(os.getenv("SCRAPER_MAX_CONNECTIONS", "20"))
+SCRAPER_USER_AGENT = os.getenv(
+    "SCRAPER_USER_AGENT",
+    "Mozilla/5.0 (compatible; ReadingLibraryBot/1.0; +https://github.com/Hiteshydv001/Reading-library)"
+)
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+# Extraction stage: trafilatura/lxml work is CPU-bound and holds the GIL, so it runs
+# in worker processes. Set EXTRACT_WORKERS=0 to extract in-process on small deployments.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+EXTRACT_MAX_TASKS_PER_CHILD = int(os.getenv("EXTRACT_MAX_TASKS_PER_CHILD", "200"))  # Recycle workers to cap lxml memory
+
+# HTTP/2 needs the optional h2 package (installed via httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_http_client: Optional[httpx.AsyncClient] = None
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+# Statuses that say "try again later" rather than "this URL is bad"
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """Raised when a page can't be downloaded or is not an HTML document"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable  # Timeouts, connection errors, 429/5xx: the host may recover
+
+
+@dataclass
+class FetchResult:
+    html: Optional[str]  # None when the server answered 304 Not Modified
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client so keep-alive connections are reused across fetches to the same host"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            follow_redirects=True,
+            timeout=httpx.Timeout(SCRAPER_READ_TIMEOUT, connect=SCRAPER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=SCRAPER_MAX_CONNECTIONS,
+                max_keepalive_connections=SCRAPER_MAX_CONNECTIONS,
+                keepalive_expiry=30
+            ),
+            headers={
+                "User-Agent": SCRAPER_USER_AGENT,
+                "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.5"
+            }
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close pooled connections (call on application shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Lazily start the extraction process pool (None when running in-process)"""
+    global _extract_pool
+    if EXTRACT_WORKERS <= 0:
+        return None
+    if _extract_pool is None:
+        _extract_pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            # spawn avoids forking a process that is running an event loop and threads
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=EXTRACT_MAX_TASKS_PER_CHILD
+        )
+        logger.info(f"Started extraction pool with {EXTRACT_WORKERS} processes")
+    return _extract_pool
+
+
+def shutdown_extraction_pool():
+    """Stop extraction worker processes (call on application shutdown)"""
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+async def run_extraction(url: str, downloaded: str) -> Dict:
+    """Run extract_metadata in the process pool, or in a thread when the pool is disabled"""
+    global _extract_pool
+    pool = get_extraction_pool()
+    if pool is None:
+        return await asyncio.to_thread(extract_metadata, url, downloaded)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, extract_metadata, url, downloaded)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge page); start a fresh pool next time
+        logger.error(f"Extraction pool broken while processing {url}; restarting it")
+        shutdown_extraction_pool()
+        return await asyncio.to_thread(extract_metadata, url, downloaded)
+
+
+async def fetch_page(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+    """
+    Download a page and return its decoded HTML.
+    Pass the validators of a cached copy to make the request conditional.
+    Non-HTML responses and bodies larger than SCRAPER_MAX_BYTES are rejected
+    from the headers (or while streaming) so large binaries are never fully downloaded.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and headers:
+                return FetchResult(html=None, etag=etag, last_modified=last_modified, not_modified=True)
+            if response.status_code != 200:
+                raise FetchError(f"HTTP {response.status_code}", retryable=response.status_code in RETRYABLE_STATUS_CODES)
+
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type and content_type not in HTML_CONTENT_TYPES:
+                raise FetchError(f"Unsupported content type: {content_type}")
+
+            content_length = response.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > SCRAPER_MAX_BYTES:
+                raise FetchError(f"Response too large ({content_length} bytes)")
+
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > SCRAPER_MAX_BYTES:
+                    raise FetchError(f"Response exceeded {SCRAPER_MAX_BYTES} bytes")
+                chunks.append(chunk)
+            response_etag = response.headers.get("etag")
+            response_last_modified = response.headers.get("last-modified")
+    except httpx.TransportError as e:
+        raise FetchError(f"{type(e).__name__}: {e}", retryable=True) from e
+    except httpx.HTTPError as e:
+        raise FetchError(f"{type(e).__name__}: {e}") from e
+
+    # Same charset detection trafilatura.fetch_url applies
+    return FetchResult(
+        html=decode_file(b"".join(chunks)),
+        etag=response_etag,
+        last_modified=response_last_modified
+    )
+
+def extract_media(url: str, tree: html.HtmlElement) -> Dict:
+    """Extract image and video previews using OpenGraph and specific patterns (from an already parsed tree)"""
     media = {"image_url": None, "video_url": None}
     
     try:
-        tree = html.fromstring(html_content)
-        
         # 1. Try OpenGraph Image
         og_image = tree.xpath('//meta[@property="og:image"]/@content')
         if og_image:
@@ -54,88 +231,98 @@ def extract_domain(url: str) -> str:
     except:
         return "unknown"
 
-def calculate_reading_time(text: str) -> int:
-    """Calculate reading time in minutes (avg 200 words/min)"""
-    if not text:
-        return 0
-    word_count = len(text.split())
-    return max(1, round(word_count / 200))
-
-def auto_tag(title: str, text: str, domain: str) -> List[str]:
-    """Generate relevant tags based on content"""
-    tags = set()
-    
-    # Domain-based tags
-    domain_map = {
-        "arxiv.org": ["Research", "Academic"],
-        "github.com": ["Code", "Development"],
-        "medium.com": ["Article", "Blog"],
-        "youtube.com": ["Video"],
-        "twitter.com": ["Social"],
-        "x.com": ["Social"],
-        "linkedin.com": ["Social", "Professional"],
-        "reddit.com": ["Discussion"],
-        "stackoverflow.com": ["Programming", "Q&A"]
-    }
-    
-    for domain_key, domain_tags in domain_map.items():
-        if domain_key in domain:
-            tags.update(domain_tags)
-    
-    # Keyword-based tagging
-    combined_text = f"{title} {text}".lower()
-    
-    keyword_map = {
-        "AI": ["ai", "artificial intelligence", "machine learning", "deep learning"],
-        "NLP": ["nlp", "natural language", "language model", "transformer", "gpt", "llm"],
-        "Computer Vision": ["computer vision", "image recognition", "object detection"],
-        "Data Science": ["data science", "data analysis", "analytics"],
-        "Python": ["python", "pytorch", "tensorflow"],
-        "JavaScript": ["javascript", "react", "node.js", "typescript"],
-        "Cloud": ["cloud", "aws", "azure", "gcp"],
-        "Database": ["database", "sql", "mongodb", "postgres"],
-        "Security": ["security", "encryption", "authentication"],
-        "DevOps": ["devops", "docker", "kubernetes", "ci/cd"],
-        "Tutorial": ["tutorial", "guide", "how to", "introduction"],
-        "Research": ["research", "paper", "study", "analysis"]
+def _error_result(url: str, title: str, summary: str, retryable: bool = False) -> Dict:
+    return {
+        "title": title,
+        "summary": summary,
+        "content": None,
+        "author": None,
+        "tags": ["Error"],
+        "domain": extract_domain(url),
+        "reading_time": 0,
+        "retryable": retryable  # Transient failure: callers should retry later instead of storing this
     }
-    
-    for tag, keywords in keyword_map.items():
-        if any(keyword in combined_text for keyword in keywords):
-            tags.add(tag)
-    
-    # Limit to top 5 tags
-    return list(tags)[:5]
 
-def process_url(url: str) -> Dict:
+def _fetch_failed(url: str, e: FetchError) -> Dict:
+    logger.warning(f"Unable to fetch {url}: {e}")
+    circuit_breaker.record_failure(url, str(e), e.retryable)
+    return _error_result(url, "Error: Unable to fetch content", f"Could not download content from URL ({e}).", e.retryable)
+
+async def process_url(url: str) -> Dict:
     """
     Downloads URL and extracts comprehensive metadata.
     Returns dict with title, summary, content, author, tags, domain, reading_time
     """
     try:
-        # Download content
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded is None:
-            return {
-                "title": "Error: Unable to fetch content",
-                "summary": "Could not download content from URL.",
-                "content": None,
-                "author": None,
-                "tags": ["Error"],
-                "domain": extract_domain(url),
-                "reading_time": 0
-            }
+        # Fail fast for URLs that just failed and hosts whose circuit is open, before any request
+        blocked = circuit_breaker.check(url)
+        if blocked:
+            reason, retryable = blocked
+            return _error_result(url, "Error: Unable to fetch content", f"Could not download content from URL ({reason}).", retryable)
         
-        # Extract with metadata
-        result = trafilatura.extract(
-            downloaded,
-            output_format="json",
+        # Known sites (YouTube, arXiv, GitHub, ...) are described from cheap structured sources
+        from extractors import run_fast_path
+        metadata = await run_fast_path(url)
+        if metadata:
+            return metadata
+        
+        # Download content (conditionally when we have a cached copy)
+        cached = await fetch_cache.lookup(url)
+        try:
+            fetched = await fetch_page(
+                url,
+                etag=cached.etag if cached else None,
+                last_modified=cached.last_modified if cached else None
+            )
+        except FetchError as e:
+            return _fetch_failed(url, e)
+        circuit_breaker.record_success(url)
+        
+        if fetched.not_modified:
+            await fetch_cache.mark_revalidated(cached)
+            # Unchanged page: reuse the previous extraction instead of parsing again
+            if cached.metadata:
+                return cached.metadata
+            downloaded = await fetch_cache.read_body(cached)
+            if downloaded is None:
+                # The cached body is gone: fetch the page again, unconditionally
+                try:
+                    fetched = await fetch_page(url)
+                except FetchError as e:
+                    return _fetch_failed(url, e)
+                downloaded = fetched.html
+        else:
+            downloaded = fetched.html
+        
+        metadata = await run_extraction(url, downloaded)
+        # Only cache real extractions: a 304 would otherwise replay an empty or failed one forever
+        if metadata.get("content") and "Error" not in metadata.get("tags", []):
+            await fetch_cache.store(url, downloaded, fetched.etag, fetched.last_modified, metadata)
+        return metadata
+
+    except Exception as e:
+        return _error_result(url, "Error Processing URL", f"Exception: {str(e)}")
+
+def extract_metadata(url: str, downloaded: str) -> Dict:
+    """
+    Extract text, metadata, media and tags from downloaded HTML.
+    Runs inside extraction worker processes, so it must stay a picklable top-level function.
+    """
+    try:
+        # Parse once; the tree is shared by text/metadata extraction and the OpenGraph lookups
+        tree = load_html(downloaded)
+        del downloaded
+        
+        # trafilatura works on its own copy of the tree, so it stays intact for extract_media
+        document = bare_extraction(
+            tree,
+            output_format="python",
             with_metadata=True,
             include_comments=False,
             include_tables=False
-        )
+        ) if tree is not None else None
         
-        if not result:
+        if document is None:
             return {
                 "title": "No Content Extracted",
                 "summary": "Unable to extract text from this URL.",
@@ -145,57 +332,34 @@ def process_url(url: str) -> Dict:
                 "domain": extract_domain(url),
                 "reading_time": 0
             }
-
-        data = json.loads(result)
         
         # Extract fields
-        title = data.get("title") or "No Title"
-        author = data.get("author")
-        text = data.get("text", "") or ""
-        
-        # Generate summary (first 400 chars)
-        summary = text[:400] + "..." if len(text) > 400 else text
+        title = document.title or "No Title"
+        author = document.author
+        text = document.text or ""
         
-        # Calculate reading time
-        reading_time = calculate_reading_time(text)
-        
-        # Extract domain
+        # Word count, reading time, summary, tag hits and nested links in one pass over the text
         domain = extract_domain(url)
+        matcher = get_matcher()
+        stats = analyze_text(text, url=url, title=title, matcher=matcher)
         
         # Extract Media (Images/Videos)
-        media = extract_media(url, downloaded)
-        
-        # Auto-generate tags
-        tags = auto_tag(title, text, domain)
-
-        # Find nested links in the text
-        nested_links = []
-        if text:
-            # Find all URLs in the text
-            found_urls = re.findall(r'https?://[^\s<>"]+|www\.[^\s<>"]+', text)
-            # Filter out the original URL and duplicates
-            nested_links = list(set([u for u in found_urls if u != url]))
+        media = extract_media(url, tree)
 
         return {
             "title": title,
-            "summary": summary,
+            "summary": stats.summary,
             "content": text,  # Full content for search
             "author": author,
-            "tags": tags,
+            "tags": matcher.rank(domain, stats.tag_hits),
+            "taxonomy_version": matcher.version,
             "domain": domain,
-            "reading_time": reading_time,
+            "reading_time": stats.reading_time,
+            "word_count": stats.word_count,
             "image_url": media["image_url"],
             "video_url": media["video_url"],
-            "nested_links": nested_links
+            "nested_links": stats.links
         }
 
     except Exception as e:
-        return {
-            "title": "Error Processing URL",
-            "summary": f"Exception: {str(e)}",
-            "content": None,
-            "author": None,
-            "tags": ["Error"],
-            "domain": extract_domain(url),
-            "reading_time": 0
-        }
\ No newline at end of file
+        return _error_result(url, "Error Processing URL", f"Exception: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Full-text search over the library
+Searches use MongoDB's text index on title/summary/content (weighted 10/5/1), so a query
+looks up its terms in the index instead of regex-scanning every document, and results
+are ordered by relevance. The query syntax is the text index's own:
+    rust async          links with either word (stemmed, stopwords ignored)
+    "borrow checker"    exact phrase
+    -python             exclude a word
+Terms ending in * (e.g. kube*) match word prefixes. The text index only knows whole
+words, so each link also stores the distinct words of its title and summary in an
+indexed `search_terms` array that anchored prefix queries can range-scan.
+Both indexes are created by database.ensure_indexes.
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from database import collection
+
+logger = logging.getLogger(__name__)
+
+MIN_PREFIX_CHARS = 2  # Shorter prefixes would match most of the library
+MAX_SEARCH_TERMS = 200
+
+WORD = re.compile(r"\w+")
+QUERY_TOKEN = re.compile(r'-?"[^"]*"?|\S+')
+
+
+def search_terms(title: Optional[str], summary: Optional[str]) -> List[str]:
+    """Distinct lowercased words of a link's title and summary, for prefix matching"""
+    words = dict.fromkeys(WORD.findall(f"{title or ''} {summary or ''}".lower()))
+    return [word for word in words if len(word) >= MIN_PREFIX_CHARS][:MAX_SEARCH_TERMS]
+
+
+def parse_query(search: str) -> Tuple[str, List[str], bool]:
+    """
+    Split a search into the $text search string (words, "phrases", -exclusions), the
+    prefixes of terms written as `prefix*`, and whether the search string has any
+    positive term ($text can't run on exclusions alone)
+    """
+    text_parts, prefixes = [], []
+    positive = False
+    for token in QUERY_TOKEN.findall(search):
+        negated = token.startswith("-")
+        body = token[1:] if negated else token
+        if body.startswith('"'):
+            phrase = body.replace('"', "").strip()
+            if phrase:
+                text_parts.append(f'{"-" if negated else ""}"{phrase}"')
+                positive = positive or not negated
+        elif body.endswith("*") and not negated:
+            words = WORD.findall(body.lower())
+            if words and len(words[-1]) >= MIN_PREFIX_CHARS:
+                # "node.js*" -> the whole word "node" and the prefix "js"
+                text_parts.extend(words[:-1])
+                prefixes.append(words[-1])
+                words = words[:-1]
+            else:
+                text_parts.extend(words)
+            positive = positive or bool(words)
+        else:
+            # Quotes are the only syntax of the $search string; stray ones would open a phrase
+            body = body.replace('"', "")
+            if body:
+                text_parts.append(f"{'-' if negated else ''}{body}")
+                positive = positive or not negated
+    return " ".join(text_parts), prefixes, positive
+
+
+def build_search(search: str) -> Tuple[Dict, bool]:
+    """
+    Return (filter, ranked) for a search string; ranked is True when the filter contains
+    a $text clause, so results can be sorted by relevance
+    """
+    text_search, prefixes, positive = parse_query(search)
+    query: Dict = {}
+    if positive:
+        query["$text"] = {"$search": text_search}
+    if prefixes:
+        query["$and"] = [{"search_terms": {"$regex": f"^{re.escape(prefix)}"}} for prefix in prefixes]
+    if not query:
+        # Nothing searchable (e.g. only punctuation): match nothing rather than everything
+        query["_id"] = None
+    return query, "$text" in query
+
+
+async def backfill_search_terms(batch_size: int = 500):
+    """Set search_terms on links stored before it existed"""
+    updated = 0
+    while True:
+        docs = await collection.find(
+            {"search_terms": {"$exists": False}}, {"title": 1, "summary": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        result = await collection.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"search_terms": search_terms(doc.get("title"), doc.get("summary"))}})
+            for doc in docs
+        ], ordered=False)
+        updated += result.modified_count
+    if updated:
+        logger.info(f"🔎 Added search terms to {updated} existing links")
@@ -0,0 +1,908 @@
+"""
+Embedded BM25 search index (SEARCH_BACKEND=bm25)
+For MongoDB deployments without Atlas Search: an in-process inverted index over each
+link's title, tags, summary and content, ranked with BM25. Field weights are applied to
+term frequencies at indexing time (title 3, tags 2, summary 2, content 1).
+
+Postings are stored per term as varint-encoded columns (doc-id deltas, weighted term
+frequencies, offset counts, then content character offsets), in one file that is memory
+mapped on startup. Recent changes live in a small in-memory delta (new postings plus
+tombstones) that is merged into a new on-disk generation in the background. Encoding,
+decoding and merging are vectorized with NumPy.
+
+The offsets give search results highlighted snippets without scanning the content again.
+Each worker process has its own copy; changes made by other workers are picked up from
+`updated_at` every SEARCH_INDEX_FLUSH_INTERVAL seconds. Only one process writes to the
+index directory: the worker holding its writer lock builds and merges generations, and
+the other workers load each generation it publishes. Generation files are written under
+temporary names and renamed into place, under a second lock that the CLI takes too.
+
+Usage (rebuild the index from the database):
+    python search_index.py
+"""
+import argparse
+import asyncio
+import bisect
+import html
+import json
+import logging
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from bson import ObjectId
+from database import collection, close_database_connection
+from projections import with_content
+from search import QUERY_TOKEN, WORD
+from text_analysis import iter_chunks
+from tfidf import STOPWORDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, so each process acts as the only writer (run a single worker)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "mongo").lower()  # "mongo" (text index) or "bm25" (this module)
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_index"))
+SEARCH_INDEX_FLUSH_INTERVAL = float(os.getenv("SEARCH_INDEX_FLUSH_INTERVAL", "60"))  # Seconds between syncs/saves
+SEARCH_INDEX_MAX_CHARS = int(os.getenv("SEARCH_INDEX_MAX_CHARS", "100000"))  # Content indexed per link
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))  # Ranked candidates considered per search
+
+FIELD_WEIGHTS = (("title", 3), ("tags", 2), ("summary", 2))  # Content counts 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_POSITIONS = 16  # Content offsets kept per term and link (enough for a snippet)
+MAX_PREFIX_TERMS = 50  # Most frequent expansions of a prefix* term
+MAX_DELTA_DOCS = 2000  # Merge the in-memory delta into a new generation beyond this
+SNIPPET_CHARS = 180
+SYNC_OVERLAP = timedelta(seconds=5)  # Re-read a little before the last sync (clock skew between workers)
+INDEX_PROJECTION = {"title": 1, "tags": 1, "summary": 1, "content": 1}
+FORMAT_VERSION = 1
+WRITER_LOCK = "writer.lock"  # Held for its lifetime by the worker that builds and merges generations
+WRITE_LOCK = "write.lock"  # Held while a generation is written and published (by that worker or the CLI)
+CODEC_CHUNK = 1 << 22  # Values (or bytes) encoded/decoded per vectorized step
+
+
+# --- Varint columns ---
+
+def encode_varints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """LEB128-encode non-negative integers; returns (bytes, byte length of each value)"""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+    owner = np.repeat(np.arange(len(values)), sizes)
+    index = np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    out = ((values[owner] >> (7 * index).astype(np.uint64)) & np.uint64(0x7F)).astype(np.uint8)
+    out[index < sizes[owner] - 1] |= 0x80
+    return out, sizes
+
+
+def _decode(data: np.ndarray) -> np.ndarray:
+    last = data < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    index = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << (7 * index), starts)
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Decode a buffer of LEB128 varints, vectorized in slices of CODEC_CHUNK bytes"""
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    parts, start = [], 0
+    while start < len(data):
+        end = min(start + CODEC_CHUNK, len(data))
+        if end < len(data):
+            # Cut after the last complete varint of the slice
+            end = start + int(np.flatnonzero(data[start:end] < 0x80)[-1]) + 1
+        parts.append(_decode(data[start:end]))
+        start = end
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def offset_deltas(offsets: np.ndarray, npos: np.ndarray) -> np.ndarray:
+    """Differences to the previous offset of the same row (the first of each row stays absolute)"""
+    deltas = np.asarray(offsets, dtype=np.int64).copy()
+    later = np.ones(len(deltas), dtype=bool)
+    later[(np.cumsum(npos) - npos)[npos > 0]] = False
+    deltas[later] = np.diff(deltas)[later[1:]]
+    return deltas
+
+
+def group_cumsum(values: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Running sums restarted at each group (groups are consecutive runs of the given sizes)"""
+    if not len(values):
+        return values
+    total = np.cumsum(values)
+    starts = (np.cumsum(sizes) - sizes)[sizes > 0]
+    return total - np.repeat((total - values)[starts], sizes[sizes > 0])
+
+
+@dataclass
+class Rows:
+    """Postings in columnar form: one row per (term, document)"""
+    terms: List[str]  # Vocabulary; term_ids index into it
+    term_ids: np.ndarray
+    docnos: np.ndarray
+    weights: np.ndarray  # Field-weighted term frequency
+    npos: np.ndarray  # Content offsets stored for the row
+    positions: np.ndarray  # Offsets of all rows, row after row
+
+
+@dataclass
+class Postings:
+    """One term's postings, sorted by document number"""
+    docs: np.ndarray
+    weights: np.ndarray
+    npos: np.ndarray
+    deltas: np.ndarray  # Offset deltas, restarting at each row
+
+    def offsets(self, docno: int) -> List[int]:
+        row = int(np.searchsorted(self.docs, docno))
+        if row >= len(self.docs) or self.docs[row] != docno:
+            return []
+        start = int(self.npos[:row].sum())
+        return np.cumsum(self.deltas[start:start + int(self.npos[row])]).tolist()
+
+
+def write_generation(directory: str, generation: int, rows: Rows, doc_ids: List[str], lengths: np.ndarray):
+    """Sort, encode and write postings plus the document table as generation files"""
+    order = sorted(range(len(rows.terms)), key=rows.terms.__getitem__)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    terms = [rows.terms[i] for i in order]
+    n_terms = len(terms)
+
+    perm = np.lexsort((rows.docnos, rank[rows.term_ids]))
+    term_ids = rank[rows.term_ids[perm]]
+    docnos, weights, npos = rows.docnos[perm], rows.weights[perm], rows.npos[perm]
+    old_starts = np.cumsum(rows.npos) - rows.npos
+    new_starts = np.cumsum(npos) - npos
+    positions = rows.positions[np.repeat(old_starts[perm] - new_starts, npos) + np.arange(int(npos.sum()))]
+    del perm, old_starts, new_starts
+
+    # Doc ids and offsets as deltas within their term / row
+    first = np.ones(len(docnos), dtype=bool)
+    first[1:] = term_ids[1:] != term_ids[:-1]
+    doc_deltas = docnos.copy()
+    doc_deltas[~first] = np.diff(docnos)[~first[1:]]
+    pos_deltas = offset_deltas(positions, npos)
+    del first, positions
+
+    # Scatter into per-term blocks: [doc deltas][weights][offset counts][offset deltas]
+    df = np.bincount(term_ids, minlength=n_terms)
+    offset_counts = np.bincount(term_ids, weights=npos, minlength=n_terms).astype(np.int64)
+    n_values = 3 * df + offset_counts
+    value_start = np.cumsum(n_values) - n_values
+    values = np.empty(int(n_values.sum()), dtype=np.int64)
+    row_rank = np.arange(len(docnos)) - np.repeat(np.cumsum(df) - df, df)
+    row_slot = value_start[term_ids] + row_rank
+    values[row_slot] = doc_deltas
+    values[row_slot + df[term_ids]] = weights
+    values[row_slot + 2 * df[term_ids]] = npos
+    del row_rank, row_slot, doc_deltas
+    pos_terms = np.repeat(term_ids, npos)
+    pos_rank = np.arange(len(pos_terms)) - np.repeat(np.cumsum(offset_counts) - offset_counts, offset_counts)
+    values[value_start[pos_terms] + 3 * df[pos_terms] + pos_rank] = pos_deltas
+    del pos_terms, pos_rank, pos_deltas
+
+    # Encode in slices to bound the temporary arrays; track each term's byte length
+    prefix = os.path.join(directory, f"{generation}")
+    value_end = np.cumsum(n_values)
+    byte_len = np.zeros(n_terms, dtype=np.int64)
+    with atomic_file(f"{prefix}.postings") as f:
+        for start in range(0, len(values), CODEC_CHUNK):
+            chunk = values[start:start + CODEC_CHUNK]
+            data, sizes = encode_varints(chunk)
+            f.write(data.tobytes())
+            owners = np.searchsorted(value_end, np.arange(start, start + len(chunk)), side="right")
+            byte_len += np.bincount(owners, weights=sizes, minlength=n_terms).astype(np.int64)
+    lexicon = np.stack((np.cumsum(byte_len) - byte_len, byte_len, df), axis=1)
+
+    save_array(f"{prefix}.lexicon.npy", lexicon.astype(np.int64))
+    save_array(f"{prefix}.lengths.npy", np.asarray(lengths, dtype=np.float32))
+    # Raw 12-byte ObjectIds (an "S12" array would drop trailing zero bytes)
+    save_array(f"{prefix}.docs.npy", np.frombuffer(b"".join(ObjectId(i).binary for i in doc_ids), dtype=np.uint8).reshape(-1, 12))
+    with atomic_file(f"{prefix}.terms") as f:
+        f.write("\n".join(terms).encode("utf-8"))
+
+
+def read_rows(blob: np.ndarray, lexicon: np.ndarray, terms: List[str]) -> Rows:
+    """Decode a whole generation back into rows (for merging)"""
+    values = decode_varints(blob)
+    ends = np.concatenate(([0], np.cumsum(blob < 0x80)))
+    value_start = ends[lexicon[:, 0]]
+    del ends
+    df = lexicon[:, 2]
+    n_rows = int(df.sum())
+    term_ids = np.repeat(np.arange(len(terms)), df)
+    doc_index = value_start[term_ids] + np.arange(n_rows) - np.repeat(np.cumsum(df) - df, df)
+    weight_index = doc_index + df[term_ids]
+    npos_index = weight_index + df[term_ids]
+    is_pos = np.ones(len(values), dtype=bool)
+    is_pos[doc_index] = is_pos[weight_index] = is_pos[npos_index] = False
+    npos = values[npos_index]
+    return Rows(
+        terms=list(terms),
+        term_ids=term_ids,
+        docnos=group_cumsum(values[doc_index], df),
+        weights=values[weight_index],
+        npos=npos,
+        positions=group_cumsum(values[is_pos], npos)
+    )
+
+
+# --- Analysis ---
+
+def _keep(token: str) -> bool:
+    return len(token) > 1 and token not in STOPWORDS
+
+
+def analyze_document(doc: Dict) -> Tuple[float, Dict[str, list]]:
+    """Return (weighted length, {term: [weighted tf, content offsets]}) for a link document"""
+    postings: Dict[str, list] = {}
+    length = 0
+    for field, weight in FIELD_WEIGHTS:
+        value = doc.get(field) or ""
+        text = " ".join(value) if isinstance(value, list) else str(value)
+        for token in WORD.findall(text.lower()):
+            if _keep(token):
+                postings.setdefault(token, [0, []])[0] += weight
+                length += weight
+    base = 0
+    for chunk in iter_chunks((doc.get("content") or "")[:SEARCH_INDEX_MAX_CHARS]):
+        for match in WORD.finditer(chunk):
+            token = match.group().lower()
+            if _keep(token):
+                entry = postings.setdefault(token, [0, []])
+                entry[0] += 1
+                length += 1
+                if len(entry[1]) < MAX_POSITIONS:
+                    entry[1].append(base + match.start())
+        base += len(chunk)
+    return float(length), postings
+
+
+def parse_query(search: str) -> Tuple[Set[str], Set[str], Set[str], List[str]]:
+    """(optional terms, required terms, excluded terms, prefixes) in the syntax of search.py"""
+    optional, required, excluded, prefixes = set(), set(), set(), []
+    for token in QUERY_TOKEN.findall(search.lower()):
+        negated = token.startswith("-")
+        body = token[1:] if negated else token
+        words = [word for word in WORD.findall(body) if _keep(word)]
+        if negated:
+            excluded.update(words)
+        elif body.startswith('"'):
+            required.update(words)  # Phrases: every word must occur
+        elif body.endswith("*") and WORD.findall(body):
+            parts = WORD.findall(body)
+            optional.update(word for word in parts[:-1] if _keep(word))
+            prefixes.append(parts[-1])
+        else:
+            optional.update(words)
+    return optional, required, excluded, prefixes
+
+
+@dataclass
+class SearchHit:
+    link_id: str
+    score: float
+    docno: int
+
+
+class SearchIndex:
+    def __init__(self):
+        self.generation = 0
+        self.synced_at: Optional[datetime] = None
+        # On-disk generation (memory mapped)
+        self.terms: List[str] = []
+        self.term_index: Dict[str, int] = {}
+        self.lexicon = np.zeros((0, 3), dtype=np.int64)
+        self.blob = np.zeros(0, dtype=np.uint8)
+        self.base_docs = 0
+        self.base_lengths = np.zeros(0, dtype=np.float32)
+        # Document table and in-memory delta
+        self.doc_ids: List[str] = []
+        self.docno_of: Dict[str, int] = {}
+        self.extra_lengths: List[float] = []
+        self.delta: Dict[str, List[Tuple[int, int, List[int]]]] = {}
+        self.deleted: Set[int] = set()
+        self.live_docs = 0
+        self.total_length = 0.0
+        self.dirty = False
+        self._journal: Optional[list] = None  # Changes made while a new generation is written
+        self._lengths_cache: Optional[np.ndarray] = None
+
+    # -- Loading --
+
+    def load(self, directory: str, generation: int, synced_at: Optional[datetime]):
+        prefix = os.path.join(directory, f"{generation}")
+        with open(f"{prefix}.terms", encoding="utf-8") as f:
+            content = f.read()
+        self.__init__()
+        self.generation = generation
+        self.synced_at = synced_at
+        self.terms = content.split("\n") if content else []
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.lexicon = np.load(f"{prefix}.lexicon.npy", mmap_mode="r")
+        self.blob = np.memmap(f"{prefix}.postings", dtype=np.uint8, mode="r") if os.path.getsize(f"{prefix}.postings") else np.zeros(0, dtype=np.uint8)
+        self.base_lengths = np.load(f"{prefix}.lengths.npy", mmap_mode="r")
+        raw = np.load(f"{prefix}.docs.npy").tobytes()
+        self.doc_ids = [str(ObjectId(raw[i:i + 12])) for i in range(0, len(raw), 12)]
+        self.docno_of = {link_id: i for i, link_id in enumerate(self.doc_ids)}
+        self.base_docs = len(self.doc_ids)
+        self.live_docs = self.base_docs
+        self.total_length = float(np.sum(self.base_lengths, dtype=np.float64))
+
+    # -- Changes --
+
+    def add(self, link_id: str, length: float, postings: Dict[str, list]):
+        """Index (or re-index) one analyzed link"""
+        if self._journal is not None:
+            self._journal.append((link_id, length, postings))
+        self._remove(link_id)
+        docno = len(self.doc_ids)
+        self.doc_ids.append(link_id)
+        self.docno_of[link_id] = docno
+        self.extra_lengths.append(length)
+        for term, (weight, offsets) in postings.items():
+            self.delta.setdefault(term, []).append((docno, weight, offsets))
+        self.live_docs += 1
+        self.total_length += length
+        self._lengths_cache = None
+        self.dirty = True
+
+    def remove(self, link_id: str):
+        if self._journal is not None:
+            self._journal.append((link_id, None, None))
+        self._remove(link_id)
+
+    def _remove(self, link_id: str):
+        docno = self.docno_of.pop(link_id, None)
+        if docno is None:
+            return
+        self.deleted.add(docno)
+        self.live_docs -= 1
+        self.total_length -= float(self._lengths()[docno])
+        self.dirty = True
+
+    def _lengths(self) -> np.ndarray:
+        if self._lengths_cache is None:
+            self._lengths_cache = np.concatenate((self.base_lengths, np.asarray(self.extra_lengths, dtype=np.float32)))
+        return self._lengths_cache
+
+    # -- Lookup --
+
+    def postings(self, term: str) -> Optional[Postings]:
+        parts = []
+        index = self.term_index.get(term)
+        if index is not None:
+            offset, size, df = (int(v) for v in self.lexicon[index])
+            values = decode_varints(self.blob[offset:offset + size])
+            parts.append(Postings(np.cumsum(values[:df]), values[df:2 * df], values[2 * df:3 * df], values[3 * df:]))
+        rows = self.delta.get(term)
+        if rows:
+            npos = np.array([len(row[2]) for row in rows], dtype=np.int64)
+            parts.append(Postings(
+                np.array([row[0] for row in rows], dtype=np.int64),
+                np.array([row[1] for row in rows], dtype=np.int64),
+                npos,
+                offset_deltas(np.array([offset for row in rows for offset in row[2]], dtype=np.int64), npos)
+            ))
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        # Delta documents are numbered after the on-disk ones, so concatenation stays sorted
+        base, recent = parts
+        return Postings(
+            np.concatenate((base.docs, recent.docs)), np.concatenate((base.weights, recent.weights)),
+            np.concatenate((base.npos, recent.npos)), np.concatenate((base.deltas, recent.deltas))
+        )
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        """The most frequent indexed terms starting with prefix"""
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\uffff")
+        candidates = {}
+        if end > start:
+            df = np.asarray(self.lexicon[start:end, 2])
+            for i in np.argsort(-df, kind="stable")[:MAX_PREFIX_TERMS]:
+                candidates[self.terms[start + int(i)]] = int(df[i])
+        for term, rows in self.delta.items():
+            if term.startswith(prefix):
+                candidates[term] = candidates.get(term, 0) + len(rows)
+        return sorted(candidates, key=lambda term: -candidates[term])[:MAX_PREFIX_TERMS]
+
+    def search(self, query: str, limit: int = SEARCH_MAX_RESULTS) -> Tuple[List[SearchHit], Dict[str, Postings]]:
+        """Rank links by BM25; also returns the postings used, for snippets"""
+        optional, required, excluded, prefixes = parse_query(query)
+        groups = [self.expand_prefix(prefix) for prefix in prefixes]
+        if any(not group for group in groups) or not (optional or required or groups):
+            return [], {}
+
+        n_docs = len(self.doc_ids)
+        lengths = self._lengths()
+        avgdl = self.total_length / self.live_docs if self.live_docs else 1.0
+        scores = np.zeros(n_docs, dtype=np.float64)
+        keep = np.ones(n_docs, dtype=bool)
+        keep[list(self.deleted)] = False
+        used: Dict[str, Postings] = {}
+
+        for term in optional | required | {term for group in groups for term in group}:
+            postings = self.postings(term)
+            if postings is None:
+                continue
+            used[term] = postings
+            df = len(postings.docs)
+            idf = np.log(1.0 + (self.live_docs - df + 0.5) / (df + 0.5))
+            tf = postings.weights.astype(np.float64)
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[postings.docs] / avgdl)
+            scores[postings.docs] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        for term in required:
+            if term not in used:
+                return [], {}
+            present = np.zeros(n_docs, dtype=bool)
+            present[used[term].docs] = True
+            keep &= present
+        for group in groups:
+            present = np.zeros(n_docs, dtype=bool)
+            for term in group:
+                if term in used:
+                    present[used[term].docs] = True
+            keep &= present
+        for term in excluded:
+            postings = self.postings(term)
+            if postings is not None:
+                keep[postings.docs] = False
+
+        candidates = np.flatnonzero(keep & (scores > 0))
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [SearchHit(self.doc_ids[d], float(scores[d]), int(d)) for d in candidates], used
+
+    # -- Merging --
+
+    def _delta_rows(self, delta: Dict[str, list], vocabulary: Dict[str, int]) -> Rows:
+        term_ids, docnos, weights, npos, positions = [], [], [], [], []
+        for term, rows in delta.items():
+            term_id = vocabulary.setdefault(term, len(vocabulary))
+            for docno, weight, offsets in rows:
+                term_ids.append(term_id)
+                docnos.append(docno)
+                weights.append(weight)
+                npos.append(len(offsets))
+                positions.extend(offsets)
+        return Rows([], *(np.asarray(column, dtype=np.int64) for column in (term_ids, docnos, weights, npos, positions)))
+
+    def merged_rows(self, delta: Dict[str, list], deleted: Set[int], n_docs: int) -> Tuple[Rows, np.ndarray]:
+        """Base and delta postings without deleted documents, renumbered; returns (rows, kept docnos)"""
+        base = read_rows(np.asarray(self.blob), np.asarray(self.lexicon), self.terms)
+        vocabulary = {term: i for i, term in enumerate(self.terms)}
+        extra = self._delta_rows(delta, vocabulary)
+        terms = [None] * len(vocabulary)
+        for term, i in vocabulary.items():
+            terms[i] = term
+
+        alive = np.ones(n_docs, dtype=bool)
+        alive[list(deleted)] = False
+        renumber = np.cumsum(alive) - 1
+        columns = [np.concatenate((getattr(base, name), getattr(extra, name)))
+                   for name in ("term_ids", "docnos", "weights", "npos", "positions")]
+        term_ids, docnos, weights, npos, positions = columns
+        keep_rows = alive[docnos]
+        positions = positions[np.repeat(keep_rows, npos)]
+        rows = Rows(terms, term_ids[keep_rows], renumber[docnos[keep_rows]], weights[keep_rows], npos[keep_rows], positions)
+        # Terms whose every posting was deleted stay in the vocabulary with df 0; drop them
+        used = np.zeros(len(terms), dtype=bool)
+        used[rows.term_ids] = True
+        if not used.all():
+            remap = np.cumsum(used) - 1
+            rows.terms = [term for term, u in zip(terms, used) if u]
+            rows.term_ids = remap[rows.term_ids]
+        return rows, np.flatnonzero(alive)
+
+    def snippet(self, docno: int, used: Dict[str, Postings], content: Optional[str]) -> Optional[str]:
+        """Highlight the densest window of query-term offsets in the content"""
+        if not content:
+            return None
+        hits = sorted((offset, term) for term, postings in used.items() for offset in postings.offsets(docno))
+        if not hits:
+            return None
+        best, best_count, end = 0, 0, 0
+        for start in range(len(hits)):
+            while end < len(hits) and hits[end][0] < hits[start][0] + SNIPPET_CHARS:
+                end += 1
+            if end - start > best_count:
+                best, best_count = start, end - start
+        window_start = max(0, hits[best][0] - 40)
+        space = content.find(" ", window_start, hits[best][0])
+        if window_start > 0 and space != -1:
+            window_start = space + 1
+        window_end = min(len(content), window_start + SNIPPET_CHARS)
+        space = content.rfind(" ", hits[best][0], window_end)
+        if window_end < len(content) and space != -1:
+            window_end = space
+
+        parts, cursor = ["…" if window_start > 0 else ""], window_start
+        for offset, term in hits:
+            if offset < cursor or offset + len(term) > window_end:
+                continue
+            if content[offset:offset + len(term)].lower() != term:
+                continue  # Lowercasing changed the length; skip rather than mis-highlight
+            parts.append(html.escape(content[cursor:offset]))
+            parts.append(f"<mark>{html.escape(content[offset:offset + len(term)])}</mark>")
+            cursor = offset + len(term)
+        parts.append(html.escape(content[cursor:window_end]))
+        parts.append("…" if window_end < len(content) else "")
+        return "".join(parts)
+
+
+# --- Persistence ---
+
+@contextmanager
+def atomic_file(path: str):
+    """Binary file written under a temporary name and renamed to `path` once complete"""
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def save_array(path: str, array: np.ndarray):
+    with atomic_file(path) as f:
+        np.save(f, array)
+
+
+_writer_locks: Dict[str, int] = {}  # Directory -> file descriptor holding its writer lock
+
+
+def claim_writer(directory: str) -> bool:
+    """
+    Whether this process builds and merges the generations in `directory`. The first worker
+    to take the directory's writer lock keeps it until it exits (another worker then takes
+    over); the others only load what it publishes.
+    """
+    if directory in _writer_locks:
+        return True
+    if fcntl is None:
+        _writer_locks[directory] = -1
+        return True
+    fd = os.open(os.path.join(directory, WRITER_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _writer_locks[directory] = fd
+    return True
+
+
+def is_writer(directory: str) -> bool:
+    return directory in _writer_locks
+
+
+def release_writer(directory: str):
+    fd = _writer_locks.pop(directory, None)
+    if fd is not None and fd >= 0:
+        os.close(fd)  # Closing the descriptor releases the lock
+
+
+@contextmanager
+def write_lock(directory: str):
+    """Exclusive lock for writing and publishing a generation (blocks while another process does)"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(directory, WRITE_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def commit_generation(directory: str, write: Callable[[int], int], synced_at: Optional[datetime],
+                      extra: Optional[Dict] = None) -> int:
+    """
+    Write and publish the next generation under the write lock; `write(generation)` writes
+    its files and returns the number of documents. Blocks, so run it in a thread.
+    """
+    with write_lock(directory):
+        generation = next_generation(directory)
+        documents = write(generation)
+        publish_generation(directory, generation, synced_at, documents, extra)
+    return generation
+
+
+def _manifest_path(directory: str) -> str:
+    return os.path.join(directory, "manifest.json")
+
+
+def read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(_manifest_path(directory), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("format") == FORMAT_VERSION else None
+
+
+def publish_generation(directory: str, generation: int, synced_at: Optional[datetime], documents: int, extra: Optional[Dict] = None):
+    """
+    Point the manifest at a written generation (atomic rename) and delete older files; the
+    previous generation is kept for workers that are still loading it
+    """
+    manifest = {
+        "format": FORMAT_VERSION,
+        "generation": generation,
+        "synced_at": synced_at.isoformat() if synced_at else None,
+        "documents": documents,
+        **(extra or {})
+    }
+    with atomic_file(_manifest_path(directory)) as f:
+        f.write(json.dumps(manifest).encode("utf-8"))
+    for name in os.listdir(directory):
+        stem = name.split(".", 1)[0]
+        if stem.isdigit() and int(stem) < generation - 1:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def next_generation(directory: str) -> int:
+    stems = [int(name.split(".", 1)[0]) for name in os.listdir(directory) if name.split(".", 1)[0].isdigit()]
+    return max(stems, default=0) + 1
+
+
+_index: Optional[SearchIndex] = None  # Set once an index is loaded or built
+_sync_task: Optional[asyncio.Task] = None
+_save_lock = asyncio.Lock()
+
+
+def ready() -> bool:
+    return SEARCH_BACKEND == "bm25" and _index is not None
+
+
+def _analyze(docs: Iterable[Dict]) -> List[Tuple[str, float, Dict[str, list]]]:
+    return [(str(doc["_id"]), *analyze_document(doc)) for doc in docs]
+
+
+async def index_documents(docs: Iterable[Dict]):
+    """Add or replace links in the index (no-op unless the BM25 backend is loaded), analyzing them off the event loop"""
+    if not ready():
+        return
+    analyzed = await asyncio.to_thread(_analyze, list(docs))
+    # A save may have swapped in a new generation meanwhile; postings don't depend on it
+    for link_id, length, postings in analyzed:
+        _index.add(link_id, length, postings)
+
+
+def remove_document(link_id: str):
+    if ready():
+        _index.remove(link_id)
+
+
+async def reindex_link(link_id: str):
+    """Re-read a link after its indexed fields changed"""
+    if not ready():
+        return
+    doc = await collection.find_one({"_id": ObjectId(link_id)}, INDEX_PROJECTION)
+    if doc is None:
+        _index.remove(link_id)
+    else:
+        await index_documents([doc])
+
+
+async def save_index():
+    """Merge the in-memory delta into a new generation on disk, off the event loop (writer only)"""
+    global _index
+    index = _index
+    if index is None or not index.dirty or not is_writer(SEARCH_INDEX_DIR):
+        return
+    async with _save_lock:
+        snapshot = ({term: list(rows) for term, rows in index.delta.items()}, set(index.deleted), len(index.doc_ids))
+        doc_ids, lengths = list(index.doc_ids), index._lengths().copy()
+        synced_at = index.synced_at
+        index._journal = []
+        try:
+            def write(generation: int) -> int:
+                rows, kept = index.merged_rows(*snapshot)
+                write_generation(SEARCH_INDEX_DIR, generation, rows, [doc_ids[i] for i in kept], lengths[kept])
+                return len(kept)
+
+            generation = await asyncio.to_thread(commit_generation, SEARCH_INDEX_DIR, write, synced_at)
+            loaded = SearchIndex()
+            loaded.load(SEARCH_INDEX_DIR, generation, synced_at)
+        finally:
+            journal, index._journal = index._journal, None
+        # Replay what changed while writing
+        for link_id, length, postings in journal:
+            if postings is None:
+                loaded.remove(link_id)
+            else:
+                loaded.add(link_id, length, postings)
+        loaded.dirty = bool(journal)
+        _index = loaded
+        logger.info(f"🔎 Search index generation {generation} saved ({loaded.base_docs} links, {len(loaded.terms)} terms)")
+
+
+async def build_index(batch_size: int = 500) -> SearchIndex:
+    """Index the whole library from the database into a new generation"""
+    global _index
+    os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+    started_at = datetime.utcnow()
+    vocabulary: Dict[str, int] = {}
+    columns = {name: [] for name in ("term_ids", "docnos", "weights", "npos", "positions")}
+    doc_ids: List[str] = []
+    lengths: List[float] = []
+
+    def analyze_batch(docs: List[Dict]) -> Rows:
+        delta: Dict[str, list] = {}
+        for doc in docs:
+            length, postings = analyze_document(doc)
+            docno = len(doc_ids)
+            doc_ids.append(str(doc["_id"]))
+            lengths.append(length)
+            for term, (weight, offsets) in postings.items():
+                delta.setdefault(term, []).append((docno, weight, offsets))
+        return SearchIndex()._delta_rows(delta, vocabulary)
+
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await collection.find(query, INDEX_PROJECTION).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        rows = await asyncio.to_thread(analyze_batch, docs)
+        for name in columns:
+            columns[name].append(getattr(rows, name))
+        logger.info(f"🔎 Indexed {len(doc_ids)} links")
+
+    terms = [None] * len(vocabulary)
+    for term, i in vocabulary.items():
+        terms[i] = term
+    rows = Rows(terms, *(np.concatenate(columns[name]) if columns[name] else np.zeros(0, dtype=np.int64) for name in columns))
+
+    def write(generation: int) -> int:
+        write_generation(SEARCH_INDEX_DIR, generation, rows, doc_ids, np.asarray(lengths))
+        return len(doc_ids)
+
+    generation = await asyncio.to_thread(commit_generation, SEARCH_INDEX_DIR, write, started_at)
+    index = SearchIndex()
+    index.load(SEARCH_INDEX_DIR, generation, started_at)
+    if SEARCH_BACKEND == "bm25":
+        _index = index
+    logger.info(f"🔎 Search index built over {len(doc_ids)} links ({len(terms)} terms)")
+    return index
+
+
+async def sync_index(batch_size: int = 500):
+    """Pick up links changed by other processes (or while the index was offline)"""
+    if not ready() or _index.synced_at is None:
+        return
+    now = datetime.utcnow()
+    since = _index.synced_at - SYNC_OVERLAP
+    changed = 0
+    cursor = collection.find({"updated_at": {"$gt": since}}, INDEX_PROJECTION)
+    while docs := await cursor.to_list(length=batch_size):
+        for link_id, length, postings in await asyncio.to_thread(_analyze, docs):
+            _index.add(link_id, length, postings)
+        changed += len(docs)
+    _index.synced_at = now
+    if changed:
+        logger.info(f"🔎 Synced {changed} changed links into the search index")
+
+
+def _load(manifest: Dict):
+    """Switch to the published generation; changes since its sync are re-read from updated_at"""
+    global _index
+    index = SearchIndex()
+    synced_at = datetime.fromisoformat(manifest["synced_at"]) if manifest.get("synced_at") else None
+    index.load(SEARCH_INDEX_DIR, manifest["generation"], synced_at)
+    _index = index
+    logger.info(f"🔎 Loaded search index generation {index.generation} ({index.base_docs} links)")
+
+
+async def _sync_loop():
+    while True:
+        try:
+            # Re-checked every round so another worker takes over when the writer exits
+            writer = claim_writer(SEARCH_INDEX_DIR)
+            manifest = read_manifest(SEARCH_INDEX_DIR)
+            if manifest is None:
+                if writer:
+                    await build_index()
+            elif _index is None or manifest["generation"] > _index.generation:
+                _load(manifest)
+            await sync_index()
+            # Unsaved changes are re-read from updated_at after a restart, so merging can wait for a big delta
+            if writer and _index is not None and len(_index.extra_lengths) + len(_index.deleted) >= MAX_DELTA_DOCS:
+                await save_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Search index sync failed: {e}")
+        await asyncio.sleep(SEARCH_INDEX_FLUSH_INTERVAL)
+
+
+def start_search_index():
+    """Load (or build) the BM25 index and keep it in sync (call from the app lifespan)"""
+    global _sync_task
+    if SEARCH_BACKEND == "bm25":
+        os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+        _sync_task = asyncio.create_task(_sync_loop())
+
+
+async def stop_search_index():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
+    try:
+        await save_index()
+    except Exception as e:
+        logger.error(f"Error saving search index: {e}")
+    release_writer(SEARCH_INDEX_DIR)
+
+
+async def search_links(search: str, filters: Dict, skip: int, limit: int,
+                       projection: Optional[Dict] = None) -> Tuple[List[Dict], int]:
+    """
+    Ranked, filtered page of links for a search, each with a highlighted `snippet`.
+    Filters are applied by MongoDB to the ranked candidates, so counts stay exact.
+    With a projection (see projections.py) content is only fetched to cut the snippets.
+    """
+    index = _index  # A save may swap in a new generation (with new doc numbers) while we await
+    hits, used = index.search(search)
+    if not hits:
+        return [], 0
+    ids = [ObjectId(hit.link_id) for hit in hits]
+    allowed = {doc["_id"] async for doc in collection.find({**filters, "_id": {"$in": ids}}, {"_id": 1})}
+    ranked = [(oid, hit) for oid, hit in zip(ids, hits) if oid in allowed]
+    page = ranked[skip:skip + limit]
+    fields = with_content(projection) if projection else None
+    docs = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": [oid for oid, _ in page]}}, fields)}
+    links = []
+    for oid, hit in page:
+        doc = docs.get(oid)
+        if doc is None:
+            continue
+        content = doc.pop("content", None) if projection else doc.get("content")
+        doc["snippet"] = index.snippet(hit.docno, used, content)
+        links.append(doc)
+    return links, len(ranked)
+
+
+async def main(args):
+    try:
+        started = datetime.utcnow()
+        index = await build_index(batch_size=args.batch_size)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        print(f"✅ Indexed {index.base_docs} links ({len(index.terms)} terms) into {SEARCH_INDEX_DIR} in {elapsed:.1f}s")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Rebuild the embedded BM25 search index from the database")
+    parser.add_argument("--batch-size", type=int, default=500, help="Links read and analyzed per batch")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,195 @@
+"""
+Tagging engine used by the scraper (via text_analysis) and the retag job
+The taxonomy (domain -> tags, tag -> keywords) is compiled once into a single regex:
+the keywords form a prefix trie turned into nested alternations, wrapped in word
+boundaries. An article is scanned in one pass whatever the number of keywords
+(instead of one substring scan per keyword), and "ai" no longer matches inside "said".
+Tags are ranked by how often their keywords occur, which makes the top-N stable.
+The taxonomy lives in taxonomy.yaml and is recompiled when the file changes.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+import yaml
+
+logger = logging.getLogger(__name__)
+
+TAXONOMY_FILE = os.getenv("TAXONOMY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "taxonomy.yaml"))
+TAXONOMY_CHECK_INTERVAL = float(os.getenv("TAXONOMY_CHECK_INTERVAL", "5"))  # Seconds between file change checks
+
+MAX_TAGS = 5
+
+
+def trie_pattern(words: List[str]) -> str:
+    """
+    Build a regex alternation from a prefix trie of the words, e.g. ["aws", "azure", "ai"]
+    -> "a(?:i|ws|zure)". The regex engine then tests one branch per character instead of
+    retrying every keyword at every position. Longer words are preferred at a position.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if "" in node:
+            return f"(?:{'|'.join(branches)})?"
+        if len(branches) == 1:
+            return branches[0]
+        return f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
+class TagMatcher:
+    """A taxonomy compiled for single-pass matching"""
+
+    def __init__(self, domain_tags: Dict[str, List[str]], keyword_tags: Dict[str, List[str]], version: str = ""):
+        self.version = version  # Hash of the taxonomy source, stored on links as taxonomy_version
+        self.tag_names = set(keyword_tags) | {tag for tags in domain_tags.values() for tag in tags}
+        self.domain_tags = {domain.lower(): list(tags) for domain, tags in domain_tags.items()}
+        self.keyword_to_tags: Dict[str, List[str]] = {}
+        for tag, keywords in keyword_tags.items():
+            for keyword in keywords:
+                tags = self.keyword_to_tags.setdefault(keyword.lower(), [])
+                if tag not in tags:
+                    tags.append(tag)
+
+        self.max_keyword_chars = max(map(len, self.keyword_to_tags), default=0)
+        self.pattern: Optional[re.Pattern] = None
+        if self.keyword_to_tags:
+            # Text is lowercased before matching; re.IGNORECASE makes the scan about 2x slower
+            self.pattern = re.compile(rf"(?<!\w){trie_pattern(list(self.keyword_to_tags))}(?!\w)")
+
+    def domain_matches(self, domain: str) -> List[str]:
+        """Tags for a domain or any of its subdomains (www.github.com, gist.github.com, ...)"""
+        domain = (domain or "").lower()
+        tags = []
+        for key, key_tags in self.domain_tags.items():
+            if domain == key or domain.endswith(f".{key}"):
+                tags.extend(tag for tag in key_tags if tag not in tags)
+        return tags
+
+    def keyword_hits(self, *texts: str) -> Counter:
+        """Count keyword hits per tag across the given texts"""
+        hits = Counter()
+        if self.pattern is None:
+            return hits
+        for text in texts:
+            if not text:
+                continue
+            for keyword in self.pattern.findall(text.lower()):
+                for tag in self.keyword_to_tags[keyword]:
+                    hits[tag] += 1
+        return hits
+
+    def tag(self, title: str, text: str, domain: str, limit: int = MAX_TAGS) -> List[str]:
+        """Domain tags first, then keyword tags by hit count (ties broken alphabetically)"""
+        return self.rank(domain, self.keyword_hits(title, text), limit)
+
+    def rank(self, domain: str, hits: Counter, limit: int = MAX_TAGS) -> List[str]:
+        """Tags for already counted keyword hits (see text_analysis.analyze_text)"""
+        tags = self.domain_matches(domain)
+        for tag, _ in sorted(hits.items(), key=lambda item: (-item[1], item[0])):
+            if tag not in tags:
+                tags.append(tag)
+        return tags[:limit]
+
+
+class KeywordScanner:
+    """
+    Counts a matcher's keyword hits over text fed in consecutive chunks, with the same result
+    as matching the whole text at once. The last longest-keyword's worth of each chunk is
+    carried into the next, so a keyword spanning a cut ("machine | learning") is still found,
+    and counted once.
+    """
+
+    def __init__(self, matcher: TagMatcher):
+        self.matcher = matcher
+        self.hits = Counter()
+        self._carry = ""  # Lowercased tail of the text fed so far
+        self._pos = 0  # Where matching resumes in the carry (earlier characters are lookbehind context)
+
+    def feed(self, chunk: str):
+        if self.matcher.pattern is not None and chunk:
+            self._scan(self._carry + chunk.lower(), final=False)
+
+    def finish(self) -> Counter:
+        if self.matcher.pattern is not None and self._carry:
+            self._scan(self._carry, final=True)
+        self._carry, self._pos = "", 0
+        return self.hits
+
+    def _scan(self, text: str, final: bool):
+        # A match starting before `settled` ends inside the text, whatever comes next
+        settled = len(text) if final else len(text) - self.matcher.max_keyword_chars
+        resume = self._pos
+        for match in self.matcher.pattern.finditer(text, self._pos):
+            if match.start() >= settled:
+                break
+            for tag in self.matcher.keyword_to_tags[match.group()]:
+                self.hits[tag] += 1
+            resume = match.end()
+        if not final:
+            resume = max(resume, settled)
+            keep = max(resume - 1, 0)
+            self._carry, self._pos = text[keep:], resume - keep
+
+
+_matcher = TagMatcher({}, {})
+_loaded_mtime: Optional[float] = None
+_next_check = 0.0
+_lock = threading.Lock()
+
+
+def load_taxonomy(path: str = TAXONOMY_FILE) -> TagMatcher:
+    """Parse and compile a taxonomy file (raises on missing or malformed files)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = yaml.safe_load(raw) or {}
+    domains = data.get("domains") or {}
+    keywords = data.get("keywords") or {}
+    if not isinstance(domains, dict) or not isinstance(keywords, dict):
+        raise ValueError("taxonomy needs 'domains' and 'keywords' mappings")
+    return TagMatcher(
+        {str(domain): [str(tag) for tag in tags or []] for domain, tags in domains.items()},
+        {str(tag): [str(keyword) for keyword in words or []] for tag, words in keywords.items()},
+        version=hashlib.sha1(raw).hexdigest()[:12]
+    )
+
+
+def get_matcher() -> TagMatcher:
+    """
+    Return the compiled taxonomy, reloading it if the file changed.
+    The file is stat'ed at most every TAXONOMY_CHECK_INTERVAL seconds; a broken edit is
+    logged and the previous taxonomy stays in use.
+    """
+    global _matcher, _loaded_mtime, _next_check
+    now = time.monotonic()
+    if now < _next_check:
+        return _matcher
+    with _lock:
+        if now < _next_check:
+            return _matcher
+        _next_check = now + TAXONOMY_CHECK_INTERVAL
+        try:
+            mtime = os.path.getmtime(TAXONOMY_FILE)
+            if mtime != _loaded_mtime:
+                _loaded_mtime = mtime  # Don't retry (and re-log) a broken file until it changes again
+                matcher = load_taxonomy()
+                if _matcher.version:
+                    logger.info(f"🏷️ Reloaded tag taxonomy (version {matcher.version})")
+                _matcher = matcher
+        except Exception as e:
+            logger.error(f"Could not load tag taxonomy from {TAXONOMY_FILE}: {e}")
+    return _matcher
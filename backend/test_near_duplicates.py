@@ -0,0 +1,55 @@
+"""
+MinHash signatures, LSH bands and clustering of near-duplicate links
+Run with: python -m pytest test_near_duplicates.py
+"""
+import random
+import numpy as np
+from bson import ObjectId
+from near_duplicates import NEAR_DUP_THRESHOLD, _repoint_failed, band_keys, cluster, signature, similarity
+
+rng = random.Random(3)
+VOCABULARY = [f"word{i}" for i in range(2000)]
+
+
+def article(length: int = 400) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(length))
+
+
+def mirror(text: str) -> str:
+    """The same article with a different header and footer, as on a mirror or AMP page"""
+    return "Home | Subscribe " + text + " Share this post on social media"
+
+
+def test_near_identical_texts_share_a_band():
+    text = article()
+    original, copy, other = signature(text), signature(mirror(text)), signature(article())
+    assert similarity(original, copy)[0] >= NEAR_DUP_THRESHOLD
+    assert similarity(original, other)[0] < 0.1
+    keys = band_keys(np.stack([original, copy, other]))
+    assert set(keys[0]) & set(keys[1])
+    assert not set(keys[0]) & set(keys[2])
+
+
+def test_short_texts_have_no_signature():
+    assert signature("too short to compare") is None
+
+
+def test_cluster_points_copies_at_the_earliest_row():
+    first, second = article(), article()
+    rows = [first, second, mirror(first), article(), mirror(second), mirror(mirror(first))]
+    roots = cluster(np.stack([signature(text) for text in rows]))
+    assert roots.tolist() == [0, 1, 0, 3, 1, 0]
+
+
+def test_copies_of_a_failed_insert_are_repointed():
+    ids = [ObjectId() for _ in range(4)]
+    docs = [
+        {"_id": ids[0]},  # Original within the batch, then fails on the unique index
+        {"_id": ids[1], "duplicate_of": str(ids[0])},
+        {"_id": ids[2], "duplicate_of": "stored-link"},
+        {"_id": ids[3], "duplicate_of": str(ids[0])},
+    ]
+    changed = _repoint_failed(docs, [False, True, True, True])
+    assert [doc["_id"] for doc in changed] == [ids[1], ids[3]]
+    assert [doc.get("duplicate_of") for doc in docs[1:]] == [None, "stored-link", str(ids[1])]
+    assert _repoint_failed(docs, [True, True, True, True]) == []
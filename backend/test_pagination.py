@@ -0,0 +1,65 @@
+"""
+Keyset pagination cursors for the link list
+Run with: python -m pytest test_pagination.py
+"""
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from pagination import after_cursor, decode_cursor, encode_cursor, next_cursor
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """Evaluate the subset of MongoDB filters after_cursor produces"""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not doc[field] < condition["$lt"]:
+                return False
+        elif doc[field] != condition:
+            return False
+    return True
+
+
+def test_cursor_round_trip():
+    created_at, link_id = datetime(2024, 5, 1, 12, 30, 15, 123000), ObjectId()
+    cursor = encode_cursor(created_at, link_id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, link_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(datetime(2024, 1, 1), "x")])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_after_cursor_breaks_ties_on_id():
+    same_time, earlier = datetime(2024, 5, 1), datetime(2024, 4, 30)
+    links = [{"created_at": same_time, "_id": ObjectId()} for _ in range(4)]
+    links.append({"created_at": earlier, "_id": ObjectId()})
+    links.sort(key=lambda link: (link["created_at"], link["_id"]), reverse=True)  # NEWEST_FIRST
+    for i, last in enumerate(links):
+        query = after_cursor(*decode_cursor(encode_cursor(last["created_at"], last["_id"])))
+        assert [link for link in links if matches(link, query)] == links[i + 1:]
+
+
+def test_next_cursor_only_on_full_pages():
+    page = [{"created_at": datetime(2024, 5, 1), "id": str(ObjectId())} for _ in range(3)]
+    assert next_cursor(page, 3) == encode_cursor(page[-1]["created_at"], page[-1]["id"])
+    assert next_cursor(page, 4) is None
+    assert next_cursor([], 3) is None
+
+
+def test_list_rejects_malformed_cursor():
+    import main
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"username": "test"}
+    try:
+        client = TestClient(main.app)
+        assert client.get("/api/links", params={"cursor": "not-a-cursor"}).status_code == 400
+        cursor = encode_cursor(datetime(2024, 5, 1), ObjectId())
+        assert client.get("/api/links", params={"cursor": cursor, "search": "kube*"}).status_code == 400
+    finally:
+        main.app.dependency_overrides.clear()
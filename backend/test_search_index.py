@@ -0,0 +1,124 @@
+"""
+Embedded BM25 index: varint codec, generation files, merging, ranking and snippets
+Run with: python -m pytest test_search_index.py
+"""
+import numpy as np
+from bson import ObjectId
+import search_index as si
+
+
+def link(title: str, content: str = "") -> dict:
+    return {"_id": str(ObjectId()), "title": title, "content": content}
+
+
+def build(directory, docs, generation: int = 1) -> si.SearchIndex:
+    """Write docs as a generation (as build_index does) and load it"""
+    vocabulary, delta, lengths = {}, {}, []
+    for docno, doc in enumerate(docs):
+        length, postings = si.analyze_document(doc)
+        lengths.append(length)
+        for term, (weight, offsets) in postings.items():
+            delta.setdefault(term, []).append((docno, weight, offsets))
+    rows = si.SearchIndex()._delta_rows(delta, vocabulary)
+    rows.terms = sorted(vocabulary, key=vocabulary.get)
+    si.write_generation(str(directory), generation, rows, [doc["_id"] for doc in docs], np.asarray(lengths))
+    index = si.SearchIndex()
+    index.load(str(directory), generation, None)
+    return index
+
+
+def row_set(rows: si.Rows, doc_ids) -> set:
+    """(term, link id, weight, offsets) per row, independent of row order and numbering"""
+    starts = np.cumsum(rows.npos) - rows.npos
+    return {
+        (rows.terms[t], doc_ids[d], int(w), tuple(rows.positions[s:s + n].tolist()))
+        for t, d, w, n, s in zip(rows.term_ids, rows.docnos, rows.weights, rows.npos, starts)
+    }
+
+
+def expected_rows(docs) -> set:
+    return {
+        (term, doc["_id"], weight, tuple(offsets))
+        for doc in docs
+        for term, (weight, offsets) in si.analyze_document(doc)[1].items()
+    }
+
+
+def test_varints_round_trip(monkeypatch):
+    rng = np.random.default_rng(0)
+    values = np.concatenate((
+        [0, 1, 127, 128, 16383, 16384, 2 ** 35, 2 ** 62],
+        rng.integers(0, 2 ** 40, 5000)
+    )).astype(np.int64)
+    data, sizes = si.encode_varints(values)
+    assert sizes.sum() == len(data)
+    assert sizes[:4].tolist() == [1, 1, 1, 2]
+    assert np.array_equal(si.decode_varints(data), values)
+    assert len(si.decode_varints(np.zeros(0, dtype=np.uint8))) == 0
+    # Slices are cut between varints, never inside one
+    monkeypatch.setattr(si, "CODEC_CHUNK", 16)
+    assert np.array_equal(si.decode_varints(data), values)
+
+
+def test_generation_round_trip(tmp_path):
+    content = "The borrow checker keeps Rust memory safe. Rust again."
+    docs = [
+        link("Rust borrow checker", content),
+        link("Python asyncio", "Event loops and tasks in Python"),
+        link("Zebra", ""),
+    ]
+    index = build(tmp_path, docs)
+    rows = si.read_rows(np.asarray(index.blob), np.asarray(index.lexicon), index.terms)
+    assert index.terms == sorted(index.terms)
+    assert row_set(rows, index.doc_ids) == expected_rows(docs)
+    assert index.postings("rust").offsets(0) == [content.index("Rust"), content.rindex("Rust")]
+
+
+def test_merged_rows_after_add_remove_replace(tmp_path):
+    docs = [link(f"Post {i}", f"shared words and topic{i} content") for i in range(5)]
+    index = build(tmp_path, docs)
+    added = link("New post", "fresh topic9 content")
+    replaced = {**docs[1], "content": "rewritten body about zebras"}
+    index.add(added["_id"], *si.analyze_document(added))
+    index.remove(docs[3]["_id"])
+    index.add(replaced["_id"], *si.analyze_document(replaced))
+
+    rows, kept = index.merged_rows(index.delta, index.deleted, len(index.doc_ids))
+    kept_ids = [index.doc_ids[i] for i in kept]
+    final = [docs[0], docs[2], docs[4], added, replaced]
+    assert sorted(kept_ids) == sorted(doc["_id"] for doc in final)
+    assert row_set(rows, kept_ids) == expected_rows(final)
+    assert "topic3" not in rows.terms  # Only the removed link had it
+
+    si.write_generation(str(tmp_path), 2, rows, kept_ids, index._lengths()[kept])
+    merged = si.SearchIndex()
+    merged.load(str(tmp_path), 2, None)
+    assert [hit.link_id for hit in merged.search("zebras")[0]] == [replaced["_id"]]
+    assert merged.search("topic1")[0] == []
+
+
+def test_bm25_ordering(tmp_path):
+    docs = [
+        link("Unrelated", "python only"),
+        link("Mentions", "rust appears once among many other words here"),
+        link("About rust", "rust rust rust"),
+        link("Rust in the title", "memory safety"),
+    ]
+    index = build(tmp_path, docs)
+    hits, _ = index.search("rust")
+    # Title matches weigh 3x; a short content full of the term beats a single mention
+    assert [hit.link_id for hit in hits] == [docs[2]["_id"], docs[3]["_id"], docs[1]["_id"]]
+    assert all(a.score >= b.score for a, b in zip(hits, hits[1:]))
+    assert [hit.link_id for hit in index.search("rust -memory")[0]] == [docs[2]["_id"], docs[1]["_id"]]
+    assert [hit.link_id for hit in index.search("pyth*")[0]] == [docs[0]["_id"]]
+
+
+def test_snippet_highlights_query_terms(tmp_path):
+    content = "Intro. The <b>borrow</b> checker in Rust is strict, and Rust users like it."
+    docs = [link("Notes", content)]
+    index = build(tmp_path, docs)
+    hits, used = index.search("rust borrow")
+    snippet = index.snippet(hits[0].docno, used, content)
+    assert snippet.count("<mark>Rust</mark>") == 2
+    assert "&lt;b&gt;<mark>borrow</mark>&lt;/b&gt;" in snippet
+    assert index.snippet(hits[0].docno, used, None) is None
@@ -0,0 +1,35 @@
+"""
+Chunked text analysis must find the same taxonomy keywords as matching the whole text
+Run with: python -m pytest test_text_analysis.py
+"""
+import random
+from tagging import KeywordScanner, TagMatcher
+from text_analysis import iter_chunks
+
+MATCHER = TagMatcher({}, {
+    "AI": ["machine learning", "machine", "ai"],
+    "Rust": ["rust", "borrow checker"],
+})
+
+
+def scan(text: str, size: int):
+    scanner = KeywordScanner(MATCHER)
+    for chunk in iter_chunks(text, size):
+        scanner.feed(chunk)
+    return scanner.finish()
+
+
+def test_keyword_straddling_a_chunk_boundary():
+    text = "x" * 31 + " borrow checker errors"
+    chunks = list(iter_chunks(text, 40))
+    assert chunks[0].endswith("borrow ") and chunks[1].startswith("checker")
+    assert scan(text, 40) == {"Rust": 1}
+
+
+def test_chunked_hits_match_whole_text():
+    words = ["machine", "learning", "rust", "borrow", "checker", "ai", "said", "\n", "word"]
+    rng = random.Random(7)
+    for _ in range(200):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 120)))
+        for size in (8, 13, 32, 64):
+            assert scan(text, size) == MATCHER.keyword_hits(text)
@@ -0,0 +1,55 @@
+"""
+canonicalize_url() decides the unique canonical_url key, so equal links must map to one key
+Run with: python -m pytest test_urls.py
+"""
+import pytest
+from urls import canonicalize_url, find_urls, youtube_video_id
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/post",
+    "http://example.com/post",
+    "https://www.example.com/post",
+    "https://EXAMPLE.com./post/",
+    "https://example.com:443/post#comments",
+    "http://example.com:80/post?utm_source=x&utm_medium=y",
+    "https://example.com/post?fbclid=abc&gclid=def&si=1",
+])
+def test_spellings_of_one_link(url):
+    assert canonicalize_url(url) == "https://example.com/post"
+
+
+def test_root_keeps_its_slash_and_other_ports_stay():
+    assert canonicalize_url("https://example.com") == "https://example.com/"
+    assert canonicalize_url("https://example.com/") == "https://example.com/"
+    assert canonicalize_url("http://example.com:8080/a/") == "https://example.com:8080/a"
+
+
+def test_query_is_sorted_and_kept():
+    a = canonicalize_url("https://example.com/search?q=rust&page=2&utm_campaign=z")
+    b = canonicalize_url("https://example.com/search?page=2&q=rust")
+    assert a == b == "https://example.com/search?page=2&q=rust"
+    assert canonicalize_url("https://example.com/?id=1") != canonicalize_url("https://example.com/?id=2")
+    assert canonicalize_url("https://example.com/?flag=") == "https://example.com/?flag="
+
+
+@pytest.mark.parametrize("url", [
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?si=tracking&t=42",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&feature=share",
+    "https://m.youtube.com/watch/?v=dQw4w9WgXcQ",
+    "https://youtube.com/shorts/dQw4w9WgXcQ",
+    "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+])
+def test_youtube_links(url):
+    assert canonicalize_url(url) == "https://youtube.com/watch?v=dQw4w9WgXcQ"
+    assert youtube_video_id(url) == "dQw4w9WgXcQ"
+
+
+def test_youtube_pages_that_are_not_videos():
+    assert canonicalize_url("https://www.youtube.com/@channel/videos/") == "https://youtube.com/@channel/videos"
+    assert youtube_video_id("https://www.youtube.com/@channel") == ""
+
+
+def test_find_urls_strips_trailing_punctuation():
+    assert find_urls("see https://a.com/x, and http://b.org/y.") == ["https://a.com/x", "http://b.org/y"]
@@ -0,0 +1,91 @@
+"""
+Single-pass analysis of extracted article text
+Word count, reading time, summary, nested links and tag keyword hits are computed in one
+walk over the text instead of one full scan (and one full copy) each. The text is read
+in chunks that end at a line or word break, so the only copies made are chunk-sized:
+a multi-megabyte article is never split into one big word list or lowercased as a whole.
+Keyword hits are counted by a tagging.KeywordScanner, which also finds keywords that a
+cut at a word break splits in two.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+from tagging import KeywordScanner, TagMatcher
+
+ANALYSIS_CHUNK_CHARS = 64 * 1024  # Characters analyzed per step
+SUMMARY_CHARS = 400
+SUMMARY_MIN_CHARS = 150  # Shorter sentence cuts fall back to a word cut
+WORDS_PER_MINUTE = 200
+
+LINK_PATTERN = re.compile(r'https?://[^\s<>"]+|www\.[^\s<>"]+')
+SENTENCE_END = re.compile(r'[.!?]["\'”)\]]*(?=\s)')
+
+
+@dataclass
+class TextStats:
+    """Content-derived fields of an article"""
+    word_count: int = 0
+    reading_time: int = 0  # Minutes at WORDS_PER_MINUTE, at least 1 for non-empty text
+    summary: str = ""
+    links: List[str] = field(default_factory=list)  # URLs found in the text, in order of appearance
+    tag_hits: Counter = field(default_factory=Counter)  # Taxonomy keyword hits per tag (title included)
+
+
+def reading_time(word_count: int) -> int:
+    return max(1, round(word_count / WORDS_PER_MINUTE)) if word_count else 0
+
+
+def summarize(text: str, limit: int = SUMMARY_CHARS) -> str:
+    """The opening of the text, cut at the last sentence end (or word) before `limit` characters"""
+    if len(text) <= limit:
+        return text
+    head = text[:limit + 1]
+    ends = [m.end() for m in SENTENCE_END.finditer(head) if m.end() <= limit]
+    if ends and ends[-1] >= SUMMARY_MIN_CHARS:
+        return head[:ends[-1]]
+    cut = head.rfind(" ", SUMMARY_MIN_CHARS)
+    return head[:cut if cut != -1 else limit].rstrip() + "..."
+
+
+def iter_chunks(text: str, size: int = ANALYSIS_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Consecutive slices of about `size` characters. Each ends at a newline if there is one
+    in its second half, else at a space, so no word or URL is split (a multi-word keyword
+    can be, see KeywordScanner).
+    """
+    start, length = 0, len(text)
+    while start < length:
+        end = start + size
+        if end < length:
+            cut = text.rfind("\n", start + size // 2, end)
+            if cut == -1:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        yield text[start:end]
+        start = end
+
+
+def analyze_text(text: str, url: str = "", title: str = "", matcher: Optional[TagMatcher] = None) -> TextStats:
+    """Analyze article text in one chunked pass; `url` is excluded from the links found"""
+    stats = TextStats(summary=summarize(text or ""))
+    if matcher is not None and title:
+        stats.tag_hits.update(matcher.keyword_hits(title))
+    if not text:
+        return stats
+
+    links = {}  # Ordered set
+    scanner = KeywordScanner(matcher) if matcher is not None else None
+    for chunk in iter_chunks(text):
+        stats.word_count += len(chunk.split())
+        if scanner is not None:
+            scanner.feed(chunk)
+        for link in LINK_PATTERN.findall(chunk):
+            if link != url:
+                links[link] = None
+    if scanner is not None:
+        stats.tag_hits.update(scanner.finish())
+    stats.links = list(links)
+    stats.reading_time = reading_time(stats.word_count)
+    return stats
@@ -0,0 +1,489 @@
+"""
+Corpus-level TF-IDF keywords and cluster tags
+Terms are hashed into a fixed number of buckets (TFIDF_DIM), so document frequencies are
+a single NumPy array that can grow incrementally as links arrive. Documents are scored
+in batches as SciPy sparse matrices: sublinear tf x idf, L2-normalized rows.
+Each link gets its top `keywords`, and `suggested_tags` from the nearest cluster of a
+spherical k-means model fitted over the library by the rebuild job.
+
+The model is stored in the `models` collection. Running processes add the document
+frequencies of new links to the stored model with an optimistic version check.
+
+Usage (rebuild statistics and clusters, then annotate every link):
+    python tfidf.py [--clusters 24] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+from scipy import sparse
+from database import collection, models_collection, close_database_connection
+
+logger = logging.getLogger(__name__)
+
+TFIDF_ENABLED = os.getenv("TFIDF_ENABLED", "true").lower() in ("1", "true", "yes")
+TFIDF_DIM = int(os.getenv("TFIDF_DIM", str(2 ** 18)))  # Hash buckets (power of two)
+TFIDF_CLUSTERS = int(os.getenv("TFIDF_CLUSTERS", "24"))
+TFIDF_MAX_CHARS = int(os.getenv("TFIDF_MAX_CHARS", "20000"))  # Only the start of long articles is analyzed
+TFIDF_FLUSH_INTERVAL = float(os.getenv("TFIDF_FLUSH_INTERVAL", "60"))  # Seconds between model saves
+TFIDF_FIT_SAMPLE = int(os.getenv("TFIDF_FIT_SAMPLE", "20000"))  # Links used to fit the clusters
+TFIDF_BATCH_SIZE = int(os.getenv("TFIDF_BATCH_SIZE", "500"))  # Links scored per vectorized call
+KEYWORDS_PER_LINK = 8
+CENTROID_TERMS = 300  # Non-zero weights kept per stored centroid
+LABEL_TERMS = 3  # Terms used to name a cluster
+MODEL_ID = "tfidf"
+
+TOKEN = re.compile(r"[a-z][a-z0-9+#]{2,}")  # Terms of three or more characters
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are aren as at be because been before being below
+between both but by can cannot could did do does doing don down during each even ever every few for from
+further get gets got had has have having he her here hers herself him himself his how however i if in into
+is it its itself just let like made make makes many may me might more most much must my myself need new no
+nor not now of off often on once one only or other our ours ourselves out over own per rather really same
+see she should since so some still such than that the their theirs them themselves then there these they
+this those through thus to too two under until up upon us use used uses using very via was we well were
+what when where which while who whom why will with within without would yet you your yours yourself
+""".split())
+
+
+def term_counts(text: str) -> Counter:
+    """Lowercased content terms of the first TFIDF_MAX_CHARS characters, with their counts"""
+    counts = Counter(TOKEN.findall((text or "")[:TFIDF_MAX_CHARS].lower()))
+    # Dropping stopwords from the distinct terms is cheaper than filtering every token
+    for word in STOPWORDS.intersection(counts):
+        del counts[word]
+    return counts
+
+
+def term_bucket(term: str, dim: int = TFIDF_DIM) -> int:
+    return zlib.crc32(term.encode("utf-8")) & (dim - 1)
+
+
+def link_text(doc: Dict) -> str:
+    return f"{doc.get('title') or ''} {doc.get('content') or doc.get('summary') or ''}"
+
+
+@dataclass
+class DocTerms:
+    """A document as bucket ids with their terms and counts (aligned arrays)"""
+    terms: List[str]
+    buckets: np.ndarray
+    counts: np.ndarray
+
+    @classmethod
+    def from_text(cls, text: str, dim: int = TFIDF_DIM) -> "DocTerms":
+        counter = term_counts(text)
+        terms = list(counter)
+        return cls(
+            terms=terms,
+            buckets=np.fromiter((term_bucket(t, dim) for t in terms), dtype=np.int64, count=len(terms)),
+            counts=np.fromiter(counter.values(), dtype=np.float32, count=len(terms))
+        )
+
+
+@dataclass
+class TfidfModel:
+    dim: int = TFIDF_DIM
+    n_docs: int = 0
+    df: np.ndarray = None
+    centroids: Optional[sparse.csr_matrix] = None  # k x dim, rows L2-normalized
+    cluster_labels: List[List[str]] = field(default_factory=list)
+    version: int = 0
+
+    def __post_init__(self):
+        if self.df is None:
+            self.df = np.zeros(self.dim, dtype=np.int32)
+
+    def idf(self) -> np.ndarray:
+        # Smoothed idf; never-seen buckets get the highest weight
+        return (np.log((1.0 + self.n_docs) / (1.0 + self.df)) + 1.0).astype(np.float32)
+
+    def add(self, docs: Sequence[DocTerms]):
+        """Count the documents into the document frequencies"""
+        if docs:
+            present = np.concatenate([np.unique(doc.buckets) for doc in docs])
+            self.df += np.bincount(present, minlength=self.dim).astype(np.int32)
+        self.n_docs += len(docs)
+
+    def counts(self, docs: Sequence[DocTerms]) -> sparse.csr_matrix:
+        """Raw term counts (len(docs) x dim); hash collisions inside a document are summed"""
+        indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(doc.buckets) for doc in docs])
+        indices = np.concatenate([doc.buckets for doc in docs]) if docs else np.zeros(0, dtype=np.int64)
+        data = np.concatenate([doc.counts for doc in docs]) if docs else np.zeros(0, dtype=np.float32)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(docs), self.dim))
+        matrix.sum_duplicates()
+        return matrix
+
+    def weight(self, counts: sparse.csr_matrix, idf: Optional[np.ndarray] = None) -> sparse.csr_matrix:
+        """Sublinear tf x idf with L2-normalized rows"""
+        idf = self.idf() if idf is None else idf
+        matrix = counts.copy()
+        matrix.data = (1.0 + np.log(matrix.data)) * idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ matrix
+
+    def transform(self, docs: Sequence[DocTerms], idf: Optional[np.ndarray] = None) -> sparse.csr_matrix:
+        """One vectorized TF-IDF matrix (len(docs) x dim) for a batch of documents"""
+        return self.weight(self.counts(docs), idf)
+
+    def keywords(self, docs: Sequence[DocTerms], n: int = KEYWORDS_PER_LINK) -> List[List[str]]:
+        """Top-n terms per document by TF-IDF weight"""
+        idf = self.idf()
+        result = []
+        for doc in docs:
+            if not doc.terms:
+                result.append([])
+                continue
+            weights = (1.0 + np.log(doc.counts)) * idf[doc.buckets]
+            top = np.argsort(-weights, kind="stable")[:n]
+            result.append([doc.terms[i] for i in top])
+        return result
+
+    def assign(self, matrix: sparse.csr_matrix) -> np.ndarray:
+        """Nearest cluster per row (cosine similarity), -1 for empty rows or no clusters"""
+        if self.centroids is None or matrix.shape[0] == 0:
+            return np.full(matrix.shape[0], -1)
+        similarity = (matrix @ self.centroids.T).toarray()
+        labels = similarity.argmax(axis=1)
+        labels[similarity.max(axis=1) <= 0] = -1
+        return labels
+
+    def suggested_tags(self, labels: np.ndarray) -> List[List[str]]:
+        return [self.cluster_labels[label] if label >= 0 else [] for label in labels]
+
+
+def _dense(matrix) -> np.ndarray:
+    return matrix.toarray() if sparse.issparse(matrix) else np.asarray(matrix)
+
+
+def spherical_kmeans(matrix, k: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Cluster L2-normalized rows (sparse or dense) by cosine similarity; returns dense k x dim centroids"""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    k = min(k, n)
+    centroids = _dense(matrix[rng.choice(n, size=k, replace=False)])
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.asarray((matrix @ centroids.T).argmax(axis=1)).ravel()
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        # Sum the rows of each cluster with one sparse product, then renormalize
+        membership = sparse.csr_matrix((np.ones(n), (labels, np.arange(n))), shape=(k, n))
+        sums = _dense(membership @ matrix)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        if empty.any():
+            # Re-seed empty clusters with random documents
+            sums[empty] = _dense(matrix[rng.choice(n, size=int(empty.sum()), replace=False)])
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-12)[:, None]
+    return centroids
+
+
+def sparsify_centroids(centroids: np.ndarray, keep: int = CENTROID_TERMS) -> sparse.csr_matrix:
+    """Keep the strongest weights of each centroid so the model fits in one document"""
+    rows = []
+    for centroid in centroids:
+        top = np.argpartition(-centroid, min(keep, len(centroid) - 1))[:keep]
+        row = np.zeros_like(centroid)
+        row[top] = centroid[top]
+        norm = np.linalg.norm(row)
+        rows.append(sparse.csr_matrix(row / norm if norm else row))
+    return sparse.vstack(rows).tocsr().astype(np.float32)
+
+
+# --- Persistence ---
+
+def _to_binary(array: np.ndarray) -> Binary:
+    return Binary(np.ascontiguousarray(array).tobytes())
+
+
+def _model_document(model: TfidfModel) -> Dict:
+    doc = {
+        "dim": model.dim,
+        "n_docs": model.n_docs,
+        "df": _to_binary(model.df.astype(np.int32)),
+        "cluster_labels": model.cluster_labels,
+        "updated_at": datetime.utcnow()
+    }
+    if model.centroids is not None:
+        doc["centroids"] = {
+            "shape": list(model.centroids.shape),
+            "data": _to_binary(model.centroids.data.astype(np.float32)),
+            "indices": _to_binary(model.centroids.indices.astype(np.int32)),
+            "indptr": _to_binary(model.centroids.indptr.astype(np.int32))
+        }
+    return doc
+
+
+def _model_from_document(doc: Dict) -> TfidfModel:
+    centroids = None
+    if doc.get("centroids"):
+        c = doc["centroids"]
+        centroids = sparse.csr_matrix((
+            np.frombuffer(c["data"], dtype=np.float32),
+            np.frombuffer(c["indices"], dtype=np.int32),
+            np.frombuffer(c["indptr"], dtype=np.int32)
+        ), shape=tuple(c["shape"]))
+    return TfidfModel(
+        dim=doc["dim"],
+        n_docs=doc["n_docs"],
+        df=np.frombuffer(doc["df"], dtype=np.int32).copy(),
+        centroids=centroids,
+        cluster_labels=doc.get("cluster_labels", []),
+        version=doc.get("version", 0)
+    )
+
+
+_model: Optional[TfidfModel] = None
+_pending_df: Optional[np.ndarray] = None  # Document frequencies not yet saved
+_pending_docs = 0
+_flush_task: Optional[asyncio.Task] = None
+_rebuild_task: Optional[asyncio.Task] = None
+_status: Dict = {"running": False}
+
+
+async def load_model() -> Optional[TfidfModel]:
+    """Load the stored model (or start an empty one) for annotating new links"""
+    global _model, _pending_df
+    if not TFIDF_ENABLED:
+        return None
+    doc = await models_collection.find_one({"_id": MODEL_ID})
+    _model = _model_from_document(doc) if doc and doc.get("dim") == TFIDF_DIM else TfidfModel()
+    _pending_df = np.zeros(_model.dim, dtype=np.int32)
+    logger.info(f"Loaded TF-IDF model ({_model.n_docs} documents, {len(_model.cluster_labels)} clusters)")
+    return _model
+
+
+def annotate(metadata: Dict, count: bool = True) -> Dict:
+    """
+    Keywords and cluster tags for a freshly scraped link. New links are also counted into
+    the corpus statistics (count=False for re-scrapes). Returns {} when the model isn't loaded.
+    """
+    global _pending_docs
+    if _model is None or "Error" in metadata.get("tags", []):
+        return {}
+    doc = DocTerms.from_text(link_text(metadata), _model.dim)
+    if not doc.terms:
+        return {}
+    if count:
+        buckets = np.unique(doc.buckets)
+        _model.df[buckets] += 1
+        _model.n_docs += 1
+        _pending_df[buckets] += 1
+        _pending_docs += 1
+    labels = _model.assign(_model.transform([doc]))
+    return {"keywords": _model.keywords([doc])[0], "suggested_tags": _model.suggested_tags(labels)[0]}
+
+
+async def flush_model():
+    """Add this process's new document frequencies to the stored model"""
+    global _pending_docs
+    if _model is None or not _pending_docs:
+        return
+    delta, docs = _pending_df.copy(), _pending_docs
+    _pending_df[:] = 0
+    _pending_docs = 0
+    for _ in range(5):
+        stored = await models_collection.find_one({"_id": MODEL_ID})
+        if stored is None:
+            result = await models_collection.update_one(
+                {"_id": MODEL_ID},
+                {"$setOnInsert": {**_model_document(TfidfModel(df=delta, n_docs=docs)), "version": 1}},
+                upsert=True
+            )
+            if result.upserted_id is not None:
+                return
+            continue
+        merged = _model_from_document(stored)
+        merged.df += delta
+        merged.n_docs += docs
+        update = _model_document(merged)
+        # Only apply on top of the version we read; another worker may have saved meanwhile
+        result = await models_collection.update_one(
+            {"_id": MODEL_ID, "version": stored.get("version", 0)},
+            {"$set": {**update, "version": stored.get("version", 0) + 1}}
+        )
+        if result.modified_count:
+            return
+    logger.warning("Could not save TF-IDF statistics (concurrent updates); will retry")
+    _pending_df[:] += delta
+    _pending_docs += docs
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(TFIDF_FLUSH_INTERVAL)
+        try:
+            await flush_model()
+        except Exception as e:
+            logger.error(f"❌ Saving TF-IDF statistics failed: {e}")
+
+
+async def start_tfidf():
+    """Load the model and periodically save new statistics (call from the app lifespan)"""
+    global _flush_task
+    if await load_model() is not None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_tfidf():
+    global _flush_task
+    if _rebuild_task is not None and not _rebuild_task.done():
+        _rebuild_task.cancel()
+        await asyncio.gather(_rebuild_task, return_exceptions=True)
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+        _flush_task = None
+    await flush_model()
+
+
+# --- Rebuild job ---
+
+async def iter_batches(batch_size: int, projection: Dict):
+    """Links in _id order, batch by batch (keyset pagination)"""
+    query = {"tags": {"$ne": "Error"}}
+    last_id = None
+    while True:
+        batch_query = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            return
+        last_id = docs[-1]["_id"]
+        yield docs
+
+
+def _bucket_terms(term_df: Counter, buckets: set, dim: int) -> Dict[int, str]:
+    """The most common term behind each of the given hash buckets"""
+    names: Dict[int, str] = {}
+    for term, _ in term_df.most_common():
+        bucket = term_bucket(term, dim)
+        if bucket in buckets and bucket not in names:
+            names[bucket] = term
+    return names
+
+
+async def rebuild(clusters: int = TFIDF_CLUSTERS, batch_size: int = TFIDF_BATCH_SIZE) -> Dict:
+    """
+    Recompute document frequencies over the whole library, fit clusters, then write
+    keywords/suggested_tags to every link. Documents are scored batch_size at a time.
+    """
+    global _model, _pending_docs
+    projection = {"title": 1, "content": 1, "summary": 1}
+    model = TfidfModel()
+    term_df = Counter()  # Document frequency per term, to name the cluster centroids' buckets
+    sample: List[sparse.csr_matrix] = []
+    _status.update(
+        running=True, phase="statistics", documents=0, clusters=0, annotated=0, error=None,
+        started_at=datetime.utcnow(), finished_at=None
+    )
+
+    def analyze(docs: List[Dict]) -> List[DocTerms]:
+        return [DocTerms.from_text(link_text(doc), model.dim) for doc in docs]
+
+    try:
+        # Pass 1: document frequencies; the first TFIDF_FIT_SAMPLE links keep their counts for clustering
+        async for docs in iter_batches(batch_size, projection):
+            terms = await asyncio.to_thread(analyze, docs)
+            model.add(terms)
+            for doc in terms:
+                term_df.update(doc.terms)
+            if model.n_docs - len(docs) < TFIDF_FIT_SAMPLE:
+                sample.append(model.counts(terms))
+            _status["documents"] = model.n_docs
+        logger.info(f"📊 TF-IDF statistics over {model.n_docs} links")
+
+        # Pass 2: spherical k-means on the sample's TF-IDF matrix
+        _status["phase"] = "clustering"
+        if model.n_docs >= 2 and clusters > 1:
+            matrix = model.weight(sparse.vstack(sample).tocsr())
+            sample.clear()
+            centroids = await asyncio.to_thread(spherical_kmeans, matrix, clusters)
+            model.centroids = sparsify_centroids(centroids)
+            tops = [[b for b in np.argsort(-centroid)[:LABEL_TERMS].tolist() if centroid[b] > 0] for centroid in centroids]
+            names = await asyncio.to_thread(_bucket_terms, term_df, {b for top in tops for b in top}, model.dim)
+            model.cluster_labels = [[names[b] for b in top if b in names] for top in tops]
+            _status["clusters"] = len(model.cluster_labels)
+            logger.info(f"📊 Fitted {len(model.cluster_labels)} clusters: {model.cluster_labels}")
+
+        stored = await models_collection.find_one({"_id": MODEL_ID}, {"version": 1})
+        model.version = (stored or {}).get("version", 0) + 1
+        await models_collection.replace_one({"_id": MODEL_ID}, {**_model_document(model), "version": model.version}, upsert=True)
+        if _model is not None:
+            # New links from now on are scored (and counted) against the rebuilt model
+            _model = model
+            _pending_df[:] = 0
+            _pending_docs = 0
+
+        # Pass 3: annotate every link, one vectorized scoring call and one bulk_write per batch
+        _status["phase"] = "annotating"
+
+        def score(docs: List[Dict]):
+            terms = analyze(docs)
+            labels = model.assign(model.transform(terms))
+            return model.keywords(terms), model.suggested_tags(labels)
+
+        async for docs in iter_batches(batch_size, projection):
+            keywords, suggested = await asyncio.to_thread(score, docs)
+            await collection.bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"keywords": k, "suggested_tags": t}})
+                for doc, k, t in zip(docs, keywords, suggested)
+            ], ordered=False)
+            _status["annotated"] += len(docs)
+            logger.info(f"📊 Annotated {_status['annotated']} links")
+    except Exception as e:
+        _status["error"] = str(e)
+        raise
+    finally:
+        _status.update(running=False, phase=None, finished_at=datetime.utcnow())
+    return dict(_status)
+
+
+def rebuild_status() -> Dict:
+    return dict(_status)
+
+
+def start_rebuild() -> bool:
+    """Run rebuild in the background; False if a run is already in progress"""
+    global _rebuild_task
+    if _rebuild_task is not None and not _rebuild_task.done():
+        return False
+
+    async def run():
+        try:
+            await rebuild()
+        except Exception as e:
+            logger.error(f"TF-IDF rebuild failed: {e}", exc_info=True)
+
+    _rebuild_task = asyncio.create_task(run())
+    return True
+
+
+async def main(args):
+    try:
+        result = await rebuild(clusters=args.clusters, batch_size=args.batch_size)
+        elapsed = (result["finished_at"] - result["started_at"]).total_seconds()
+        print(f"✅ Annotated {result['annotated']} links with {result['clusters']} clusters in {elapsed:.1f}s")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Rebuild TF-IDF statistics and clusters, and annotate every link")
+    parser.add_argument("--clusters", type=int, default=TFIDF_CLUSTERS, help="Number of topic clusters")
+    parser.add_argument("--batch-size", type=int, default=TFIDF_BATCH_SIZE, help="Links scored per vectorized batch")
+    asyncio.run(main(parser.parse_args()))
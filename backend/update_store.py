@@ -0,0 +1,63 @@
+"""
+Idempotency store for Telegram webhook deliveries
+Telegram redelivers an update when our endpoint answers slowly. Each update_id is
+claimed once: recent IDs are answered from a bounded in-memory map, and the claim is
+mirrored to MongoDB (TTL-indexed) so redeliveries to other workers are caught too.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+from pymongo.errors import DuplicateKeyError
+from database import updates_collection, TELEGRAM_UPDATE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_UPDATE_CACHE_SIZE = int(os.getenv("TELEGRAM_UPDATE_CACHE_SIZE", "10000"))
+
+# update_id -> expiry timestamp; insertion order == expiry order since the TTL is fixed
+_seen: "OrderedDict[int, float]" = OrderedDict()
+
+
+def _expire(now: float):
+    while _seen:
+        update_id, expires_at = next(iter(_seen.items()))
+        if expires_at > now and len(_seen) <= TELEGRAM_UPDATE_CACHE_SIZE:
+            break
+        _seen.popitem(last=False)
+
+
+def _remember(update_id: int):
+    now = time.monotonic()
+    _seen[update_id] = now + TELEGRAM_UPDATE_TTL_SECONDS
+    _seen.move_to_end(update_id)
+    _expire(now)
+
+
+def seen_recently(update_id: int) -> bool:
+    _expire(time.monotonic())
+    return update_id in _seen
+
+
+async def claim_update(update_id: Optional[int]) -> bool:
+    """
+    Return True if this update has not been handled yet (and mark it as handled).
+    Fails open: if MongoDB is unreachable the update is processed rather than dropped.
+    """
+    if update_id is None:
+        return True
+    if seen_recently(update_id):
+        return False
+
+    try:
+        await updates_collection.insert_one({"_id": update_id, "created_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        _remember(update_id)
+        return False
+    except Exception as e:
+        logger.warning(f"Could not record Telegram update {update_id}: {e}")
+
+    _remember(update_id)
+    return True
@@ -0,0 +1,85 @@
+"""
+URL helpers shared by the webhook, ingestion and the fetch cache
+canonicalize_url() maps trivially different spellings of the same link
+(tracking parameters, www., fragments, trailing slashes, youtu.be, ...)
+to one key that is stored as `canonical_url` and used for deduplication.
+"""
+import re
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+URL_PATTERN = re.compile(r'https?://\S+')
+
+# Query parameters that only carry tracking/attribution information
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "_hsenc", "_hsmi", "ref_src", "ref_url", "spm", "si"
+}
+TRACKING_PREFIXES = ("utm_",)
+
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+
+
+def find_urls(text: str) -> List[str]:
+    """Find http(s) URLs in a message, stripping trailing punctuation"""
+    return [url.rstrip('.,;:!?') for url in URL_PATTERN.findall(text or "")]
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def _youtube_video_id(host: str, path: str, query: List[tuple]) -> str:
+    """Return the video ID for youtu.be / watch / shorts / embed links, or ''"""
+    if host == "youtu.be":
+        return path.strip("/").split("/")[0]
+    if host in YOUTUBE_HOSTS:
+        if path.rstrip("/") == "/watch":
+            return dict(query).get("v", "")
+        for prefix in ("/shorts/", "/embed/", "/live/", "/v/"):
+            if path.startswith(prefix):
+                return path[len(prefix):].strip("/").split("/")[0]
+    return ""
+
+
+def youtube_video_id(url: str) -> str:
+    """Return the YouTube video ID of a link, or '' if it isn't a video link"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return _youtube_video_id(host, parts.path or "/", parse_qsl(parts.query))
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL into a deduplication key:
+    - https scheme, so http:// and https:// spellings are one link (sites serving different
+      pages on the two are vanishingly rare; the stored `url` keeps the scheme it was shared with)
+    - lowercase host without www. and default ports
+    - no fragment, no tracking parameters, remaining parameters sorted
+    - no trailing slash (except for the root path)
+    - YouTube short/embed/mobile links mapped to youtube.com/watch?v=ID
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port if parts.port not in (None, 80, 443) else None
+    except ValueError:
+        port = None
+    netloc = f"{host}:{port}" if port else host
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking_param(k)]
+    path = parts.path or "/"
+
+    video_id = _youtube_video_id(host, path, query)
+    if video_id:
+        return f"https://youtube.com/watch?v={video_id}"
+
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    return urlunsplit(("https", netloc, path, urlencode(sorted(query)), ""))
@@ -240,9 +240,9 @@ export const RetroLinkCard = ({
                     {url}
                   </a>
                 ))}
-                {link.nested_links.length > 3 && (
+                {(link.nested_links_count ?? link.nested_links.length) > 3 && (
                   <p className="text-xs text-muted-foreground">
-                    +{link.nested_links.length - 3} more
+                    +{(link.nested_links_count ?? link.nested_links.length) - 3} more
                   </p>
                 )}
               </div>
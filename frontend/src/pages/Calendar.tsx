@@ -22,7 +22,7 @@ const CalendarPage = () => {
     const loadScheduled = async () => {
       setLoading(true);
       try {
-        const res = await (await import("@/lib/api")).getLinks({ is_scheduled: true, limit: 1000 });
+        const res = await (await import("@/lib/api")).getLinks({ is_scheduled: true, limit: 1000, view: "calendar" });
         console.log("📅 Calendar - Fetched scheduled links:", res.links?.length || 0);
         console.log("📅 Links with scheduled_at:", res.links?.filter(l => l.scheduled_at).length || 0);
         setLinks(res.links || []);
@@ -3,7 +3,7 @@ export interface Link {
   url: string;
   title: string;
   summary?: string;
-  content?: string;
+  content?: string;  // Only returned by GET /api/links/{id}
   tags: string[];
   source: string;
   domain?: string;
@@ -13,7 +13,11 @@ export interface Link {
   video_url?: string;
   is_read: boolean;
   is_favorite: boolean;
-  nested_links?: string[];
+  nested_links?: string[];  // Only the first few in list responses
+  nested_links_count?: number;  // Length of the full nested_links list
+  snippet?: string;  // Highlighted search match (<mark>), only with the bm25 search backend
+  duplicate_of?: string | null;  // Id of the earliest link with near-identical text
+  similarity?: number;  // Cosine similarity, on related links and semantic search results
   scheduled_at?: string;
   created_at: string;
   updated_at: string;
@@ -21,9 +25,10 @@ export interface Link {
 
 export interface LinksResponse {
   links: Link[];
-  total: number;
+  total: number | null;  // null when requested with include_total=false
   skip: number;
   limit: number;
+  next_cursor?: string | null;  // Pass as `cursor` for the next page, null on the last page
 }
 
 export interface Stats {